@@ -0,0 +1,71 @@
+"""Micro-benchmark of expiry email rendering.
+
+Run from the backend directory:
+
+    python bench_email_templates.py [messages] [recipients_per_service]
+
+Compares rendering every message from scratch with rendering the
+service-invariant body once per (service, threshold) and substituting only
+the greeting per recipient, and reports the size saved by minification.
+"""
+import os
+import sys
+import time
+
+# server.py reads these at import time; no connection is made
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+
+from server import (
+    EXPIRY_EMAIL_TEMPLATE,
+    compile_template,
+    escape_html,
+    get_email_html_template,
+    get_expiry_email_values,
+    render_expiry_email,
+)
+
+def make_service(i: int) -> dict:
+    return {
+        "id": str(i),
+        "name": f"Service {i}",
+        "provider": "Microsoft",
+        "category_name": "Software License",
+        "expiry_date": "2026-12-31T00:00:00+00:00",
+        "owners": [{"name": f"Owner {n}", "role": "Owner"} for n in range(4)]
+    }
+
+def bench(label: str, fn, messages: int):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed * 1000:9.1f} ms total  {elapsed * 1000 * 10000 / messages:9.1f} ms per 10k messages")
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    per_service = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    services = [make_service(i) for i in range(max(1, messages // per_service))]
+    names = [f"Recipient {n}" for n in range(per_service)]
+
+    def per_message():
+        for service in services:
+            for name in names:
+                get_email_html_template(service, name, 7, "Second reminder", "Acme")
+
+    def per_service_body():
+        for service in services:
+            body = render_expiry_email(service, 7, "Second reminder", "Acme")
+            for name in names:
+                body.render({"recipient_name": escape_html(name)})
+
+    print(f"{len(services) * len(names)} messages, {len(names)} recipients per service\n")
+    bench("full render per message", per_message, messages)
+    bench("body per service + greeting", per_service_body, messages)
+
+    values = {**get_expiry_email_values(services[0], 7, "Second reminder", "Acme"), "recipient_name": "Recipient"}
+    original = len(compile_template(EXPIRY_EMAIL_TEMPLATE, minify=False).render(values).encode())
+    minified = len(compile_template(EXPIRY_EMAIL_TEMPLATE).render(values).encode())
+    print(f"\nmessage size: {original} bytes unminified, {minified} bytes minified ({100 - minified * 100 // original}% smaller)")
+
+if __name__ == "__main__":
+    main()
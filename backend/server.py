@@ -1,24 +1,40 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, BackgroundTasks
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, BackgroundTasks, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import InsertOne, MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.jobstores.mongodb import MongoDBJobStore
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 import aiosmtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import os
 import logging
+import random
 import asyncio
+import functools
+import hashlib
+import html
+import re
+import string
+import time
+import contextlib
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr, ConfigDict
-from typing import List, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 import uuid
+import json
+from collections import OrderedDict, deque
 from datetime import datetime, timezone, timedelta
 import jwt
 import bcrypt
-import resend
+import httpx
+import numpy as np
+import pandas as pd
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -28,8 +44,16 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
-# Resend configuration
-resend.api_key = os.environ.get('RESEND_API_KEY', '')
+# Resend configuration (the API key in settings takes precedence)
+RESEND_API_KEY = os.environ.get('RESEND_API_KEY', '')
+# Point at a local stand-in server for testing
+RESEND_API_BASE_URL = os.environ.get('RESEND_API_BASE_URL', 'https://api.resend.com')
+RESEND_TIMEOUT_SECONDS = float(os.environ.get('RESEND_TIMEOUT_SECONDS', '10'))
+RESEND_MAX_RETRIES = int(os.environ.get('RESEND_MAX_RETRIES', '2'))
+# Per-message limits for every provider: connecting to the server, and the
+# whole send including retries (keep it below OUTBOX_LEASE_SECONDS)
+EMAIL_CONNECT_TIMEOUT_SECONDS = float(os.environ.get('EMAIL_CONNECT_TIMEOUT_SECONDS', '10'))
+EMAIL_SEND_TIMEOUT_SECONDS = float(os.environ.get('EMAIL_SEND_TIMEOUT_SECONDS', '60'))
 SENDER_EMAIL = os.environ.get('SENDER_EMAIL', 'onboarding@resend.dev')
 
 # JWT configuration
@@ -112,6 +136,22 @@ class CategoryUpdate(BaseModel):
     color: Optional[str] = None
     icon: Optional[str] = None
 
+class EmailProviderConfig(BaseModel):
+    """A fallback email provider; unset sender fields are taken from the primary"""
+    model_config = ConfigDict(extra="ignore")
+    name: str = ""
+    email_provider: str = "smtp"
+    resend_api_key: str = ""
+    sender_email: Optional[str] = None
+    sender_name: Optional[str] = None
+    smtp_host: str = ""
+    smtp_port: int = 587
+    smtp_username: str = ""
+    smtp_password: str = ""
+    smtp_use_tls: bool = True
+    email_rate_limit_per_second: float = 0
+    email_daily_limit: int = 0
+
 class AppSettings(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = "app_settings"
@@ -126,6 +166,13 @@ class AppSettings(BaseModel):
     smtp_username: str = ""
     smtp_password: str = ""
     smtp_use_tls: bool = True
+    # Providers tried in order when the primary is unavailable
+    email_fallback_providers: List[EmailProviderConfig] = []
+    # Send one consolidated email per recipient per expiry check
+    notification_digest: bool = False
+    # Sending limits for the active provider (0 = provider default)
+    email_rate_limit_per_second: float = 0
+    email_daily_limit: int = 0
     # General Settings
     company_name: str = "Your Organization"
     notification_thresholds: List[int] = [30, 7, 1]
@@ -197,6 +244,7 @@ class Service(BaseModel):
     cost: float = 0.0
     status: str = "active"
     notifications_sent: List[str] = []  # Changed to store threshold IDs instead of days
+    next_notification_at: Optional[datetime] = None  # When the next unsent threshold becomes due
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
     updated_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
@@ -211,7 +259,7 @@ class NotificationLog(BaseModel):
     days_until_expiry: int
     recipients: List[dict] = []  # [{email, name, status}]
     sent_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
-    status: str = "sent"  # sent, partial, failed
+    status: str = "sent"  # pending, sent, partial, failed
 
 class EmailLog(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -225,6 +273,52 @@ class EmailLog(BaseModel):
     days_until_expiry: int
     sent_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
     status: str = "sent"  # sent, failed, pending
+    provider_message_id: Optional[str] = None
+    error: Optional[str] = None
+
+class OutboxJob(BaseModel):
+    """A rendered email waiting in the outbox for delivery by a worker"""
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    status: str = "pending"  # pending, sending, sent, dead
+    to_email: str
+    to_name: str = ""
+    subject: str
+    html: str
+    service_id: str
+    service_name: str
+    threshold_id: str = ""
+    threshold_label: str = ""
+    days_until_expiry: int
+    notification_log_id: str = ""
+    # Digest emails cover several (service, threshold) pairs:
+    # [{service_id, service_name, threshold_id, threshold_label, days_until_expiry, notification_log_id}]
+    digest_items: List[dict] = []
+    # One send per (service, threshold, recipient, expiry); enforced by a unique index
+    idempotency_key: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    attempts: int = 0
+    last_error: str = ""
+    available_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    lease_owner: Optional[str] = None
+    lease_expires_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+    created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+
+class EmailTemplate(BaseModel):
+    """One saved version of a custom reminder template for a threshold label"""
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    label: str
+    label_key: str  # Normalized label used for lookups; "*" applies to all labels
+    version: int
+    subject: str
+    html: str
+    created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    created_by: str = ""
+
+class EmailTemplateUpdate(BaseModel):
+    subject: str
+    html: str
 
 # ==================== AUTH HELPERS ====================
 
@@ -270,6 +364,367 @@ async def get_app_settings():
         return default_settings.model_dump()
     return settings
 
+# ==================== REQUEST COALESCING ====================
+
+class SingleFlight:
+    """Share one in-flight computation between concurrent callers with the same key.
+    
+    The computation runs as its own task, so a caller disconnecting does not
+    cancel it for the others.
+    """
+    
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._metrics: Dict[str, Dict[str, int]] = {}
+    
+    async def do(self, route: str, params: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        key = f"{route}?{params}"
+        metrics = self._metrics.setdefault(route, {"calls": 0, "executions": 0, "coalesced": 0})
+        metrics["calls"] += 1
+        
+        task = self._inflight.get(key)
+        if task is None:
+            metrics["executions"] += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            metrics["coalesced"] += 1
+        
+        return await asyncio.shield(task)
+    
+    def _finish(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved even if every caller went away
+        if not task.cancelled():
+            task.exception()
+    
+    def snapshot(self) -> dict:
+        return {
+            "in_flight": len(self._inflight),
+            "routes": {route: dict(m) for route, m in self._metrics.items()}
+        }
+
+single_flight = SingleFlight()
+
+# ==================== QUERY CACHE ====================
+
+# Memory budget for the in-process service query cache
+SERVICE_CACHE_MAX_BYTES = int(os.environ.get('SERVICE_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+# Optional Redis (or Redis-compatible) URL to share the cache between replicas
+SERVICE_CACHE_REDIS_URL = os.environ.get('SERVICE_CACHE_REDIS_URL', '')
+SERVICE_CACHE_TTL_SECONDS = int(os.environ.get('SERVICE_CACHE_TTL_SECONDS', '300'))
+# How long a process trusts its copy of the cache generation before re-reading
+# it from MongoDB, i.e. how stale a write made in another process can be
+SERVICE_CACHE_GENERATION_TTL_SECONDS = float(os.environ.get('SERVICE_CACHE_GENERATION_TTL_SECONDS', '1'))
+
+class MemoryCacheBackend:
+    """Per-process LRU cache bounded by the approximate JSON size of its entries.
+    
+    The generation is a counter document in MongoDB, so a write in any process
+    (another uvicorn worker, replica or the separate worker) invalidates the
+    entries held by all of them. A process re-reads it at most once every
+    SERVICE_CACHE_GENERATION_TTL_SECONDS and sees its own writes at once.
+    """
+    
+    GENERATION_ID = "service_cache"
+    
+    def __init__(self, max_bytes: int, generation_ttl_seconds: float = 0):
+        self.max_bytes = max_bytes
+        self.generation_ttl_seconds = generation_ttl_seconds
+        self.generation = 0
+        self._generation_read_at: Optional[float] = None
+        self._generation_lock = asyncio.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self.evictions = 0
+    
+    def _generation_is_fresh(self) -> bool:
+        return (
+            self._generation_read_at is not None
+            and time.monotonic() - self._generation_read_at < self.generation_ttl_seconds
+        )
+    
+    def _set_generation(self, generation: int):
+        self._generation_read_at = time.monotonic()
+        # A read that started before a local bump must not roll it back
+        if generation > self.generation:
+            # Entries of older generations can never be read again
+            self.generation = generation
+            self._entries.clear()
+            self._bytes = 0
+    
+    async def get_generation(self) -> int:
+        if self._generation_is_fresh():
+            return self.generation
+        async with self._generation_lock:
+            # Concurrent lookups share one read
+            if not self._generation_is_fresh():
+                doc = await db.cache_generations.find_one({"_id": self.GENERATION_ID})
+                self._set_generation(doc["generation"] if doc else 0)
+        return self.generation
+    
+    async def bump_generation(self) -> int:
+        doc = await db.cache_generations.find_one_and_update(
+            {"_id": self.GENERATION_ID},
+            {"$inc": {"generation": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self._set_generation(doc["generation"])
+        return self.generation
+    
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+    
+    async def set(self, key: str, value: Any):
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[1]
+        self._entries[key] = (value, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+    
+    def snapshot(self) -> dict:
+        return {
+            "backend": "memory",
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions
+        }
+
+class RedisCacheBackend:
+    """Cache shared between replicas through Redis; the generation is a Redis counter"""
+    
+    GENERATION_KEY = "service_cache:generation"
+    
+    def __init__(self, url: str, ttl_seconds: int):
+        import redis.asyncio as redis
+        self._redis = redis.from_url(url)
+        self.ttl_seconds = ttl_seconds
+    
+    async def get_generation(self) -> int:
+        return int(await self._redis.get(self.GENERATION_KEY) or 0)
+    
+    async def bump_generation(self) -> int:
+        return await self._redis.incr(self.GENERATION_KEY)
+    
+    async def get(self, key: str) -> Optional[Any]:
+        raw = await self._redis.get(f"service_cache:{key}")
+        return json.loads(raw) if raw is not None else None
+    
+    async def set(self, key: str, value: Any):
+        await self._redis.set(f"service_cache:{key}", json.dumps(value, default=str), ex=self.ttl_seconds)
+    
+    def snapshot(self) -> dict:
+        return {"backend": "redis", "ttl_seconds": self.ttl_seconds}
+
+class QueryCache:
+    """Read-through cache whose keys embed a generation counter bumped on every write"""
+    
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+    
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            generation = await self.backend.get_generation()
+            versioned_key = f"{generation}:{key}"
+            value = await self.backend.get(versioned_key)
+        except Exception as e:
+            logger.error(f"Query cache read failed: {str(e)}")
+            return await loader()
+        
+        if value is not None:
+            self.hits += 1
+            return value
+        
+        self.misses += 1
+        value = await loader()
+        if value is not None:
+            try:
+                await self.backend.set(versioned_key, value)
+            except Exception as e:
+                logger.error(f"Query cache write failed: {str(e)}")
+        return value
+    
+    async def invalidate(self):
+        try:
+            await self.backend.bump_generation()
+        except Exception as e:
+            logger.error(f"Query cache invalidation failed: {str(e)}")
+    
+    def snapshot(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, **self.backend.snapshot()}
+
+def create_cache_backend():
+    if SERVICE_CACHE_REDIS_URL:
+        try:
+            return RedisCacheBackend(SERVICE_CACHE_REDIS_URL, SERVICE_CACHE_TTL_SECONDS)
+        except ImportError:
+            logger.warning("SERVICE_CACHE_REDIS_URL is set but the redis package is not installed; using in-memory cache")
+    return MemoryCacheBackend(SERVICE_CACHE_MAX_BYTES, SERVICE_CACHE_GENERATION_TTL_SECONDS)
+
+service_cache = QueryCache(create_cache_backend())
+
+# ==================== BUFFERED WRITES ====================
+
+# Log and notification state writes are buffered and applied in bulk once
+# this many are pending, or this many seconds after the first one
+WRITE_BUFFER_MAX_BATCH = int(os.environ.get('WRITE_BUFFER_MAX_BATCH', '500'))
+WRITE_BUFFER_FLUSH_SECONDS = float(os.environ.get('WRITE_BUFFER_FLUSH_SECONDS', '1'))
+# Flushes a buffered write is retried for before it is dropped
+WRITE_BUFFER_MAX_RETRIES = 5
+
+class BulkWriter:
+    """Buffers writes to one collection and applies them with bulk_write.
+    
+    Writes are flushed once `max_batch` are pending, `flush_seconds` after
+    the first pending one was added, and on flush() (end of an expiry check,
+    shutdown). An update added with a `retry_id` that matches no document,
+    because the insert of that document is still buffered (possibly in
+    another process), is retried on the following flushes. A write the
+    database rejects is dropped; for an ordered writer, the writes after it
+    are kept for the next flush.
+    """
+    
+    def __init__(self, collection: str, max_batch: int, flush_seconds: float, ordered: bool = False,
+                 on_flush: Optional[Callable[[], Awaitable[Any]]] = None):
+        self.collection = collection
+        self.max_batch = max(1, max_batch)
+        self.flush_seconds = flush_seconds
+        # Ordered when later writes to a document must not overtake earlier ones
+        self.ordered = ordered
+        self.on_flush = on_flush
+        # (operation, retry_id, attempts)
+        self._pending: List[tuple] = []
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.writes = 0
+        self.retried = 0
+        self.dropped = 0
+    
+    async def add(self, operation, retry_id: Optional[str] = None):
+        await self.extend([operation], retry_id)
+    
+    async def extend(self, operations: list, retry_id: Optional[str] = None):
+        self._pending.extend((operation, retry_id, 0) for operation in operations)
+        if len(self._pending) >= self.max_batch:
+            await self.flush()
+        elif self._pending and (self._timer is None or self._timer.done()):
+            self._timer = asyncio.ensure_future(self._flush_later())
+    
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_seconds)
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Flushing buffered {self.collection} writes failed: {str(e)}")
+    
+    async def flush(self):
+        async with self._lock:
+            if not self._pending:
+                return
+            retry = []
+            while self._pending:
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+                retry.extend(await self._write(batch))
+            # Retries go out with the next flush rather than looping here
+            self._pending[:0] = retry
+            if self._pending and (self._timer is None or self._timer.done() or self._timer is asyncio.current_task()):
+                self._timer = asyncio.ensure_future(self._flush_later())
+            if self.on_flush:
+                await self.on_flush()
+    
+    def _requeue(self, items: List[tuple], reason: str) -> List[tuple]:
+        retry = [(operation, retry_id, attempts + 1) for operation, retry_id, attempts in items if attempts + 1 < WRITE_BUFFER_MAX_RETRIES]
+        if len(retry) < len(items):
+            self.dropped += len(items) - len(retry)
+            logger.error(f"Dropped {len(items) - len(retry)} buffered {self.collection} write(s): {reason}")
+        self.retried += len(retry)
+        return retry
+    
+    async def _write(self, batch: List[tuple]) -> List[tuple]:
+        """Apply one batch; returns the writes to retry"""
+        collection = db[self.collection]
+        self.flushes += 1
+        try:
+            result = await collection.bulk_write([operation for operation, _, _ in batch], ordered=self.ordered)
+        except BulkWriteError as e:
+            # Rejected writes (e.g. duplicate inserts) would fail again
+            errors = e.details.get("writeErrors", [])
+            self.writes += e.details.get("nInserted", 0) + e.details.get("nMatched", 0) + e.details.get("nUpserted", 0)
+            self.dropped += len(errors)
+            logger.error(f"{len(errors)} buffered {self.collection} write(s) rejected: {errors[0].get('errmsg') if errors else e}")
+            if self.ordered and errors:
+                # An ordered bulk write stops at the first error; the writes
+                # after it were never attempted and go out with the next flush
+                return batch[errors[0]["index"] + 1:]
+            return []
+        except Exception as e:
+            return self._requeue(batch, str(e))
+        
+        self.writes += len(batch)
+        updates = sum(1 for operation, _, _ in batch if isinstance(operation, UpdateOne))
+        keyed = [item for item in batch if item[1] is not None]
+        if not keyed or result.matched_count >= updates:
+            return []
+        existing = set(await collection.distinct("id", {"id": {"$in": list({item[1] for item in keyed})}}))
+        missing = [item for item in keyed if item[1] not in existing]
+        self.writes -= len(missing)
+        return self._requeue(missing, "document not found")
+    
+    async def close(self):
+        if self._timer:
+            self._timer.cancel()
+        await self.flush()
+        if self._timer:
+            self._timer.cancel()
+        if self._pending:
+            logger.warning(f"{len(self._pending)} buffered {self.collection} write(s) not applied at shutdown")
+    
+    def snapshot(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "writes": self.writes,
+            "retried": self.retried,
+            "dropped": self.dropped
+        }
+
+email_log_writer = BulkWriter("email_logs", WRITE_BUFFER_MAX_BATCH, WRITE_BUFFER_FLUSH_SECONDS)
+notification_log_writer = BulkWriter("notification_logs", WRITE_BUFFER_MAX_BATCH, WRITE_BUFFER_FLUSH_SECONDS)
+# Threshold bookkeeping; the query cache is invalidated once per flush
+service_state_writer = BulkWriter(
+    "services", WRITE_BUFFER_MAX_BATCH, WRITE_BUFFER_FLUSH_SECONDS, ordered=True, on_flush=service_cache.invalidate
+)
+write_buffers = [email_log_writer, notification_log_writer, service_state_writer]
+
+async def flush_write_buffers():
+    for writer in write_buffers:
+        await writer.flush()
+
+async def close_write_buffers():
+    for writer in write_buffers:
+        try:
+            await writer.close()
+        except Exception as e:
+            logger.error(f"Flushing buffered {writer.collection} writes on shutdown failed: {str(e)}")
+
 # ==================== AUTH ROUTES ====================
 
 @api_router.post("/auth/register")
@@ -336,8 +791,6 @@ async def update_settings(
     
     if resend_api_key is not None:
         update_data["resend_api_key"] = resend_api_key
-        # Update resend API key in memory
-        resend.api_key = resend_api_key
         
     if sender_email is not None:
         update_data["sender_email"] = sender_email
@@ -368,6 +821,10 @@ class SettingsUpdate(BaseModel):
     smtp_username: Optional[str] = None
     smtp_password: Optional[str] = None
     smtp_use_tls: Optional[bool] = None
+    email_fallback_providers: Optional[List[EmailProviderConfig]] = None
+    email_rate_limit_per_second: Optional[float] = None
+    email_daily_limit: Optional[int] = None
+    notification_digest: Optional[bool] = None
     # General
     company_name: Optional[str] = None
     notification_thresholds: Optional[List[int]] = None
@@ -394,7 +851,6 @@ async def update_settings_json(
         update_data["email_provider"] = settings_data.email_provider
     if settings_data.resend_api_key is not None:
         update_data["resend_api_key"] = settings_data.resend_api_key
-        resend.api_key = settings_data.resend_api_key
     if settings_data.sender_email is not None:
         update_data["sender_email"] = settings_data.sender_email
     if settings_data.sender_name is not None:
@@ -411,6 +867,26 @@ async def update_settings_json(
         update_data["smtp_password"] = settings_data.smtp_password
     if settings_data.smtp_use_tls is not None:
         update_data["smtp_use_tls"] = settings_data.smtp_use_tls
+    if settings_data.email_fallback_providers is not None:
+        names = set()
+        for index, fallback in enumerate(settings_data.email_fallback_providers, start=1):
+            if fallback.email_provider not in EMAIL_PROVIDERS:
+                raise HTTPException(status_code=400, detail=f"Unknown email provider: {fallback.email_provider}")
+            name = get_fallback_provider_id(fallback.model_dump(), index)
+            if name in names:
+                raise HTTPException(status_code=400, detail=f"Duplicate email provider name: {name}")
+            names.add(name)
+        update_data["email_fallback_providers"] = [fallback.model_dump() for fallback in settings_data.email_fallback_providers]
+    if settings_data.notification_digest is not None:
+        update_data["notification_digest"] = settings_data.notification_digest
+    if settings_data.email_rate_limit_per_second is not None:
+        if settings_data.email_rate_limit_per_second < 0:
+            raise HTTPException(status_code=400, detail="email_rate_limit_per_second cannot be negative")
+        update_data["email_rate_limit_per_second"] = settings_data.email_rate_limit_per_second
+    if settings_data.email_daily_limit is not None:
+        if settings_data.email_daily_limit < 0:
+            raise HTTPException(status_code=400, detail="email_daily_limit cannot be negative")
+        update_data["email_daily_limit"] = settings_data.email_daily_limit
         
     # General settings
     if settings_data.company_name is not None:
@@ -472,12 +948,12 @@ async def test_email_settings(current_user: dict = Depends(get_admin_user)):
     """
     
     try:
-        await send_email_with_provider(
+        await send_with_deadline(settings.get("email_provider", "resend"), lambda: send_email_with_provider(
             to_email=current_user["email"],
             subject=f"[Test] Email Configuration - {settings.get('company_name', 'Service Renewal Hub')}",
             html_content=test_html,
             settings=settings
-        )
+        ))
         return {"message": f"Test email sent to {current_user['email']}"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to send test email: {str(e)}")
@@ -546,8 +1022,15 @@ async def get_categories(current_user: dict = Depends(get_current_user)):
 @api_router.get("/categories/with-services")
 async def get_categories_with_services(current_user: dict = Depends(get_current_user)):
     """Get categories with their services for sidebar navigation"""
+    return await single_flight.do(
+        "categories/with-services",
+        current_user["id"],
+        lambda: load_categories_with_services(current_user["id"])
+    )
+
+async def load_categories_with_services(user_id: str):
     user_categories = await db.categories.find(
-        {"user_id": current_user["id"]}, 
+        {"user_id": user_id}, 
         {"_id": 0}
     ).sort("name", 1).to_list(100)
     
@@ -600,6 +1083,7 @@ async def create_category(category_data: CategoryCreate, current_user: dict = De
         **category_data.model_dump()
     )
     await db.categories.insert_one(category.model_dump())
+    await service_cache.invalidate()
     return category
 
 @api_router.put("/categories/{category_id}")
@@ -621,6 +1105,7 @@ async def update_category(
     
     if update_data:
         await db.categories.update_one({"id": category_id}, {"$set": update_data})
+        await service_cache.invalidate()
     
     updated = await db.categories.find_one({"id": category_id}, {"_id": 0})
     return updated
@@ -640,8 +1125,10 @@ async def delete_category(category_id: str, current_user: dict = Depends(get_cur
         {"category_id": category_id},
         {"$set": {"category_id": None, "category_name": "Uncategorized"}}
     )
+    await invalidate_dashboard_stats()
     
     await db.categories.delete_one({"id": category_id})
+    await service_cache.invalidate()
     return {"message": "Category deleted successfully"}
 
 # ==================== SERVICE ROUTES ====================
@@ -659,11 +1146,17 @@ async def get_services(
         else:
             query["category_id"] = category_id
     
-    services = await db.services.find(query, {"_id": 0}).to_list(1000)
-    return services
+    return await service_cache.get_or_load(
+        f"services:{category_id or ''}",
+        lambda: db.services.find(query, {"_id": 0}).to_list(1000)
+    )
 
 @api_router.post("/services")
-async def create_service(service_data: ServiceCreate, current_user: dict = Depends(get_current_user)):
+async def create_service(
+    service_data: ServiceCreate,
+    background_tasks: BackgroundTasks,
+    current_user: dict = Depends(get_current_user)
+):
     data = service_data.model_dump()
     
     # Handle expiry date from duration
@@ -701,18 +1194,30 @@ async def create_service(service_data: ServiceCreate, current_user: dict = Depen
     data["user_id"] = current_user["id"]
     
     service = Service(**data)
+    service.next_notification_at = compute_next_notification_at(service.model_dump())
     await db.services.insert_one(service.model_dump())
+    await service_cache.invalidate()
+    await update_dashboard_stats(None, service.model_dump())
+    schedule_notification_if_due(background_tasks, service.id, service.next_notification_at)
     return service
 
 @api_router.get("/services/{service_id}")
 async def get_service(service_id: str, current_user: dict = Depends(get_current_user)):
-    service = await db.services.find_one({"id": service_id}, {"_id": 0})
+    service = await service_cache.get_or_load(
+        f"service:{service_id}",
+        lambda: db.services.find_one({"id": service_id}, {"_id": 0})
+    )
     if not service:
         raise HTTPException(status_code=404, detail="Service not found")
     return service
 
 @api_router.put("/services/{service_id}")
-async def update_service(service_id: str, service_data: ServiceUpdate, current_user: dict = Depends(get_current_user)):
+async def update_service(
+    service_id: str,
+    service_data: ServiceUpdate,
+    background_tasks: BackgroundTasks,
+    current_user: dict = Depends(get_current_user)
+):
     existing = await db.services.find_one({"id": service_id}, {"_id": 0})
     if not existing:
         raise HTTPException(status_code=404, detail="Service not found")
@@ -745,19 +1250,26 @@ async def update_service(service_id: str, service_data: ServiceUpdate, current_u
     
     update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
     
-    # Reset notifications if thresholds changed
-    if "reminder_thresholds" in update_data:
+    # Reset notifications if thresholds changed or the service was renewed
+    if "reminder_thresholds" in update_data or update_data.get("expiry_date", existing.get("expiry_date")) != existing.get("expiry_date"):
         update_data["notifications_sent"] = []
     
+    update_data["next_notification_at"] = compute_next_notification_at({**existing, **update_data})
+    
     await db.services.update_one({"id": service_id}, {"$set": update_data})
+    await service_cache.invalidate()
     updated = await db.services.find_one({"id": service_id}, {"_id": 0})
+    await update_dashboard_stats(existing, updated)
+    schedule_notification_if_due(background_tasks, service_id, update_data["next_notification_at"])
     return updated
 
 @api_router.delete("/services/{service_id}")
 async def delete_service(service_id: str, current_user: dict = Depends(get_current_user)):
-    result = await db.services.delete_one({"id": service_id})
-    if result.deleted_count == 0:
+    deleted = await db.services.find_one_and_delete({"id": service_id}, {"_id": 0})
+    if not deleted:
         raise HTTPException(status_code=404, detail="Service not found")
+    await service_cache.invalidate()
+    await update_dashboard_stats(deleted, None)
     return {"message": "Service deleted successfully"}
 
 # ==================== EMAIL ROUTES ====================
@@ -787,15 +1299,26 @@ async def send_manual_reminder(service_id: str, current_user: dict = Depends(get
         
         result = await send_expiry_notifications(service, days_until, "manual", "Manual reminder")
         recipients_count = len(result.get("recipients", []))
-        return {"message": f"Reminder sent to {recipients_count} recipient(s)", "details": result}
+        return {"message": f"Reminder queued for {recipients_count} recipient(s)", "details": result}
     except Exception as e:
-        logger.error(f"Failed to send reminder: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to send email: {str(e)}")
+        logger.error(f"Failed to queue reminder: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to queue email: {str(e)}")
 
 # ==================== EXPIRY CHECK & EMAIL ====================
 
 NOTIFICATION_THRESHOLDS = [30, 7, 1]
 
+# Hour of the daily expiry check
+EXPIRY_CHECK_HOUR = 9
+
+# Run the expiry check every N minutes instead of daily at EXPIRY_CHECK_HOUR
+# (0 = daily). Each run only reads services whose next_notification_at is due.
+EXPIRY_CHECK_INTERVAL_MINUTES = int(os.environ.get('EXPIRY_CHECK_INTERVAL_MINUTES', '0'))
+
+# Services not reached within this many seconds of an expiry check starting
+# stay due and are picked up by the next run (0 = no deadline)
+EXPIRY_CHECK_DEADLINE_SECONDS = float(os.environ.get('EXPIRY_CHECK_DEADLINE_SECONDS', '1800'))
+
 COMPANY_NAME = os.environ.get('COMPANY_NAME', 'Your Organization')
 
 # SMTP Presets for common providers
@@ -832,18 +1355,629 @@ SMTP_PRESETS = {
     }
 }
 
-async def send_email_with_provider(to_email: str, subject: str, html_content: str, settings: dict):
+EMAIL_PROVIDERS = {"resend", "smtp", *SMTP_PRESETS}
+
+# Default sending limits per provider: sustained messages (API calls for
+# Resend) per second and messages per UTC day (None = no daily cap).
+# Overridable in settings for the active provider.
+PROVIDER_RATE_LIMITS = {
+    "resend": {"per_second": 2, "daily": None},
+    "smtp": {"per_second": 5, "daily": None},
+    "gmail": {"per_second": 1, "daily": 500},
+    "outlook": {"per_second": 0.5, "daily": 10000},
+    "exchange": {"per_second": 0.5, "daily": 10000},
+    "yahoo": {"per_second": 0.5, "daily": 500},
+    "sendgrid": {"per_second": 10, "daily": None},
+    "mailgun": {"per_second": 10, "daily": None}
+}
+
+# Global cap on concurrent outgoing emails
+NOTIFICATION_MAX_CONCURRENCY = int(os.environ.get('NOTIFICATION_MAX_CONCURRENCY', '20'))
+
+# Default per-provider caps on concurrent sends, overridable with
+# NOTIFICATION_PROVIDER_CONCURRENCY="gmail=2,resend=10"
+PROVIDER_CONCURRENCY_LIMITS = {
+    "resend": 10,
+    "smtp": 4,
+    "gmail": 2,
+    "outlook": 3,
+    "exchange": 3,
+    "yahoo": 2,
+    "sendgrid": 10,
+    "mailgun": 10
+}
+
+def parse_provider_limits(value: str) -> Dict[str, int]:
+    limits = {}
+    for item in value.split(","):
+        if "=" in item:
+            name, limit = item.split("=", 1)
+            limits[name.strip()] = int(limit)
+    return limits
+
+class NotificationDispatcher:
+    """Bounds concurrent email sends globally and per provider, and tracks progress"""
+    
+    THROUGHPUT_WINDOW_SECONDS = 60
+    
+    def __init__(self, max_concurrency: int, provider_limits: Dict[str, int]):
+        self.max_concurrency = max_concurrency
+        self.provider_limits = provider_limits
+        self._global = asyncio.Semaphore(max_concurrency)
+        self._providers: Dict[str, asyncio.Semaphore] = {}
+        self._completions: deque = deque()
+        self.queued = 0
+        self.in_flight = 0
+        self.sent = 0
+        self.failed = 0
+        self.services_pending = 0
+        self.scan_started_at: Optional[datetime] = None
+        self.scan_finished_at: Optional[datetime] = None
+    
+    def _provider_limit(self, provider: str) -> int:
+        return self.provider_limits.get(provider, self.provider_limits.get("smtp", self.max_concurrency))
+    
+    def _provider_semaphore(self, provider: str) -> asyncio.Semaphore:
+        if provider not in self._providers:
+            self._providers[provider] = asyncio.Semaphore(self._provider_limit(provider))
+        return self._providers[provider]
+    
+    def capacity(self, provider: str) -> int:
+        """Provider calls to `provider` that may run at once"""
+        return max(1, min(self.max_concurrency, self._provider_limit(provider)))
+    
+    def _record_completion(self, messages: int):
+        now = datetime.now(timezone.utc)
+        self._completions.extend([now] * messages)
+        cutoff = now - timedelta(seconds=self.THROUGHPUT_WINDOW_SECONDS)
+        while self._completions and self._completions[0] < cutoff:
+            self._completions.popleft()
+    
+    async def send(self, provider: str, send_fn: Callable[[], Awaitable[Any]], messages: int = 1) -> Any:
+        """Run one provider call carrying `messages` emails (more than one for batch sends)"""
+        self.queued += messages
+        waiting = True
+        try:
+            async with self._provider_semaphore(provider):
+                async with self._global:
+                    self.queued -= messages
+                    waiting = False
+                    self.in_flight += messages
+                    try:
+                        result = await send_fn()
+                        self.sent += messages
+                        return result
+                    except Exception:
+                        self.failed += messages
+                        raise
+                    finally:
+                        self.in_flight -= messages
+                        self._record_completion(messages)
+        finally:
+            if waiting:
+                self.queued -= messages
+    
+    def start_scan(self):
+        self.scan_started_at = datetime.now(timezone.utc)
+        self.scan_finished_at = None
+    
+    def finish_scan(self):
+        self.scan_finished_at = datetime.now(timezone.utc)
+    
+    def snapshot(self) -> dict:
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.THROUGHPUT_WINDOW_SECONDS)
+        recent = sum(1 for t in self._completions if t >= cutoff)
+        return {
+            "scan_running": self.scan_started_at is not None and self.scan_finished_at is None,
+            "scan_started_at": self.scan_started_at.isoformat() if self.scan_started_at else None,
+            "services_pending": self.services_pending,
+            "queue_depth": self.queued,
+            "in_flight": self.in_flight,
+            "sent": self.sent,
+            "failed": self.failed,
+            "throughput_per_second": round(recent / self.THROUGHPUT_WINDOW_SECONDS, 2),
+            "max_concurrency": self.max_concurrency,
+            "provider_limits": self.provider_limits
+        }
+
+class AdaptiveRateLimiter:
+    """Rate limit of one provider, shared by all processes, that slows down when the provider throttles.
+    
+    The limit is a token bucket kept as a virtual schedule (GCRA) in one
+    email_rate_limits document per provider: each send books the next free
+    slot with compare-and-set and waits for it locally, so every API and
+    worker process draws from the same budget. Throttling responses halve
+    the shared rate (down to 1/16 of the configured one) and pause sending
+    for the provider's Retry-After or an exponential backoff; successes
+    recover 5% of the configured rate each (AIMD).
+    """
+    
+    MIN_RATE_FACTOR = 1 / 16
+    RECOVERY_FACTOR = 0.05
+    BACKOFF_BASE_SECONDS = 30
+    BACKOFF_MAX_SECONDS = 900
+    
+    def __init__(self, provider_id: str, rate: float):
+        self.provider_id = provider_id
+        self.base_rate = rate
+        self.rate = rate
+        # Epoch seconds, as last read from or written to MongoDB
+        self.paused_until = 0.0
+        self.consecutive_throttles = 0
+        self.throttled = 0
+        self._lock = asyncio.Lock()
+    
+    @property
+    def capacity(self) -> float:
+        return max(1.0, self.rate)
+    
+    def configure(self, rate: float):
+        if rate != self.base_rate:
+            self.base_rate = rate
+            self.rate = min(self.rate, rate) if self.consecutive_throttles else rate
+    
+    def _load(self, doc: Optional[dict]):
+        doc = doc or {}
+        self.rate = min(doc.get("rate", self.base_rate), self.base_rate)
+        self.paused_until = doc.get("paused_until", 0.0)
+        self.consecutive_throttles = doc.get("consecutive_throttles", 0)
+    
+    def paused_for(self) -> float:
+        """Seconds left of the pause after a throttling response"""
+        return max(0.0, self.paused_until - time.time())
+    
+    async def acquire(self, timeout: Optional[float] = None) -> bool:
+        """Book the next send slot and wait for it.
+        
+        Returns False without booking if the slot is more than `timeout`
+        seconds away, e.g. while sending is paused after throttling.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        # Slots are booked one at a time per process; the compare-and-set
+        # only retries on bookings by other processes
+        async with self._lock:
+            while True:
+                doc = await db.email_rate_limits.find_one({"_id": self.provider_id})
+                self._load(doc)
+                now = time.time()
+                interval = 1 / self.rate
+                next_slot = doc["next_slot_at"] if doc else 0.0
+                # Up to `capacity` sends may go out back to back
+                send_at = max(now, self.paused_until, next_slot - (self.capacity - 1) * interval)
+                # A slot that is free right away is always taken
+                if deadline is not None and send_at > max(deadline, now):
+                    return False
+                try:
+                    result = await db.email_rate_limits.update_one(
+                        {"_id": self.provider_id, "next_slot_at": next_slot},
+                        {"$set": {"next_slot_at": max(next_slot, send_at) + interval}},
+                        upsert=doc is None
+                    )
+                except DuplicateKeyError:
+                    # Another process created the document first
+                    continue
+                if doc is None or result.modified_count:
+                    break
+        if send_at > now:
+            await asyncio.sleep(send_at - now)
+        return True
+    
+    async def on_success(self):
+        if not self.consecutive_throttles and self.rate >= self.base_rate:
+            return
+        self.consecutive_throttles = 0
+        self.rate = min(self.base_rate, self.rate + self.base_rate * self.RECOVERY_FACTOR)
+        await db.email_rate_limits.update_one(
+            {"_id": self.provider_id},
+            {"$set": {"rate": self.rate, "consecutive_throttles": 0}}
+        )
+    
+    async def on_throttled(self, retry_after: Optional[float] = None) -> float:
+        """Slow down after a throttling response; returns the backoff in seconds"""
+        self.throttled += 1
+        self.consecutive_throttles += 1
+        self.rate = max(self.base_rate * self.MIN_RATE_FACTOR, self.rate / 2)
+        backoff = retry_after or min(
+            self.BACKOFF_BASE_SECONDS * (2 ** (self.consecutive_throttles - 1)),
+            self.BACKOFF_MAX_SECONDS
+        )
+        self.paused_until = max(self.paused_until, time.time() + backoff)
+        await db.email_rate_limits.update_one(
+            {"_id": self.provider_id},
+            {
+                "$set": {"rate": self.rate},
+                "$max": {"paused_until": self.paused_until, "consecutive_throttles": self.consecutive_throttles},
+                "$setOnInsert": {"next_slot_at": 0.0}
+            },
+            upsert=True
+        )
+        return backoff
+    
+    def snapshot(self) -> dict:
+        return {
+            "configured_per_second": self.base_rate,
+            "current_per_second": round(self.rate, 3),
+            "paused_for_seconds": round(self.paused_for(), 1),
+            "throttled": self.throttled
+        }
+
+rate_limiters: Dict[str, AdaptiveRateLimiter] = {}
+
+def get_provider_limits(provider: str, settings: dict) -> dict:
+    """Preset limits for a provider with the settings overrides applied"""
+    preset = PROVIDER_RATE_LIMITS.get(provider, PROVIDER_RATE_LIMITS["smtp"])
+    return {
+        "per_second": settings.get("email_rate_limit_per_second") or preset["per_second"],
+        "daily": settings.get("email_daily_limit") or preset["daily"]
+    }
+
+def get_rate_limiter(provider_settings: dict) -> AdaptiveRateLimiter:
+    """The limiter of one configured provider (primary or fallback), keyed by provider_id"""
+    provider_id = provider_settings["provider_id"]
+    rate = get_provider_limits(provider_settings.get("email_provider", "resend"), provider_settings)["per_second"]
+    if provider_id not in rate_limiters:
+        rate_limiters[provider_id] = AdaptiveRateLimiter(provider_id, rate)
+    else:
+        rate_limiters[provider_id].configure(rate)
+    return rate_limiters[provider_id]
+
+# SMTP replies used for rate limiting (421 service not available / too many
+# connections, 450 mailbox unavailable / try again later)
+SMTP_THROTTLE_CODES = {421, 450}
+
+def get_throttle_retry_after(error: Exception) -> Optional[float]:
+    """None if the error is not a throttling response, else the suggested delay (0 = unknown)"""
+    if isinstance(error, ResendError):
+        return (error.retry_after or 0.0) if error.status_code == 429 else None
+    if isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+        codes = {refused.code for refused in error.recipients}
+        return 0.0 if codes & SMTP_THROTTLE_CODES else None
+    if isinstance(error, aiosmtplib.SMTPResponseException):
+        return 0.0 if error.code in SMTP_THROTTLE_CODES else None
+    return None
+
+def get_quota_day(now: Optional[datetime] = None) -> datetime:
+    now = now or datetime.now(timezone.utc)
+    return now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+# Providers whose daily quota ran out in this process, until the next UTC day
+quota_exhausted_until: Dict[str, datetime] = {}
+
+def is_quota_exhausted(provider_id: str) -> bool:
+    until = quota_exhausted_until.get(provider_id)
+    return until is not None and datetime.now(timezone.utc) < until
+
+async def reserve_daily_quota(provider: str, count: int, limit: Optional[int]) -> int:
+    """Reserve up to `count` sends from today's quota; returns how many were granted.
+    
+    `provider` is the provider_id of a configured provider, so a primary and
+    a fallback of the same type have separate quotas. Usage is one counter
+    document per provider and UTC day, shared by all processes and updated
+    with compare-and-set so the quota is not exceeded.
+    """
+    day = get_quota_day()
+    key = f"{provider}:{day.date().isoformat()}"
+    on_insert = {"provider": provider, "date": day}
+    
+    if not limit:
+        await db.email_quota.update_one(
+            {"_id": key}, {"$inc": {"count": count}, "$setOnInsert": on_insert}, upsert=True
+        )
+        return count
+    
+    while True:
+        doc = await db.email_quota.find_one({"_id": key})
+        used = doc["count"] if doc else 0
+        granted = min(count, limit - used)
+        if granted < count:
+            quota_exhausted_until[provider] = day + timedelta(days=1)
+        if granted <= 0:
+            return 0
+        try:
+            result = await db.email_quota.update_one(
+                {"_id": key, "count": used},
+                {"$inc": {"count": granted}, "$setOnInsert": on_insert},
+                upsert=doc is None
+            )
+        except DuplicateKeyError:
+            # Another process created today's counter first
+            continue
+        if doc is None or result.modified_count:
+            return granted
+
+async def release_daily_quota(provider: str, count: int):
+    """Return reserved sends to today's quota when they were not attempted"""
+    key = f"{provider}:{get_quota_day().date().isoformat()}"
+    await db.email_quota.update_one({"_id": key}, {"$inc": {"count": -count}})
+    quota_exhausted_until.pop(provider, None)
+
+async def get_quota_usage(settings: dict) -> List[dict]:
+    """Today's send counts per provider, with the configured daily limits"""
+    day = get_quota_day()
+    providers = {p["provider_id"]: p for p in get_provider_chain(settings)}
+    usage = []
+    async for doc in db.email_quota.find({"date": day}):
+        # Counters of providers no longer configured fall back to the preset of that name
+        provider_settings = providers.get(doc["provider"], {"email_provider": doc["provider"]})
+        limit = get_provider_limits(provider_settings.get("email_provider", "resend"), provider_settings)["daily"]
+        usage.append({
+            "provider": doc["provider"],
+            "day": day.date().isoformat(),
+            "sent": doc["count"],
+            "daily_limit": limit,
+            "remaining": max(0, limit - doc["count"]) if limit else None
+        })
+    return usage
+
+notification_dispatcher = NotificationDispatcher(
+    NOTIFICATION_MAX_CONCURRENCY,
+    {**PROVIDER_CONCURRENCY_LIMITS, **parse_provider_limits(os.environ.get('NOTIFICATION_PROVIDER_CONCURRENCY', ''))}
+)
+
+# SMTP sessions kept open per provider config for reuse across messages
+SMTP_POOL_MAX_IDLE = int(os.environ.get('SMTP_POOL_MAX_IDLE', '4'))
+SMTP_POOL_IDLE_SECONDS = int(os.environ.get('SMTP_POOL_IDLE_SECONDS', '60'))
+# Many servers cap messages per session (e.g. Gmail, Office 365)
+SMTP_POOL_MAX_MESSAGES = int(os.environ.get('SMTP_POOL_MAX_MESSAGES', '100'))
+# Idle sessions older than this are checked with NOOP before reuse
+SMTP_POOL_HEALTHCHECK_SECONDS = 10
+
+class PooledSMTPConnection:
+    def __init__(self, smtp: aiosmtplib.SMTP):
+        self.smtp = smtp
+        self.messages_sent = 0
+        self.last_used = time.monotonic()
+
+class SMTPConnectionPool:
+    """Reuses connected, authenticated SMTP sessions per (host, port, user, TLS) config.
+    
+    Sessions are checked out for one message at a time; concurrency is bounded
+    by the notification dispatcher, so the pool only limits how many idle
+    sessions are kept. A session that is dropped by the server (disconnect or
+    421) is replaced and the message is retried once on a fresh connection.
+    """
+    
+    def __init__(self, max_idle: int, idle_seconds: int, max_messages: int):
+        self.max_idle = max_idle
+        self.idle_seconds = idle_seconds
+        self.max_messages = max_messages
+        self._idle: Dict[tuple, deque] = {}
+        self.opened = 0
+        self.reused = 0
+        self.reconnects = 0
+        self.discarded = 0
+    
+    async def _connect(self, key: tuple) -> PooledSMTPConnection:
+        hostname, port, username, password, use_tls = key
+        smtp = aiosmtplib.SMTP(
+            hostname=hostname,
+            port=port,
+            username=username,
+            password=password,
+            start_tls=True if use_tls else None,
+            # Per-command timeout once connected
+            timeout=EMAIL_SEND_TIMEOUT_SECONDS
+        )
+        try:
+            await smtp.connect(timeout=EMAIL_CONNECT_TIMEOUT_SECONDS)
+        except BaseException:
+            # Includes cancellation half-way through connecting or STARTTLS
+            smtp.close()
+            raise
+        self.opened += 1
+        return PooledSMTPConnection(smtp)
+    
+    def _discard(self, conn: PooledSMTPConnection):
+        self.discarded += 1
+        conn.smtp.close()
+    
+    async def _acquire(self, key: tuple) -> PooledSMTPConnection:
+        idle = self._idle.get(key)
+        while idle:
+            conn = idle.pop()
+            age = time.monotonic() - conn.last_used
+            if age > self.idle_seconds or not conn.smtp.is_connected:
+                self._discard(conn)
+                continue
+            if age > SMTP_POOL_HEALTHCHECK_SECONDS:
+                try:
+                    await conn.smtp.noop()
+                except (aiosmtplib.SMTPException, OSError):
+                    self._discard(conn)
+                    continue
+                except BaseException:
+                    self._discard(conn)
+                    raise
+            self.reused += 1
+            return conn
+        return await self._connect(key)
+    
+    def _release(self, key: tuple, conn: PooledSMTPConnection):
+        conn.last_used = time.monotonic()
+        idle = self._idle.setdefault(key, deque())
+        if (
+            not conn.smtp.is_connected
+            or conn.messages_sent >= self.max_messages
+            or len(idle) >= self.max_idle
+        ):
+            self._discard(conn)
+            return
+        idle.append(conn)
+    
+    async def _reset(self, key: tuple, conn: PooledSMTPConnection):
+        try:
+            await conn.smtp.rset()
+        except (aiosmtplib.SMTPException, OSError):
+            self._discard(conn)
+        except BaseException:
+            self._discard(conn)
+            raise
+        else:
+            self._release(key, conn)
+    
+    @staticmethod
+    def _is_dropped(error: Exception) -> bool:
+        if isinstance(error, aiosmtplib.SMTPServerDisconnected):
+            return True
+        return isinstance(error, aiosmtplib.SMTPResponseException) and error.code == 421
+    
+    async def send(self, message, hostname: str, port: int, username: str, password: str, use_tls: bool):
+        key = (hostname, port, username, password, use_tls)
+        for attempt in range(2):
+            conn = await self._acquire(key)
+            try:
+                result = await conn.smtp.send_message(message)
+            except Exception as e:
+                if self._is_dropped(e):
+                    self._discard(conn)
+                    if attempt == 0:
+                        self.reconnects += 1
+                        continue
+                    raise
+                # The session survived (e.g. a refused recipient); reset it for the next message
+                await self._reset(key, conn)
+                raise
+            except BaseException:
+                # Cancelled mid-transaction (e.g. send deadline): the session state is unknown
+                self._discard(conn)
+                raise
+            conn.messages_sent += 1
+            self._release(key, conn)
+            return result
+    
+    async def close_all(self):
+        for idle in self._idle.values():
+            while idle:
+                conn = idle.pop()
+                try:
+                    await asyncio.wait_for(conn.smtp.quit(), timeout=5)
+                except Exception:
+                    conn.smtp.close()
+        self._idle.clear()
+    
+    def snapshot(self) -> dict:
+        return {
+            "idle": sum(len(idle) for idle in self._idle.values()),
+            "opened": self.opened,
+            "reused": self.reused,
+            "reconnects": self.reconnects,
+            "discarded": self.discarded
+        }
+
+smtp_pool = SMTPConnectionPool(SMTP_POOL_MAX_IDLE, SMTP_POOL_IDLE_SECONDS, SMTP_POOL_MAX_MESSAGES)
+
+class ResendError(Exception):
+    def __init__(self, status_code: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(f"Resend API error {status_code}: {message}")
+        self.status_code = status_code
+        self.message = message
+        self.retry_after = retry_after
+
+class ResendClient:
+    """Async Resend API client sharing one keep-alive connection pool.
+    
+    The API key is passed per request, so settings changes apply without
+    mutating global state. Connection errors, timeouts and 5xx responses
+    are retried with backoff; every attempt of a call carries the same
+    Idempotency-Key so a retried request is not delivered twice. 429 is
+    raised right away so the provider's rate limiter can back off.
+    """
+    
+    RETRY_STATUSES = {500, 502, 503, 504}
+    MAX_RETRY_AFTER_SECONDS = 30
+    
+    def __init__(self, base_url: str, timeout_seconds: float, max_retries: int):
+        self.base_url = base_url.rstrip("/")
+        self.timeout_seconds = timeout_seconds
+        self.max_retries = max_retries
+        self._client: Optional[httpx.AsyncClient] = None
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout_seconds, connect=min(self.timeout_seconds, EMAIL_CONNECT_TIMEOUT_SECONDS)),
+                limits=httpx.Limits(max_connections=NOTIFICATION_MAX_CONCURRENCY, max_keepalive_connections=NOTIFICATION_MAX_CONCURRENCY)
+            )
+        return self._client
+    
+    @staticmethod
+    def _get_retry_after(response: Optional[httpx.Response]) -> Optional[float]:
+        if response is not None and response.headers.get("retry-after"):
+            try:
+                return float(response.headers["retry-after"])
+            except ValueError:
+                pass
+        return None
+    
+    def _get_retry_delay(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        retry_after = self._get_retry_after(response)
+        if retry_after is not None:
+            return min(retry_after, self.MAX_RETRY_AFTER_SECONDS)
+        return 0.5 * (2 ** attempt)
+    
+    async def _post(
+        self,
+        path: str,
+        api_key: str,
+        payload: Any,
+        idempotency_key: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None
+    ) -> Any:
+        if not api_key:
+            raise ValueError("Resend API key is not configured")
+        headers = {
+            **(headers or {}),
+            "Authorization": f"Bearer {api_key}",
+            "Idempotency-Key": idempotency_key or str(uuid.uuid4())
+        }
+        
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                response = await self._get_client().post(path, json=payload, headers=headers)
+            except httpx.TransportError as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"Resend request failed ({type(e).__name__}), retrying")
+            else:
+                if response.is_success:
+                    return response.json()
+                if response.status_code not in self.RETRY_STATUSES or attempt == self.max_retries:
+                    try:
+                        message = response.json().get("message", response.text)
+                    except ValueError:
+                        message = response.text
+                    raise ResendError(response.status_code, message, self._get_retry_after(response))
+            await asyncio.sleep(self._get_retry_delay(attempt, response))
+    
+    async def send_email(self, api_key: str, params: dict, idempotency_key: Optional[str] = None) -> dict:
+        return await self._post("/emails", api_key, params, idempotency_key)
+    
+    async def send_batch(self, api_key: str, params: List[dict]) -> dict:
+        """Permissive validation: invalid messages are reported without rejecting the batch"""
+        return await self._post("/emails/batch", api_key, params, headers={"x-batch-validation": "permissive"})
+    
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+resend_client = ResendClient(RESEND_API_BASE_URL, RESEND_TIMEOUT_SECONDS, RESEND_MAX_RETRIES)
+
+async def send_email_with_provider(
+    to_email: str,
+    subject: str,
+    html_content: str,
+    settings: dict,
+    idempotency_key: Optional[str] = None
+):
     """Send email using the configured provider"""
     provider = settings.get("email_provider", "resend")
     sender_email = settings.get("sender_email", SENDER_EMAIL)
     sender_name = settings.get("sender_name", "Service Renewal Hub")
     
     if provider == "resend":
-        # Use Resend API
-        db_api_key = settings.get("resend_api_key", "")
-        if db_api_key:
-            resend.api_key = db_api_key
-        
         params = {
             "from": f"{sender_name} <{sender_email}>",
             "to": [to_email],
@@ -851,7 +1985,11 @@ async def send_email_with_provider(to_email: str, subject: str, html_content: st
             "html": html_content
         }
         
-        return await asyncio.to_thread(resend.Emails.send, params)
+        return await resend_client.send_email(
+            settings.get("resend_api_key") or RESEND_API_KEY,
+            params,
+            idempotency_key
+        )
     
     else:
         # Use SMTP (works for smtp, gmail, outlook, exchange, etc.)
@@ -880,162 +2018,749 @@ async def send_email_with_provider(to_email: str, subject: str, html_content: st
         html_part = MIMEText(html_content, "html")
         message.attach(html_part)
         
-        # Send via SMTP
-        if use_tls:
-            await aiosmtplib.send(
-                message,
-                hostname=smtp_host,
-                port=smtp_port,
-                username=smtp_username,
-                password=smtp_password,
-                start_tls=True
-            )
-        else:
-            await aiosmtplib.send(
-                message,
-                hostname=smtp_host,
-                port=smtp_port,
-                username=smtp_username,
-                password=smtp_password,
-                use_tls=False
-            )
+        # Send via a pooled SMTP session
+        await smtp_pool.send(
+            message,
+            hostname=smtp_host,
+            port=smtp_port,
+            username=smtp_username,
+            password=smtp_password,
+            use_tls=use_tls
+        )
         
         return {"id": "smtp_sent", "status": "sent"}
 
-def get_email_html_template(service: dict, recipient_name: str, days_until_expiry: int, threshold_label: str, company_name: str):
-    """Generate HTML email template for expiry notification"""
-    urgency = "URGENT" if days_until_expiry <= 1 else "WARNING" if days_until_expiry <= 7 else "REMINDER"
-    urgency_text = "expiring TODAY" if days_until_expiry <= 0 else f"expiring in {days_until_expiry} day(s)"
-    color = "#ef4444" if days_until_expiry <= 1 else "#f59e0b" if days_until_expiry <= 7 else "#06b6d4"
-    btn_color = "#dc2626" if days_until_expiry <= 1 else "#d97706" if days_until_expiry <= 7 else "#0891b2"
+# Resend accepts up to 100 messages per batch request
+RESEND_BATCH_SIZE = min(int(os.environ.get('RESEND_BATCH_SIZE', '100')), 100)
+
+async def send_resend_batch(messages: List[dict], settings: dict) -> List[dict]:
+    """Send messages ({to_email, subject, html}) in one Resend batch call.
     
-    expiry_date_formatted = service['expiry_date'][:10] if service.get('expiry_date') else "Unknown"
-    category_name = service.get('category_name', 'Uncategorized')
+    Uses permissive validation so one invalid message does not reject the
+    batch. Returns one {"id": ...} or {"error": ...} per message, in order.
+    A failure of the request itself raises.
+    """
+    sender_email = settings.get("sender_email", SENDER_EMAIL)
+    sender_name = settings.get("sender_name", "Service Renewal Hub")
     
-    # Build owners list for email
-    owners_html = ""
-    if service.get('owners'):
-        owners_html = "<tr><td style='padding: 10px 0; color: #71717a; font-size: 14px; border-top: 1px solid #27272a;'>Stakeholders:</td><td style='padding: 10px 0; color: #fafafa; font-size: 14px; border-top: 1px solid #27272a;'>"
-        owners_html += ", ".join([f"{o.get('name', '')} ({o.get('role', 'Owner')})" for o in service['owners'][:3]])
-        if len(service['owners']) > 3:
-            owners_html += f" +{len(service['owners']) - 3} more"
-        owners_html += "</td></tr>"
+    params = [
+        {
+            "from": f"{sender_name} <{sender_email}>",
+            "to": [message["to_email"]],
+            "subject": message["subject"],
+            "html": message["html"]
+        }
+        for message in messages
+    ]
+    response = await resend_client.send_batch(settings.get("resend_api_key") or RESEND_API_KEY, params)
     
-    return f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="utf-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    </head>
-    <body style="margin: 0; padding: 0; background-color: #0a0a0b; font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif;">
-        <table role="presentation" width="100%" cellspacing="0" cellpadding="0" style="background-color: #0a0a0b;">
-            <tr>
-                <td align="center" style="padding: 40px 20px;">
-                    <table role="presentation" width="600" cellspacing="0" cellpadding="0" style="max-width: 600px; background-color: #121214; border-radius: 8px; overflow: hidden;">
-                        
-                        <!-- Header -->
-                        <tr>
-                            <td style="background: linear-gradient(135deg, {color}22 0%, {color}05 100%); padding: 32px 40px; border-bottom: 1px solid #27272a;">
-                                <div style="display: inline-block; background-color: {color}20; border: 1px solid {color}40; border-radius: 4px; padding: 8px 12px; margin-bottom: 16px;">
-                                    <span style="color: {color}; font-size: 12px; font-weight: 600; text-transform: uppercase; letter-spacing: 1px;">{urgency} - {threshold_label}</span>
-                                </div>
-                                <h1 style="margin: 0; color: #fafafa; font-size: 24px; font-weight: 700;">
-                                    Service {urgency_text}!
-                                </h1>
-                            </td>
-                        </tr>
-                        
-                        <!-- Body -->
-                        <tr>
-                            <td style="padding: 40px;">
-                                <p style="margin: 0 0 24px 0; color: #a1a1aa; font-size: 16px; line-height: 1.6;">
-                                    Dear {recipient_name},
-                                </p>
-                                <p style="margin: 0 0 32px 0; color: #a1a1aa; font-size: 16px; line-height: 1.6;">
-                                    This is a <strong style="color: {color};">{threshold_label.lower()}</strong> that the service <strong style="color: #fafafa;">{service['name']}</strong> is {urgency_text}.
-                                </p>
-                                
-                                <!-- Service Details Card -->
-                                <table role="presentation" width="100%" cellspacing="0" cellpadding="0" style="background-color: #1a1a1c; border-radius: 6px; border-left: 4px solid {color}; margin-bottom: 32px;">
-                                    <tr>
-                                        <td style="padding: 24px;">
-                                            <h2 style="margin: 0 0 20px 0; color: #fafafa; font-size: 18px; font-weight: 600;">
-                                                Service Details
-                                            </h2>
-                                            <table role="presentation" width="100%" cellspacing="0" cellpadding="0">
-                                                <tr>
-                                                    <td style="padding: 10px 0; color: #71717a; font-size: 14px; width: 140px;">Service Name:</td>
-                                                    <td style="padding: 10px 0; color: #fafafa; font-size: 14px; font-weight: 500;">{service['name']}</td>
-                                                </tr>
-                                                <tr>
-                                                    <td style="padding: 10px 0; color: #71717a; font-size: 14px; border-top: 1px solid #27272a;">Category:</td>
-                                                    <td style="padding: 10px 0; color: #fafafa; font-size: 14px; border-top: 1px solid #27272a;">{category_name}</td>
-                                                </tr>
-                                                <tr>
-                                                    <td style="padding: 10px 0; color: #71717a; font-size: 14px; border-top: 1px solid #27272a;">Provider:</td>
-                                                    <td style="padding: 10px 0; color: #fafafa; font-size: 14px; border-top: 1px solid #27272a;">{service.get('provider', 'N/A')}</td>
-                                                </tr>
-                                                <tr>
-                                                    <td style="padding: 10px 0; color: #71717a; font-size: 14px; border-top: 1px solid #27272a;">Expiry Date:</td>
-                                                    <td style="padding: 10px 0; color: {color}; font-size: 14px; font-weight: 700; border-top: 1px solid #27272a;">{expiry_date_formatted}</td>
-                                                </tr>
-                                                <tr>
-                                                    <td style="padding: 10px 0; color: #71717a; font-size: 14px; border-top: 1px solid #27272a;">Days Remaining:</td>
-                                                    <td style="padding: 10px 0; color: {color}; font-size: 18px; font-weight: 700; border-top: 1px solid #27272a;">{days_until_expiry} day(s)</td>
-                                                </tr>
-                                                {owners_html}
-                                            </table>
-                                        </td>
-                                    </tr>
-                                </table>
-                                
-                                <p style="margin: 0 0 32px 0; color: #a1a1aa; font-size: 16px; line-height: 1.6;">
-                                    Please take action to renew or contact the service provider as soon as possible to avoid any service interruption.
-                                </p>
-                                
-                                <!-- CTA Button -->
-                                <table role="presentation" width="100%" cellspacing="0" cellpadding="0">
-                                    <tr>
-                                        <td align="center">
-                                            <a href="#" style="display: inline-block; background-color: {btn_color}; color: #ffffff; text-decoration: none; padding: 14px 32px; border-radius: 4px; font-size: 14px; font-weight: 600; text-transform: uppercase; letter-spacing: 0.5px;">
-                                                Renew Now →
-                                            </a>
-                                        </td>
-                                    </tr>
-                                </table>
-                            </td>
-                        </tr>
-                        
-                        <!-- Footer -->
-                        <tr>
-                            <td style="background-color: #0a0a0b; padding: 24px 40px; border-top: 1px solid #27272a;">
-                                <p style="margin: 0 0 8px 0; color: #71717a; font-size: 14px; text-align: center;">
-                                    Best regards,
-                                </p>
-                                <p style="margin: 0 0 16px 0; color: #a1a1aa; font-size: 14px; font-weight: 600; text-align: center;">
-                                    The {company_name} Service Management Team
-                                </p>
-                                <p style="margin: 0; color: #52525b; font-size: 12px; text-align: center;">
-                                    This is an automated notification from Service Renewal Hub
-                                </p>
-                            </td>
-                        </tr>
-                        
-                    </table>
-                </td>
-            </tr>
-        </table>
-    </body>
-    </html>
-    """
+    errors = {err["index"]: err.get("message", "Rejected by Resend") for err in response.get("errors") or []}
+    accepted = iter(response.get("data") or [])
+    results = []
+    for i in range(len(messages)):
+        if i in errors:
+            results.append({"error": errors[i]})
+        else:
+            # Accepted messages are returned in request order, skipping rejected ones
+            results.append({"id": next(accepted, {}).get("id")})
+    return results
 
-async def send_expiry_notifications(service: dict, days_until_expiry: int, threshold_id: str, threshold_label: str):
-    """Send expiry notifications to all service owners"""
-    settings = await get_app_settings()
-    company_name = settings.get("company_name", COMPANY_NAME)
+# Consecutive provider failures that open its circuit, and how long an open
+# circuit skips the provider before letting a probe send through
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_BREAKER_FAILURE_THRESHOLD', '5'))
+CIRCUIT_BREAKER_RESET_SECONDS = float(os.environ.get('CIRCUIT_BREAKER_RESET_SECONDS', '60'))
+
+class CircuitBreaker:
+    """Tracks whether an email provider is worth trying.
     
-    # Collect all recipients (owners + legacy contact)
+    Closed: sends go through. After `failure_threshold` consecutive provider
+    failures the circuit opens and sends skip the provider without waiting
+    on it. Once `reset_seconds` have passed it is half-open and lets a single
+    probe send through, which closes the circuit on success or reopens it.
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started_at: Optional[float] = None
+        self.trips = 0
+    
+    @property
+    def available(self) -> bool:
+        now = time.monotonic()
+        if self.state == self.OPEN and now - self.opened_at >= self.reset_seconds:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            # A probe that never reported back does not block the provider forever
+            return self.probe_started_at is None or now - self.probe_started_at >= self.reset_seconds
+        return self.state == self.CLOSED
+    
+    def try_acquire(self) -> bool:
+        """Whether to send through this provider now; in half-open state only one caller gets the probe"""
+        if not self.available:
+            return False
+        if self.state == self.HALF_OPEN:
+            self.probe_started_at = time.monotonic()
+        return True
+    
+    def release(self):
+        """End a send that gave no verdict on the provider (throttled, over quota)"""
+        self.probe_started_at = None
+    
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.probe_started_at = None
+    
+    def record_failure(self):
+        self.failures += 1
+        self.probe_started_at = None
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self.trips += 1
+    
+    def retry_in(self) -> float:
+        """Seconds until an open circuit lets a probe through"""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_seconds - time.monotonic())
+    
+    def snapshot(self) -> dict:
+        available = self.available
+        return {
+            "state": self.state,
+            "available": available,
+            "consecutive_failures": self.failures,
+            "trips": self.trips,
+            "retry_in_seconds": round(self.retry_in(), 1)
+        }
+
+circuit_breakers: Dict[str, CircuitBreaker] = {}
+
+def get_circuit_breaker(provider_id: str) -> CircuitBreaker:
+    if provider_id not in circuit_breakers:
+        circuit_breakers[provider_id] = CircuitBreaker(CIRCUIT_BREAKER_FAILURE_THRESHOLD, CIRCUIT_BREAKER_RESET_SECONDS)
+    return circuit_breakers[provider_id]
+
+def get_fallback_provider_id(fallback: dict, index: int) -> str:
+    return fallback.get("name") or f"{fallback.get('email_provider', 'smtp')}#{index}"
+
+def get_provider_chain(settings: dict) -> List[dict]:
+    """Settings for the primary provider followed by each fallback, in failover order.
+    
+    Each entry is a full settings dict for send_email_with_provider with a
+    `provider_id` naming its circuit breaker.
+    """
+    chain = [{**settings, "provider_id": settings.get("email_provider", "resend")}]
+    for index, fallback in enumerate(settings.get("email_fallback_providers") or [], start=1):
+        provider_id = get_fallback_provider_id(fallback, index)
+        if provider_id == chain[0]["provider_id"]:
+            provider_id = f"{provider_id}#{index}"
+        chain.append({
+            **settings,
+            **{key: value for key, value in fallback.items() if value is not None},
+            "provider_id": provider_id
+        })
+    return chain
+
+def get_active_provider(settings: dict) -> Optional[dict]:
+    """The first provider in the chain whose circuit is not open and that has quota left"""
+    return next((
+        p for p in get_provider_chain(settings)
+        if get_circuit_breaker(p["provider_id"]).available and not is_quota_exhausted(p["provider_id"])
+    ), None)
+
+def is_provider_failure(error: Exception) -> bool:
+    """Whether a send error means the provider is unavailable rather than that it rejected the message.
+    
+    Only these count towards opening the circuit; throttling is handled by
+    the rate limiter instead.
+    """
+    if isinstance(error, ResendError):
+        return error.status_code >= 500 or error.status_code in (401, 403)
+    if isinstance(error, aiosmtplib.SMTPAuthenticationError):
+        return True
+    if isinstance(error, aiosmtplib.SMTPResponseException):
+        return False
+    # Connection and timeout errors, unsupported TLS and incomplete provider settings
+    return isinstance(error, (httpx.TransportError, aiosmtplib.SMTPNotSupported, OSError, ValueError))
+
+# ==================== EMAIL TEMPLATES ====================
+
+class CompiledTemplate:
+    """A template in string.Template syntax ($name / ${name}) parsed once into parts.
+    
+    Rendering is a single join over literal and field parts. bind() fills in
+    some fields ahead of time and returns a smaller template, so the part of
+    a message shared by many recipients is only built once.
+    """
+    
+    def __init__(self, parts: List[tuple]):
+        # (is_field, text) pairs with adjacent literals merged
+        self.parts = parts
+        self.fields = {text for is_field, text in parts if is_field}
+    
+    @staticmethod
+    def _merge(parts: List[tuple]) -> List[tuple]:
+        merged = []
+        literal = []
+        for is_field, text in parts:
+            if not is_field:
+                literal.append(text)
+                continue
+            if literal:
+                merged.append((False, "".join(literal)))
+                literal = []
+            merged.append((True, text))
+        if literal:
+            merged.append((False, "".join(literal)))
+        return [part for part in merged if part[0] or part[1]]
+    
+    @classmethod
+    def parse(cls, source: str) -> "CompiledTemplate":
+        """Parse template source; raises ValueError on a malformed placeholder"""
+        parts = []
+        position = 0
+        for match in string.Template.pattern.finditer(source):
+            parts.append((False, source[position:match.start()]))
+            position = match.end()
+            if match.group("escaped") is not None:
+                parts.append((False, "$"))
+            elif match.group("invalid") is not None:
+                line = source.count("\n", 0, match.start()) + 1
+                raise ValueError(f"Invalid placeholder on line {line}")
+            else:
+                parts.append((True, match.group("named") or match.group("braced")))
+        parts.append((False, source[position:]))
+        return cls(cls._merge(parts))
+    
+    def bind(self, values: Dict[str, str]) -> "CompiledTemplate":
+        return CompiledTemplate(self._merge([
+            (False, values[text]) if is_field and text in values else (is_field, text)
+            for is_field, text in self.parts
+        ]))
+    
+    def render(self, values: Optional[Dict[str, str]] = None) -> str:
+        """Render with all remaining fields; raises KeyError for a missing one"""
+        values = values or {}
+        return "".join(values[text] if is_field else text for is_field, text in self.parts)
+
+# Elements whose whitespace is rendered as written
+PREFORMATTED_HTML_RE = re.compile(r"<(pre|textarea)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+
+def minify_html(source: str) -> str:
+    """Collapse whitespace runs to a single space outside <pre> and <textarea>.
+    
+    Whitespace between tags is kept: between inline elements it is visible
+    text, so removing it would change what the recipient reads.
+    """
+    parts = []
+    position = 0
+    for match in PREFORMATTED_HTML_RE.finditer(source):
+        parts.append(re.sub(r"\s+", " ", source[position:match.start()]))
+        parts.append(match.group(0))
+        position = match.end()
+    parts.append(re.sub(r"\s+", " ", source[position:]))
+    return "".join(parts).strip()
+
+@functools.lru_cache(maxsize=64)
+def compile_template(source: str, minify: bool = True) -> CompiledTemplate:
+    return CompiledTemplate.parse(minify_html(source) if minify else source)
+
+def escape_html(value: Any) -> str:
+    return html.escape(str(value), quote=True)
+
+EXPIRY_EMAIL_TEMPLATE = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+</head>
+<body style="margin: 0; padding: 0; background-color: #0a0a0b; font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif;">
+    <table role="presentation" width="100%" cellspacing="0" cellpadding="0" style="background-color: #0a0a0b;">
+        <tr>
+            <td align="center" style="padding: 40px 20px;">
+                <table role="presentation" width="600" cellspacing="0" cellpadding="0" style="max-width: 600px; background-color: #121214; border-radius: 8px; overflow: hidden;">
+
+                    <!-- Header -->
+                    <tr>
+                        <td style="background: linear-gradient(135deg, ${color}22 0%, ${color}05 100%); padding: 32px 40px; border-bottom: 1px solid #27272a;">
+                            <div style="display: inline-block; background-color: ${color}20; border: 1px solid ${color}40; border-radius: 4px; padding: 8px 12px; margin-bottom: 16px;">
+                                <span style="color: ${color}; font-size: 12px; font-weight: 600; text-transform: uppercase; letter-spacing: 1px;">${urgency} - ${threshold_label}</span>
+                            </div>
+                            <h1 style="margin: 0; color: #fafafa; font-size: 24px; font-weight: 700;">
+                                Service ${urgency_text}!
+                            </h1>
+                        </td>
+                    </tr>
+
+                    <!-- Body -->
+                    <tr>
+                        <td style="padding: 40px;">
+                            <p style="margin: 0 0 24px 0; color: #a1a1aa; font-size: 16px; line-height: 1.6;">
+                                Dear ${recipient_name},
+                            </p>
+                            <p style="margin: 0 0 32px 0; color: #a1a1aa; font-size: 16px; line-height: 1.6;">
+                                This is a <strong style="color: ${color};">${threshold_label_lower}</strong> that the service <strong style="color: #fafafa;">${service_name}</strong> is ${urgency_text}.
+                            </p>
+
+                            <!-- Service Details Card -->
+                            <table role="presentation" width="100%" cellspacing="0" cellpadding="0" style="background-color: #1a1a1c; border-radius: 6px; border-left: 4px solid ${color}; margin-bottom: 32px;">
+                                <tr>
+                                    <td style="padding: 24px;">
+                                        <h2 style="margin: 0 0 20px 0; color: #fafafa; font-size: 18px; font-weight: 600;">
+                                            Service Details
+                                        </h2>
+                                        <table role="presentation" width="100%" cellspacing="0" cellpadding="0">
+                                            <tr>
+                                                <td style="padding: 10px 0; color: #71717a; font-size: 14px; width: 140px;">Service Name:</td>
+                                                <td style="padding: 10px 0; color: #fafafa; font-size: 14px; font-weight: 500;">${service_name}</td>
+                                            </tr>
+                                            <tr>
+                                                <td style="padding: 10px 0; color: #71717a; font-size: 14px; border-top: 1px solid #27272a;">Category:</td>
+                                                <td style="padding: 10px 0; color: #fafafa; font-size: 14px; border-top: 1px solid #27272a;">${category_name}</td>
+                                            </tr>
+                                            <tr>
+                                                <td style="padding: 10px 0; color: #71717a; font-size: 14px; border-top: 1px solid #27272a;">Provider:</td>
+                                                <td style="padding: 10px 0; color: #fafafa; font-size: 14px; border-top: 1px solid #27272a;">${provider}</td>
+                                            </tr>
+                                            <tr>
+                                                <td style="padding: 10px 0; color: #71717a; font-size: 14px; border-top: 1px solid #27272a;">Expiry Date:</td>
+                                                <td style="padding: 10px 0; color: ${color}; font-size: 14px; font-weight: 700; border-top: 1px solid #27272a;">${expiry_date}</td>
+                                            </tr>
+                                            <tr>
+                                                <td style="padding: 10px 0; color: #71717a; font-size: 14px; border-top: 1px solid #27272a;">Days Remaining:</td>
+                                                <td style="padding: 10px 0; color: ${color}; font-size: 18px; font-weight: 700; border-top: 1px solid #27272a;">${days_until_expiry} day(s)</td>
+                                            </tr>
+                                            ${owners_html}
+                                        </table>
+                                    </td>
+                                </tr>
+                            </table>
+
+                            <p style="margin: 0 0 32px 0; color: #a1a1aa; font-size: 16px; line-height: 1.6;">
+                                Please take action to renew or contact the service provider as soon as possible to avoid any service interruption.
+                            </p>
+
+                            <!-- CTA Button -->
+                            <table role="presentation" width="100%" cellspacing="0" cellpadding="0">
+                                <tr>
+                                    <td align="center">
+                                        <a href="#" style="display: inline-block; background-color: ${btn_color}; color: #ffffff; text-decoration: none; padding: 14px 32px; border-radius: 4px; font-size: 14px; font-weight: 600; text-transform: uppercase; letter-spacing: 0.5px;">
+                                            Renew Now →
+                                        </a>
+                                    </td>
+                                </tr>
+                            </table>
+                        </td>
+                    </tr>
+
+                    <!-- Footer -->
+                    <tr>
+                        <td style="background-color: #0a0a0b; padding: 24px 40px; border-top: 1px solid #27272a;">
+                            <p style="margin: 0 0 8px 0; color: #71717a; font-size: 14px; text-align: center;">
+                                Best regards,
+                            </p>
+                            <p style="margin: 0 0 16px 0; color: #a1a1aa; font-size: 14px; font-weight: 600; text-align: center;">
+                                The ${company_name} Service Management Team
+                            </p>
+                            <p style="margin: 0; color: #52525b; font-size: 12px; text-align: center;">
+                                This is an automated notification from Service Renewal Hub
+                            </p>
+                        </td>
+                    </tr>
+
+                </table>
+            </td>
+        </tr>
+    </table>
+</body>
+</html>
+"""
+
+DIGEST_EMAIL_TEMPLATE = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+</head>
+<body style="margin: 0; padding: 0; background-color: #0a0a0b; font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif;">
+    <table role="presentation" width="100%" cellspacing="0" cellpadding="0" style="background-color: #0a0a0b;">
+        <tr>
+            <td align="center" style="padding: 40px 20px;">
+                <table role="presentation" width="600" cellspacing="0" cellpadding="0" style="max-width: 600px; background-color: #121214; border-radius: 8px; overflow: hidden;">
+
+                    <!-- Header -->
+                    <tr>
+                        <td style="background: linear-gradient(135deg, ${color}22 0%, ${color}05 100%); padding: 32px 40px; border-bottom: 1px solid #27272a;">
+                            <h1 style="margin: 0; color: #fafafa; font-size: 24px; font-weight: 700;">
+                                ${service_count} services need your attention
+                            </h1>
+                        </td>
+                    </tr>
+
+                    <!-- Body -->
+                    <tr>
+                        <td style="padding: 40px;">
+                            <p style="margin: 0 0 24px 0; color: #a1a1aa; font-size: 16px; line-height: 1.6;">
+                                Dear ${recipient_name},
+                            </p>
+                            <p style="margin: 0 0 32px 0; color: #a1a1aa; font-size: 16px; line-height: 1.6;">
+                                The following services you are responsible for are expiring soon:
+                            </p>
+
+                            <!-- Services Table -->
+                            <table role="presentation" width="100%" cellspacing="0" cellpadding="0" style="background-color: #1a1a1c; border-radius: 6px; margin-bottom: 32px;">
+                                <tr>
+                                    <td style="padding: 12px 8px; color: #71717a; font-size: 12px; text-transform: uppercase;">Service</td>
+                                    <td style="padding: 12px 8px; color: #71717a; font-size: 12px; text-transform: uppercase;">Reminder</td>
+                                    <td style="padding: 12px 8px; color: #71717a; font-size: 12px; text-transform: uppercase;">Expiry Date</td>
+                                    <td style="padding: 12px 8px; color: #71717a; font-size: 12px; text-transform: uppercase; text-align: right;">Remaining</td>
+                                </tr>${rows_html}
+                            </table>
+
+                            <p style="margin: 0; color: #a1a1aa; font-size: 16px; line-height: 1.6;">
+                                Please take action to renew or contact the service providers as soon as possible to avoid any service interruption.
+                            </p>
+                        </td>
+                    </tr>
+
+                    <!-- Footer -->
+                    <tr>
+                        <td style="background-color: #0a0a0b; padding: 24px 40px; border-top: 1px solid #27272a;">
+                            <p style="margin: 0 0 8px 0; color: #71717a; font-size: 14px; text-align: center;">
+                                Best regards,
+                            </p>
+                            <p style="margin: 0 0 16px 0; color: #a1a1aa; font-size: 14px; font-weight: 600; text-align: center;">
+                                The ${company_name} Service Management Team
+                            </p>
+                            <p style="margin: 0; color: #52525b; font-size: 12px; text-align: center;">
+                                This is an automated notification from Service Renewal Hub
+                            </p>
+                        </td>
+                    </tr>
+
+                </table>
+            </td>
+        </tr>
+    </table>
+</body>
+</html>
+"""
+
+DIGEST_ROW_TEMPLATE = """
+<tr>
+    <td style="padding: 12px 8px; color: #fafafa; font-size: 14px; font-weight: 500; border-top: 1px solid #27272a; border-left: 4px solid ${color};">${service_name}<br><span style="color: #71717a; font-size: 12px;">${category_name} · ${provider}</span></td>
+    <td style="padding: 12px 8px; color: #a1a1aa; font-size: 13px; border-top: 1px solid #27272a;">${threshold_label}</td>
+    <td style="padding: 12px 8px; color: ${color}; font-size: 14px; font-weight: 700; border-top: 1px solid #27272a;">${expiry_date}</td>
+    <td style="padding: 12px 8px; color: ${color}; font-size: 14px; font-weight: 700; border-top: 1px solid #27272a; text-align: right;">${days_until_expiry} day(s)</td>
+</tr>
+"""
+
+def get_urgency_color(days_until_expiry: int) -> str:
+    return "#ef4444" if days_until_expiry <= 1 else "#f59e0b" if days_until_expiry <= 7 else "#06b6d4"
+
+def get_expiry_email_values(service: dict, days_until_expiry: int, threshold_label: str, company_name: str) -> Dict[str, str]:
+    """Template fields of an expiry notification, escaped for HTML"""
+    urgency = "URGENT" if days_until_expiry <= 1 else "WARNING" if days_until_expiry <= 7 else "REMINDER"
+    urgency_text = "expiring TODAY" if days_until_expiry <= 0 else f"expiring in {days_until_expiry} day(s)"
+    btn_color = "#dc2626" if days_until_expiry <= 1 else "#d97706" if days_until_expiry <= 7 else "#0891b2"
+    
+    # Build owners list for email
+    owners_html = ""
+    if service.get('owners'):
+        owners_html = "<tr><td style='padding: 10px 0; color: #71717a; font-size: 14px; border-top: 1px solid #27272a;'>Stakeholders:</td><td style='padding: 10px 0; color: #fafafa; font-size: 14px; border-top: 1px solid #27272a;'>"
+        owners_html += ", ".join([escape_html(f"{o.get('name', '')} ({o.get('role', 'Owner')})") for o in service['owners'][:3]])
+        if len(service['owners']) > 3:
+            owners_html += f" +{len(service['owners']) - 3} more"
+        owners_html += "</td></tr>"
+    
+    return {
+        "urgency": urgency,
+        "urgency_text": urgency_text,
+        "color": get_urgency_color(days_until_expiry),
+        "btn_color": btn_color,
+        "threshold_label": escape_html(threshold_label),
+        "threshold_label_lower": escape_html(threshold_label.lower()),
+        "service_name": escape_html(service['name']),
+        "category_name": escape_html(service.get('category_name', 'Uncategorized')),
+        "provider": escape_html(service.get('provider', 'N/A')),
+        "expiry_date": escape_html(service['expiry_date'][:10] if service.get('expiry_date') else "Unknown"),
+        "days_until_expiry": str(days_until_expiry),
+        "owners_html": owners_html,
+        "company_name": escape_html(company_name)
+    }
+
+def render_expiry_email(service: dict, days_until_expiry: int, threshold_label: str, company_name: str) -> CompiledTemplate:
+    """Render the recipient-independent part of an expiry notification once.
+    
+    The result only has the recipient_name field left; fill it per
+    recipient with render({"recipient_name": escape_html(name)}).
+    """
+    values = get_expiry_email_values(service, days_until_expiry, threshold_label, company_name)
+    return compile_template(EXPIRY_EMAIL_TEMPLATE).bind(values)
+
+def get_email_html_template(service: dict, recipient_name: str, days_until_expiry: int, threshold_label: str, company_name: str):
+    """Generate HTML email template for expiry notification"""
+    values = get_expiry_email_values(service, days_until_expiry, threshold_label, company_name)
+    values["recipient_name"] = escape_html(recipient_name)
+    return compile_template(EXPIRY_EMAIL_TEMPLATE).render(values)
+
+def render_digest_row(item: dict) -> str:
+    service = item["service"]
+    return compile_template(DIGEST_ROW_TEMPLATE).render({
+        "color": get_urgency_color(item["days_until_expiry"]),
+        "service_name": escape_html(service['name']),
+        "category_name": escape_html(service.get('category_name', 'Uncategorized')),
+        "provider": escape_html(service.get('provider', 'N/A')),
+        "threshold_label": escape_html(item["threshold_label"]),
+        "expiry_date": escape_html(service['expiry_date'][:10] if service.get('expiry_date') else "Unknown"),
+        "days_until_expiry": str(item["days_until_expiry"])
+    })
+
+def get_digest_email_html_template(recipient_name: str, items: List[dict], company_name: str):
+    """Generate HTML for a digest listing several expiring services, most urgent first.
+    
+    Rows are taken from item["row_html"] when already rendered for another recipient.
+    """
+    items = sorted(items, key=lambda item: item["days_until_expiry"])
+    return compile_template(DIGEST_EMAIL_TEMPLATE).render({
+        "color": get_urgency_color(items[0]["days_until_expiry"]),
+        "service_count": str(len(items)),
+        "recipient_name": escape_html(recipient_name),
+        "rows_html": "".join(item.get("row_html") or render_digest_row(item) for item in items),
+        "company_name": escape_html(company_name)
+    })
+
+# Custom templates are looked up per threshold label (case-insensitive);
+# "*" applies to every label without its own template
+EMAIL_TEMPLATE_WILDCARD = "*"
+EMAIL_TEMPLATE_MAX_BYTES = 100 * 1024
+EMAIL_TEMPLATE_CACHE_TTL_SECONDS = 30
+
+# Fields available to custom templates; HTML values are escaped, subject values are not
+EMAIL_TEMPLATE_HTML_FIELDS = {
+    "recipient_name", "urgency", "urgency_text", "color", "btn_color", "threshold_label",
+    "threshold_label_lower", "service_name", "category_name", "provider", "expiry_date",
+    "days_until_expiry", "owners_html", "company_name"
+}
+EMAIL_TEMPLATE_SUBJECT_FIELDS = {
+    "urgency", "threshold_label", "service_name", "category_name", "provider",
+    "expiry_date", "days_until_expiry", "company_name"
+}
+
+def get_template_label_key(label: str) -> str:
+    return label.strip().lower()
+
+def get_subject_values(service: dict, days_until_expiry: int, threshold_label: str, company_name: str) -> Dict[str, str]:
+    return {
+        "urgency": "URGENT" if days_until_expiry <= 1 else "WARNING" if days_until_expiry <= 7 else "REMINDER",
+        "threshold_label": threshold_label,
+        "service_name": service['name'],
+        "category_name": service.get('category_name', 'Uncategorized'),
+        "provider": service.get('provider', 'N/A'),
+        "expiry_date": service['expiry_date'][:10] if service.get('expiry_date') else "Unknown",
+        "days_until_expiry": str(days_until_expiry),
+        "company_name": company_name
+    }
+
+def validate_email_template(subject: str, html_source: str):
+    """Compile a custom template and render it with sample values; raises HTTPException(400)"""
+    if not subject.strip() or "\n" in subject or "\r" in subject:
+        raise HTTPException(status_code=400, detail="Subject must be a single non-empty line")
+    if len(html_source.encode()) > EMAIL_TEMPLATE_MAX_BYTES:
+        raise HTTPException(status_code=400, detail=f"Template exceeds {EMAIL_TEMPLATE_MAX_BYTES // 1024} KB")
+    
+    for name, source, allowed in (
+        ("subject", subject, EMAIL_TEMPLATE_SUBJECT_FIELDS),
+        ("html", html_source, EMAIL_TEMPLATE_HTML_FIELDS)
+    ):
+        try:
+            template = CompiledTemplate.parse(source)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid {name} template: {str(e)}")
+        unknown = template.fields - allowed
+        if unknown:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown field(s) in {name} template: {', '.join(sorted(unknown))}. Allowed: {', '.join(sorted(allowed))}"
+            )
+    
+    sample_service = {
+        "name": "Sample Service", "provider": "Sample Provider", "category_name": "Software",
+        "expiry_date": datetime.now(timezone.utc).isoformat(), "owners": [{"name": "Owner", "role": "Owner"}]
+    }
+    try:
+        CompiledTemplate.parse(subject).render(get_subject_values(sample_service, 7, "Sample", "Company"))
+        CompiledTemplate.parse(minify_html(html_source)).render({
+            **get_expiry_email_values(sample_service, 7, "Sample", "Company"), "recipient_name": "Recipient"
+        })
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Template failed to render: {str(e)}")
+
+class EmailTemplateStore:
+    """Latest custom template per label, compiled once per version.
+    
+    Active versions are re-read from Mongo at most every
+    EMAIL_TEMPLATE_CACHE_TTL_SECONDS (or immediately after a save in this
+    process); compiled templates are cached by (label, version).
+    """
+    
+    def __init__(self, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self._active: Optional[Dict[str, dict]] = None
+        self._loaded_at = 0.0
+        self._compiled: "OrderedDict[tuple, tuple]" = OrderedDict()
+    
+    def invalidate(self):
+        self._active = None
+    
+    async def load_active(self) -> Dict[str, dict]:
+        if self._active is None or time.monotonic() - self._loaded_at > self.ttl_seconds:
+            active = {}
+            pipeline = [
+                {"$sort": {"label_key": 1, "version": -1}},
+                {"$group": {"_id": "$label_key", "doc": {"$first": "$$ROOT"}}}
+            ]
+            async for row in db.email_templates.aggregate(pipeline):
+                doc = row["doc"]
+                doc.pop("_id", None)
+                active[row["_id"]] = doc
+            self._active = active
+            self._loaded_at = time.monotonic()
+        return self._active
+    
+    def _compile(self, doc: dict) -> Optional[tuple]:
+        """Compiled (subject, html) for a version; None if it does not compile (logged once)"""
+        key = (doc["label_key"], doc["version"])
+        if key not in self._compiled:
+            try:
+                self._compiled[key] = (
+                    CompiledTemplate.parse(doc["subject"]),
+                    CompiledTemplate.parse(minify_html(doc["html"]))
+                )
+            except Exception as e:
+                logger.error(f"Template '{doc['label']}' v{doc['version']} does not compile, using the built-in one: {str(e)}")
+                self._compiled[key] = None
+            if len(self._compiled) > 256:
+                self._compiled.popitem(last=False)
+        return self._compiled[key]
+    
+    async def get(self, threshold_label: str) -> Optional[tuple]:
+        """(doc, compiled subject, compiled html) for a label, or None for the built-in template"""
+        active = await self.load_active()
+        doc = active.get(get_template_label_key(threshold_label)) or active.get(EMAIL_TEMPLATE_WILDCARD)
+        compiled = self._compile(doc) if doc else None
+        return (doc, *compiled) if compiled else None
+
+email_template_store = EmailTemplateStore(EMAIL_TEMPLATE_CACHE_TTL_SECONDS)
+
+async def render_notification(service: dict, days_until_expiry: int, threshold_label: str, company_name: str) -> tuple:
+    """Subject and recipient-independent body of a reminder.
+    
+    Uses the custom template for the threshold label when there is one and
+    falls back to the built-in template if it cannot be rendered. The body
+    only has recipient_name left to fill in.
+    """
+    try:
+        custom = await email_template_store.get(threshold_label)
+        if custom:
+            doc, subject_template, html_template = custom
+            subject = subject_template.render(get_subject_values(service, days_until_expiry, threshold_label, company_name))
+            values = get_expiry_email_values(service, days_until_expiry, threshold_label, company_name)
+            return " ".join(subject.split()), html_template.bind(values)
+    except Exception as e:
+        logger.error(f"Custom template for '{threshold_label}' failed, using the built-in one: {str(e)}")
+    
+    return (
+        get_notification_subject(service, days_until_expiry),
+        render_expiry_email(service, days_until_expiry, threshold_label, company_name)
+    )
+
+@api_router.get("/email-templates")
+async def list_email_templates(current_user: dict = Depends(get_admin_user)):
+    """Active custom templates per label, plus the built-in template and available fields"""
+    email_template_store.invalidate()
+    active = await email_template_store.load_active()
+    return {
+        "templates": sorted(active.values(), key=lambda doc: doc["label_key"]),
+        "builtin": {"html": EXPIRY_EMAIL_TEMPLATE.strip()},
+        "html_fields": sorted(EMAIL_TEMPLATE_HTML_FIELDS),
+        "subject_fields": sorted(EMAIL_TEMPLATE_SUBJECT_FIELDS)
+    }
+
+@api_router.get("/email-templates/{label}")
+async def get_email_template_versions(label: str, current_user: dict = Depends(get_admin_user)):
+    """All saved versions for a label, newest first"""
+    versions = await db.email_templates.find(
+        {"label_key": get_template_label_key(label)}, {"_id": 0}
+    ).sort("version", -1).to_list(100)
+    if not versions:
+        raise HTTPException(status_code=404, detail="No custom template for this label")
+    return versions
+
+async def save_email_template(label: str, subject: str, html_source: str, user_id: str) -> dict:
+    validate_email_template(subject, html_source)
+    label_key = get_template_label_key(label)
+    latest = await db.email_templates.find_one({"label_key": label_key}, {"_id": 0, "version": 1}, sort=[("version", -1)])
+    template = EmailTemplate(
+        label=label.strip(),
+        label_key=label_key,
+        version=(latest["version"] + 1) if latest else 1,
+        subject=subject,
+        html=html_source,
+        created_by=user_id
+    )
+    try:
+        await db.email_templates.insert_one(template.model_dump())
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Template was modified concurrently, please retry")
+    email_template_store.invalidate()
+    return template.model_dump()
+
+@api_router.put("/email-templates/{label}")
+async def update_email_template(label: str, template_data: EmailTemplateUpdate, current_user: dict = Depends(get_admin_user)):
+    """Save a new version of the template for a threshold label ("*" for all labels)"""
+    if not label.strip():
+        raise HTTPException(status_code=400, detail="Label is required")
+    return await save_email_template(label, template_data.subject, template_data.html, current_user["id"])
+
+@api_router.post("/email-templates/{label}/revert/{version}")
+async def revert_email_template(label: str, version: int, current_user: dict = Depends(get_admin_user)):
+    """Save an earlier version again as the newest one"""
+    doc = await db.email_templates.find_one({"label_key": get_template_label_key(label), "version": version}, {"_id": 0})
+    if not doc:
+        raise HTTPException(status_code=404, detail="Template version not found")
+    return await save_email_template(doc["label"], doc["subject"], doc["html"], current_user["id"])
+
+@api_router.delete("/email-templates/{label}")
+async def delete_email_template(label: str, current_user: dict = Depends(get_admin_user)):
+    """Remove all versions for a label so the built-in template is used again"""
+    result = await db.email_templates.delete_many({"label_key": get_template_label_key(label)})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="No custom template for this label")
+    email_template_store.invalidate()
+    return {"message": "Template removed, using the built-in template"}
+
+def get_notification_subject(service: dict, days_until_expiry: int) -> str:
+    if days_until_expiry <= 1:
+        return f"URGENT: Service \"{service['name']}\" expires {'TODAY' if days_until_expiry <= 0 else 'TOMORROW'}!"
+    if days_until_expiry <= 7:
+        return f"WARNING: Service \"{service['name']}\" expires in {days_until_expiry} days!"
+    return f"Reminder: Service \"{service['name']}\" is Expiring Soon!"
+
+def get_notification_recipients(service: dict) -> List[dict]:
+    """Collect all recipients of a service (owners + legacy contact)"""
     recipients = []
     
     # Add owners
@@ -1058,201 +2783,1667 @@ async def send_expiry_notifications(service: dict, days_until_expiry: int, thres
                 "role": "Primary Contact"
             })
     
+    return recipients
+
+async def send_expiry_notifications(service: dict, days_until_expiry: int, threshold_id: str, threshold_label: str):
+    """Queue expiry notifications for all service owners in the email outbox"""
+    settings = await get_app_settings()
+    company_name = settings.get("company_name", COMPANY_NAME)
+    
+    recipients = get_notification_recipients(service)
+    
     if not recipients:
         logger.warning(f"No recipients found for service {service['name']}")
         return {"status": "no_recipients", "recipients": []}
     
-    # Build subject
-    subject = f"Reminder: Service \"{service['name']}\" is Expiring Soon!"
-    if days_until_expiry <= 1:
-        subject = f"URGENT: Service \"{service['name']}\" expires {'TODAY' if days_until_expiry <= 0 else 'TOMORROW'}!"
-    elif days_until_expiry <= 7:
-        subject = f"WARNING: Service \"{service['name']}\" expires in {days_until_expiry} days!"
+    # Render each message into the outbox; workers fill in the delivery
+    # status of the notification log created below
+    notification_log_id = str(uuid.uuid4())
+    
+    # Everything but the greeting is the same for all recipients
+    subject, body = await render_notification(service, days_until_expiry, threshold_label, company_name)
+    
+    jobs = []
+    claims = {}
+    for recipient in recipients:
+        html_content = body.render({"recipient_name": escape_html(recipient["name"])})
+        job = OutboxJob(
+            to_email=recipient["email"],
+            to_name=recipient["name"],
+            subject=subject,
+            html=html_content,
+            service_id=service["id"],
+            service_name=service["name"],
+            threshold_id=threshold_id,
+            threshold_label=threshold_label,
+            days_until_expiry=days_until_expiry,
+            notification_log_id=notification_log_id,
+            # Manual reminders may be repeated, so they keep a random key
+            **({} if threshold_id == "manual" else {
+                "idempotency_key": get_idempotency_key(service, threshold_id, recipient["email"])
+            })
+        )
+        jobs.append(job)
+        if threshold_id != "manual":
+            claims.setdefault(job.idempotency_key, job.id)
+    
+    # Skip recipients who already got this reminder, possibly in a digest
+    claimed = await claim_notification_pairs(claims)
+    jobs = [job for job in jobs if job.idempotency_key in claimed or job.idempotency_key not in claims]
+    claims = {key: job_id for key, job_id in claims.items() if key in claimed}
+    queued = await enqueue_claimed_jobs(jobs, claims)
+    if not queued:
+        logger.info(f"'{threshold_label}' for {service['name']} already queued for all recipients")
+        return {"status": "duplicate", "recipients": []}
+    
+    notification_log = NotificationLog(
+        id=notification_log_id,
+        service_id=service["id"],
+        service_name=service["name"],
+        threshold_id=threshold_id,
+        threshold_label=threshold_label,
+        days_until_expiry=days_until_expiry,
+        recipients=[{"email": job.to_email, "name": job.to_name, "status": "pending"} for job in queued],
+        status="pending"
+    )
+    await notification_log_writer.add(InsertOne(notification_log.model_dump()))
+    
+    return {"status": "queued", "recipients": notification_log.recipients}
+
+DEFAULT_REMINDER_THRESHOLDS = [
+    {"id": "default_30", "days_before": 30, "label": "First reminder"},
+    {"id": "default_7", "days_before": 7, "label": "Second reminder"},
+    {"id": "default_1", "days_before": 1, "label": "Final reminder"}
+]
+
+def get_sorted_thresholds(service: dict) -> List[dict]:
+    """Per-service thresholds (or the defaults), sorted by days_before descending"""
+    thresholds = service.get("reminder_thresholds") or DEFAULT_REMINDER_THRESHOLDS
+    return sorted(thresholds, key=lambda x: x.get("days_before", 0), reverse=True)
+
+def get_threshold_id(threshold: dict) -> str:
+    return threshold.get("id", str(threshold.get("days_before", 0)))
+
+def compute_next_notification_at(service: dict) -> Optional[datetime]:
+    """Earliest moment an unsent threshold of the service becomes due, or None.
+    
+    A threshold is due once (expiry - now).days <= days_before, i.e. once now
+    passes expiry - (days_before + 1) days.
+    """
+    if service.get("status", "active") != "active" or not service.get("expiry_date"):
+        return None
+    try:
+        expiry_date = parse_expiry_date(service["expiry_date"])
+    except ValueError:
+        return None
+    
+    notifications_sent = set(service.get("notifications_sent", []))
+    due_times = [
+        expiry_date - timedelta(days=threshold.get("days_before", 0) + 1)
+        for threshold in get_sorted_thresholds(service)
+        if get_threshold_id(threshold) not in notifications_sent
+    ]
+    return min(due_times) if due_times else None
+
+def get_due_threshold(service: dict, now: datetime) -> Optional[dict]:
+    """The first due, unsent threshold of a service (only one is sent per check)"""
+    expiry_str = service.get("expiry_date", "")
+    if not expiry_str:
+        return None
+    
+    days_until = (parse_expiry_date(expiry_str) - now).days
+    notifications_sent = service.get("notifications_sent", [])
+    
+    for threshold in get_sorted_thresholds(service):
+        threshold_id = get_threshold_id(threshold)
+        days_before = threshold.get("days_before", 0)
+        
+        # Check if already sent for this threshold
+        if threshold_id in notifications_sent:
+            continue
+        
+        # Check if we should send this notification
+        if days_until <= days_before:
+            return {
+                "threshold_id": threshold_id,
+                "threshold_label": threshold.get("label", f"{days_before} day reminder"),
+                "days_until_expiry": days_until
+            }
+    return None
+
+async def mark_threshold_sent(service: dict, threshold_id: Optional[str]):
+    """Record a queued threshold and reschedule the service's next notification.
+    
+    The write only applies while the service still has the expiry date and
+    update time it was scanned with; an edit in between resets the
+    thresholds and schedule itself, which this copy must not overwrite.
+    """
+    notifications_sent = list(service.get("notifications_sent", []))
+    if threshold_id and threshold_id not in notifications_sent:
+        notifications_sent.append(threshold_id)
+    
+    service["notifications_sent"] = notifications_sent
+    update = {"$set": {"next_notification_at": compute_next_notification_at(service)}}
+    if threshold_id:
+        # $addToSet keeps overlapping runs from clobbering each other's progress
+        update["$addToSet"] = {"notifications_sent": threshold_id}
+    await service_state_writer.add(UpdateOne(
+        {"id": service["id"], "expiry_date": service.get("expiry_date"), "updated_at": service.get("updated_at")},
+        update
+    ))
+
+async def process_due_service(service: dict, now: datetime) -> Optional[dict]:
+    """Queue the first due, unsent threshold notification for a service and reschedule it.
+    
+    Returns the result of send_expiry_notifications, or None if nothing was queued.
+    """
+    due = get_due_threshold(service, now)
+    result = None
+    if due:
+        try:
+            result = await send_expiry_notifications(service, due["days_until_expiry"], due["threshold_id"], due["threshold_label"])
+            logger.info(f"Queued '{due['threshold_label']}' notification for {service['name']}")
+        except Exception as e:
+            # Leave next_notification_at untouched so the next run retries
+            logger.error(f"Failed to send notification for {service['name']}: {str(e)}")
+            raise
+    
+    await mark_threshold_sent(service, due["threshold_id"] if due else None)
+    return result
+
+async def send_digest_notifications(due_services: List[dict], now: datetime, progress: "JobProgress", deadline: Optional[float] = None):
+    """Queue one email per recipient covering all of their due (service, threshold) pairs.
+    
+    Recipients with a single due pair get the regular per-service email.
+    Every pair still gets its own notification log and email log entries.
+    Services not reached by `deadline` (event loop time) are left for the next run.
+    """
+    settings = await get_app_settings()
+    company_name = settings.get("company_name", COMPANY_NAME)
+    loop = asyncio.get_running_loop()
+    
+    items = []
+    by_recipient: Dict[str, dict] = {}
+    for position, service in enumerate(due_services):
+        if deadline is not None and loop.time() >= deadline:
+            progress.incr("deferred_services", len(due_services) - position)
+            break
+        due = get_due_threshold(service, now)
+        if not due:
+            await mark_threshold_sent(service, None)
+            continue
+        item = {**due, "service": service, "notification_log_id": str(uuid.uuid4())}
+        item["row_html"] = render_digest_row(item)
+        items.append(item)
+        for recipient in get_notification_recipients(service):
+            entry = by_recipient.setdefault(recipient["email"].lower(), {
+                "recipient": recipient, "items": [], "job_id": str(uuid.uuid4())
+            })
+            entry["items"].append(item)
+        await progress.maybe_flush()
+    
+    # Claim every (service, threshold, recipient) pair for the job of its
+    # recipient and leave out pairs that were already sent
+    claims = {
+        get_idempotency_key(item["service"], item["threshold_id"], entry["recipient"]["email"]): entry["job_id"]
+        for entry in by_recipient.values()
+        for item in entry["items"]
+    }
+    claimed = await claim_notification_pairs(claims)
+    claims = {key: job_id for key, job_id in claims.items() if key in claimed}
+    
+    jobs = []
+    for entry in by_recipient.values():
+        recipient = entry["recipient"]
+        recipient_items = [
+            item for item in entry["items"]
+            if get_idempotency_key(item["service"], item["threshold_id"], recipient["email"]) in claimed
+        ]
+        await progress.maybe_flush()
+        if not recipient_items:
+            continue
+        first = recipient_items[0]
+        if len(recipient_items) == 1:
+            subject, body = await render_notification(
+                first["service"], first["days_until_expiry"], first["threshold_label"], company_name
+            )
+            jobs.append(OutboxJob(
+                id=entry["job_id"],
+                to_email=recipient["email"],
+                to_name=recipient["name"],
+                subject=subject,
+                html=body.render({"recipient_name": escape_html(recipient["name"])}),
+                service_id=first["service"]["id"],
+                service_name=first["service"]["name"],
+                threshold_id=first["threshold_id"],
+                threshold_label=first["threshold_label"],
+                days_until_expiry=first["days_until_expiry"],
+                notification_log_id=first["notification_log_id"],
+                idempotency_key=get_idempotency_key(first["service"], first["threshold_id"], recipient["email"])
+            ))
+            continue
+        
+        most_urgent = min(item["days_until_expiry"] for item in recipient_items)
+        subject = f"{len(recipient_items)} services are expiring soon"
+        if most_urgent <= 1:
+            subject = f"URGENT: {subject}"
+        elif most_urgent <= 7:
+            subject = f"WARNING: {subject}"
+        pair_keys = sorted(
+            get_idempotency_key(item["service"], item["threshold_id"], recipient["email"])
+            for item in recipient_items
+        )
+        jobs.append(OutboxJob(
+            id=entry["job_id"],
+            to_email=recipient["email"],
+            to_name=recipient["name"],
+            subject=subject,
+            html=get_digest_email_html_template(recipient["name"], recipient_items, company_name),
+            service_id="digest",
+            service_name=f"{len(recipient_items)} services",
+            threshold_id="digest",
+            threshold_label="Digest",
+            days_until_expiry=most_urgent,
+            digest_items=[{
+                "service_id": item["service"]["id"],
+                "service_name": item["service"]["name"],
+                "threshold_id": item["threshold_id"],
+                "threshold_label": item["threshold_label"],
+                "days_until_expiry": item["days_until_expiry"],
+                "notification_log_id": item["notification_log_id"]
+            } for item in recipient_items],
+            idempotency_key="digest:" + hashlib.sha256("|".join(pair_keys).encode()).hexdigest()
+        ))
+    
+    queued = await enqueue_claimed_jobs(jobs, claims)
+    progress.incr("emails_queued", len(queued))
+    
+    # Notification logs list the recipients whose email was actually queued
+    queued_by_log: Dict[str, List[dict]] = {}
+    for job in queued:
+        for log_id in [i["notification_log_id"] for i in job.digest_items] or [job.notification_log_id]:
+            queued_by_log.setdefault(log_id, []).append({"email": job.to_email, "name": job.to_name, "status": "pending"})
+    
+    logs = [
+        NotificationLog(
+            id=item["notification_log_id"],
+            service_id=item["service"]["id"],
+            service_name=item["service"]["name"],
+            threshold_id=item["threshold_id"],
+            threshold_label=item["threshold_label"],
+            days_until_expiry=item["days_until_expiry"],
+            recipients=queued_by_log[item["notification_log_id"]],
+            status="pending"
+        ).model_dump()
+        for item in items
+        if item["notification_log_id"] in queued_by_log
+    ]
+    await notification_log_writer.extend([InsertOne(log) for log in logs])
+    progress.incr("notifications_queued", len(logs))
+    
+    for item in items:
+        try:
+            await mark_threshold_sent(item["service"], item["threshold_id"])
+        except Exception as e:
+            progress.incr("errors")
+            logger.error(f"Error rescheduling service {item['service'].get('name', 'unknown')}: {str(e)}")
+
+async def notify_if_due(service_id: str):
+    """Queue a due notification for one service right away instead of at the next scan.
+    
+    In digest mode the service is left for the next scan, so it is listed in
+    the recipients' digest rather than sent in an email of its own.
+    """
+    settings = await get_app_settings()
+    if settings.get("notification_digest"):
+        return
+    now = datetime.now(timezone.utc)
+    service = await db.services.find_one(
+        {"id": service_id, "status": "active", "next_notification_at": {"$lte": now}},
+        {"_id": 0}
+    )
+    if not service:
+        return
+    try:
+        await process_due_service(service, now)
+    except Exception as e:
+        logger.error(f"Immediate notification for {service.get('name', service_id)} failed: {str(e)}")
+
+def schedule_notification_if_due(background_tasks: BackgroundTasks, service_id: str, next_notification_at: Optional[datetime]):
+    """After a service write, queue its notification once the response is sent if a threshold is already due"""
+    if next_notification_at and next_notification_at <= datetime.now(timezone.utc):
+        background_tasks.add_task(notify_if_due, service_id)
+
+async def check_expiring_services(progress: Optional["JobProgress"] = None) -> dict:
+    """Queue notifications for services whose next_notification_at is due.
+    
+    Due services are processed concurrently; each service's thresholds are
+    still handled in order by a single task. Counts and phase durations are
+    reported through progress when the run is tracked as a job.
+    """
+    logger.info("Running expiry check...")
+    progress = progress or JobProgress(None)
+    now = datetime.now(timezone.utc)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + EXPIRY_CHECK_DEADLINE_SECONDS if EXPIRY_CHECK_DEADLINE_SECONDS > 0 else None
+    
+    notification_dispatcher.start_scan()
+    try:
+        async with progress.phase("select"):
+            due_services = await db.services.find(
+                {"status": "active", "next_notification_at": {"$lte": now}},
+                {"_id": 0}
+            ).to_list(None)
+            progress.counts["due_services"] = len(due_services)
+        
+        # Bound the number of services in progress so a large backlog does not
+        # turn into one task per service
+        service_slots = asyncio.Semaphore(NOTIFICATION_MAX_CONCURRENCY)
+        
+        async def run_service(service: dict):
+            async with service_slots:
+                try:
+                    if deadline is not None and loop.time() >= deadline:
+                        # Still due, so the next run picks it up
+                        progress.incr("deferred_services")
+                        return
+                    result = await process_due_service(service, now)
+                    if result and result.get("status") == "queued":
+                        progress.incr("notifications_queued")
+                        progress.incr("emails_queued", len(result["recipients"]))
+                except Exception as e:
+                    progress.incr("errors")
+                    logger.error(f"Error processing service {service.get('name', 'unknown')}: {str(e)}")
+                finally:
+                    notification_dispatcher.services_pending -= 1
+                    await progress.maybe_flush()
+        
+        settings = await get_app_settings()
+        async with progress.phase("enqueue"):
+            if settings.get("notification_digest"):
+                await send_digest_notifications(due_services, now, progress, deadline)
+            else:
+                notification_dispatcher.services_pending += len(due_services)
+                await asyncio.gather(*[run_service(service) for service in due_services])
+        
+        # The next run must see this run's threshold bookkeeping
+        async with progress.phase("flush"):
+            await flush_write_buffers()
+    finally:
+        notification_dispatcher.finish_scan()
+    
+    deferred = progress.counts.get("deferred_services", 0)
+    if deferred:
+        logger.warning(f"Expiry check deadline of {EXPIRY_CHECK_DEADLINE_SECONDS:g}s reached; {deferred} service(s) left for the next run")
+    logger.info(f"Expiry check completed - {len(due_services) - deferred} due service(s) processed")
+    return progress.counts
+
+async def backfill_next_notification_at():
+    """Compute next_notification_at for services stored before the field existed"""
+    operations = []
+    updated = 0
+    cursor = db.services.find({"next_notification_at": {"$exists": False}}, {"_id": 0})
+    async for service in cursor:
+        operations.append(UpdateOne(
+            {"id": service["id"]},
+            {"$set": {"next_notification_at": compute_next_notification_at(service)}}
+        ))
+        if len(operations) >= 500:
+            await db.services.bulk_write(operations, ordered=False)
+            updated += len(operations)
+            operations = []
+    if operations:
+        await db.services.bulk_write(operations, ordered=False)
+        updated += len(operations)
+    if updated:
+        logger.info(f"Backfilled next_notification_at for {updated} service(s)")
+
+# ==================== EMAIL OUTBOX ====================
+
+# Outbox worker loops claiming jobs per process; concurrent sends are bounded
+# by NOTIFICATION_MAX_CONCURRENCY and the provider's concurrency cap
+OUTBOX_WORKERS = int(os.environ.get('OUTBOX_WORKERS', '4'))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '5'))
+OUTBOX_LEASE_SECONDS = int(os.environ.get('OUTBOX_LEASE_SECONDS', '120'))
+OUTBOX_RETRY_BASE_SECONDS = int(os.environ.get('OUTBOX_RETRY_BASE_SECONDS', '30'))
+OUTBOX_POLL_SECONDS = float(os.environ.get('OUTBOX_POLL_SECONDS', '2'))
+# How long delivered jobs are kept before the TTL index removes them
+OUTBOX_RETENTION_DAYS = int(os.environ.get('OUTBOX_RETENTION_DAYS', '7'))
+OUTBOX_SETTINGS_TTL_SECONDS = 30
+
+def get_idempotency_key(service: dict, threshold_id: str, recipient_email: str) -> str:
+    return f"{service['id']}:{threshold_id}:{recipient_email.lower()}:{service.get('expiry_date', '')}"
+
+async def enqueue_outbox_jobs(jobs: List[OutboxJob]) -> List[OutboxJob]:
+    """Insert jobs, skipping any whose idempotency key is already queued or sent.
+    
+    Returns the jobs that were actually inserted.
+    """
+    if not jobs:
+        return []
+    try:
+        await db.email_outbox.insert_many([job.model_dump() for job in jobs], ordered=False)
+        return jobs
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(err.get("code") != 11000 for err in errors):
+            raise
+        duplicates = {err["index"] for err in errors}
+        return [job for i, job in enumerate(jobs) if i not in duplicates]
+
+# How long sent (service, threshold, recipient) pairs are remembered; pair
+# keys include the expiry date, so this only needs to outlast one term
+NOTIFICATION_CLAIM_RETENTION_DAYS = 400
+
+async def claim_notification_pairs(claims: Dict[str, str]) -> set:
+    """Claim (service, threshold, recipient) pairs for outbox jobs; returns the pair keys claimed.
+    
+    `claims` maps idempotency keys of pairs to the id of the job that will
+    send them. Each pair can be claimed once (unique _id), whether it goes
+    out as a regular or a digest email, so a digest never repeats pairs that
+    were already sent on their own or in an earlier digest. A claim whose
+    job never reached the outbox (the run died in between) is taken over
+    once it is older than a lease; claims of sent or dead-lettered jobs
+    never are, as their outbox documents expire long before the claims do.
+    """
+    if not claims:
+        return set()
+    now = datetime.now(timezone.utc)
+    docs = [{"_id": key, "job_id": job_id, "status": "queued", "created_at": now} for key, job_id in claims.items()]
+    try:
+        await db.notification_claims.insert_many(docs, ordered=False)
+        return set(claims)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(err.get("code") != 11000 for err in errors):
+            raise
+        taken = [docs[err["index"]]["_id"] for err in errors]
+    claimed = set(claims) - set(taken)
+    
+    stale = await db.notification_claims.find({
+        "_id": {"$in": taken},
+        "status": "queued",
+        "created_at": {"$lt": now - timedelta(seconds=OUTBOX_LEASE_SECONDS)}
+    }).to_list(None)
+    queued = set(await db.email_outbox.distinct("id", {"id": {"$in": [claim["job_id"] for claim in stale]}}))
+    for claim in stale:
+        if claim["job_id"] in queued:
+            continue
+        result = await db.notification_claims.update_one(
+            {"_id": claim["_id"], "job_id": claim["job_id"]},
+            {"$set": {"job_id": claims[claim["_id"]], "created_at": now}}
+        )
+        if result.modified_count:
+            claimed.add(claim["_id"])
+    return claimed
+
+async def mark_notification_pairs(job_id: str, status: str):
+    """Record that the job holding these claims reached a final status (sent or dead)"""
+    await db.notification_claims.update_many({"job_id": job_id}, {"$set": {"status": status}})
+
+async def release_notification_pairs(claims: Dict[str, str]):
+    """Undo claims whose jobs could not be queued"""
+    for key, job_id in claims.items():
+        await db.notification_claims.delete_one({"_id": key, "job_id": job_id})
+
+async def enqueue_claimed_jobs(jobs: List[OutboxJob], claims: Dict[str, str]) -> List[OutboxJob]:
+    """enqueue_outbox_jobs for jobs whose pairs were claimed; the claims are released if that fails"""
+    try:
+        return await enqueue_outbox_jobs(jobs)
+    except BaseException:
+        await asyncio.shield(release_notification_pairs(claims))
+        raise
+
+def get_claimable_filter(now: datetime) -> dict:
+    """Jobs that are due, including jobs whose lease expired"""
+    return {"$or": [
+        {"status": "pending", "available_at": {"$lte": now}},
+        {"status": "sending", "lease_expires_at": {"$lte": now}}
+    ]}
+
+def get_lease_update(owner: str, now: datetime) -> dict:
+    return {
+        "$set": {
+            "status": "sending",
+            "lease_owner": owner,
+            "lease_expires_at": now + timedelta(seconds=OUTBOX_LEASE_SECONDS)
+        },
+        "$inc": {"attempts": 1}
+    }
+
+async def claim_outbox_job(worker_id: str) -> Optional[dict]:
+    """Atomically lease the next available job"""
+    now = datetime.now(timezone.utc)
+    return await db.email_outbox.find_one_and_update(
+        get_claimable_filter(now),
+        get_lease_update(worker_id, now),
+        projection={"_id": 0},
+        sort=[("available_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+async def claim_outbox_batch(worker_id: str, limit: int) -> List[dict]:
+    """Lease up to `limit` available jobs under one claim id.
+    
+    Candidates picked by another worker in the meantime fail the claim
+    filter in update_many and are simply not returned.
+    """
+    now = datetime.now(timezone.utc)
+    candidates = await db.email_outbox.find(
+        get_claimable_filter(now), {"_id": 0, "id": 1}
+    ).sort("available_at", 1).limit(limit).to_list(limit)
+    if not candidates:
+        return []
+    
+    ids = [job["id"] for job in candidates]
+    claim_id = f"{worker_id}:{uuid.uuid4().hex[:8]}"
+    await db.email_outbox.update_many(
+        {"id": {"$in": ids}, **get_claimable_filter(now)},
+        get_lease_update(claim_id, now)
+    )
+    return await db.email_outbox.find(
+        {"id": {"$in": ids}, "lease_owner": claim_id}, {"_id": 0}
+    ).sort("available_at", 1).to_list(limit)
+
+def get_retry_delay(attempts: int) -> timedelta:
+    """Exponential backoff with jitter: base * 2^(attempts - 1)"""
+    delay = OUTBOX_RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+    return timedelta(seconds=delay * random.uniform(0.5, 1))
+
+async def record_outbox_result(job: dict, status: str, error: str = "", provider_message_id: Optional[str] = None):
+    """Write the final delivery outcome to email_logs and the notification log(s).
+    
+    A digest email is logged once per (service, threshold) pair it covers.
+    """
+    items = job.get("digest_items") or [job]
+    await email_log_writer.extend([
+        InsertOne(EmailLog(
+            service_id=item["service_id"],
+            service_name=item["service_name"],
+            recipient_email=job["to_email"],
+            recipient_name=job["to_name"],
+            threshold_id=item["threshold_id"],
+            threshold_label=item["threshold_label"],
+            days_until_expiry=item["days_until_expiry"],
+            status=status,
+            provider_message_id=provider_message_id,
+            error=error or None
+        ).model_dump())
+        for item in items
+    ])
+    
+    recipient_update = {"status": status}
+    if error:
+        recipient_update["error"] = error
+    for item in items:
+        if not item.get("notification_log_id"):
+            continue
+        await notification_log_writer.add(UpdateOne({"id": item["notification_log_id"]}, [
+            {"$set": {"recipients": {"$map": {
+                "input": "$recipients",
+                "as": "r",
+                "in": {"$cond": [
+                    {"$eq": ["$$r.email", job["to_email"]]},
+                    {"$mergeObjects": ["$$r", recipient_update]},
+                    "$$r"
+                ]}
+            }}}},
+            {"$set": {"status": {"$switch": {
+                "branches": [
+                    {"case": {"$in": ["pending", "$recipients.status"]}, "then": "pending"},
+                    {"case": {"$allElementsTrue": [{"$map": {
+                        "input": "$recipients", "as": "r", "in": {"$eq": ["$$r.status", "sent"]}
+                    }}]}, "then": "sent"},
+                    {"case": {"$in": ["sent", "$recipients.status"]}, "then": "partial"}
+                ],
+                "default": "failed"
+            }}}}
+        ]), retry_id=item["notification_log_id"])
+
+async def complete_outbox_job(job: dict, error: Optional[str] = None, permanent: bool = False, provider_message_id: Optional[str] = None):
+    """Record success, a scheduled retry or a dead letter for a leased job"""
+    owned = {"id": job["id"], "lease_owner": job["lease_owner"]}
+    
+    if error is None:
+        # Claims first: a crash in between leaves a job that is re-sent under
+        # its idempotency key, never a claim that could be taken over
+        await mark_notification_pairs(job["id"], "sent")
+        result = await db.email_outbox.update_one(owned, {"$set": {
+            "status": "sent", "lease_owner": None, "completed_at": datetime.now(timezone.utc)
+        }})
+        if not result.matched_count:
+            # The lease expired and another worker owns the job; it logs the outcome
+            logger.warning(f"Lease on email to {job['to_email']} was lost before it was marked sent")
+            return
+        await record_outbox_result(job, "sent", provider_message_id=provider_message_id)
+        logger.info(f"Email sent to {job['to_email']} for service {job['service_name']}")
+    elif permanent or job["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+        logger.error(f"Dead-lettering email to {job['to_email']} after {job['attempts']} attempt(s): {error}")
+        await mark_notification_pairs(job["id"], "dead")
+        result = await db.email_outbox.update_one(owned, {"$set": {
+            "status": "dead", "last_error": error, "lease_owner": None
+        }})
+        if result.matched_count:
+            await record_outbox_result(job, "failed", error)
+    else:
+        logger.warning(f"Email to {job['to_email']} failed (attempt {job['attempts']}), retrying: {error}")
+        await db.email_outbox.update_one(owned, {"$set": {
+            "status": "pending",
+            "last_error": error,
+            "lease_owner": None,
+            "available_at": datetime.now(timezone.utc) + get_retry_delay(job["attempts"])
+        }})
+
+async def defer_outbox_jobs(jobs: List[dict], until: datetime, reason: str):
+    """Put leased jobs back without using up an attempt (throttling, quota)"""
+    for job in jobs:
+        await db.email_outbox.update_one(
+            {"id": job["id"], "lease_owner": job["lease_owner"]},
+            {"$set": {"status": "pending", "last_error": reason, "lease_owner": None, "available_at": until},
+             "$inc": {"attempts": -1}}
+        )
+    logger.warning(f"Deferred {len(jobs)} email(s) until {until.isoformat()}: {reason}")
+
+def get_next_quota_day() -> datetime:
+    return get_quota_day() + timedelta(days=1)
+
+async def send_with_deadline(provider: str, send_fn: Callable[[], Awaitable[Any]]) -> Any:
+    """Run one provider call, cancelling it after EMAIL_SEND_TIMEOUT_SECONDS.
+    
+    Cancellation discards the SMTP session or HTTP connection in use, so a
+    hung server cannot hold up the worker or return a half-used session to
+    the pool.
+    """
+    try:
+        # Runs in the calling task, unlike wait_for which schedules a new one per send
+        async with asyncio.timeout(EMAIL_SEND_TIMEOUT_SECONDS):
+            return await send_fn()
+    except TimeoutError:
+        raise TimeoutError(f"Send through {provider} timed out after {EMAIL_SEND_TIMEOUT_SECONDS:g}s")
+
+def get_lease_budget(jobs: List[dict]) -> float:
+    """Seconds the jobs may wait for a send slot and still finish sending within their lease"""
+    expires_at = min(job["lease_expires_at"] for job in jobs)
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    remaining = (expires_at - datetime.now(timezone.utc)).total_seconds()
+    return max(0.0, remaining - EMAIL_SEND_TIMEOUT_SECONDS)
+
+async def send_rate_limited(provider_settings: dict, jobs: List[dict], send_fn: Callable[[], Awaitable[Any]]) -> Optional[Any]:
+    """Make one provider call for `jobs` under the provider's rate limiter.
+    
+    A throttling response slows the limiter down, defers the jobs by its
+    backoff and releases their reserved quota, returning None; other errors
+    propagate. Jobs are also deferred, rather than waited on, when the
+    limiter cannot let them through while their lease still leaves time to
+    send them, so an expired lease never leads to a second delivery.
+    """
+    provider_id = provider_settings["provider_id"]
+    provider = provider_settings.get("email_provider", "resend")
+    limiter = get_rate_limiter(provider_settings)
+    if not await limiter.acquire(timeout=get_lease_budget(jobs)):
+        await release_daily_quota(provider_id, len(jobs))
+        until = datetime.now(timezone.utc) + timedelta(seconds=max(1.0, limiter.paused_for()))
+        await defer_outbox_jobs(jobs, until, f"Waiting for the {provider_id} rate limit")
+        return None
+    try:
+        result = await notification_dispatcher.send(provider, lambda: send_with_deadline(provider, send_fn), messages=len(jobs))
+    except Exception as e:
+        retry_after = get_throttle_retry_after(e)
+        if retry_after is None:
+            raise
+        backoff = await limiter.on_throttled(retry_after)
+        await release_daily_quota(provider_id, len(jobs))
+        await defer_outbox_jobs(jobs, datetime.now(timezone.utc) + timedelta(seconds=backoff), f"Throttled by {provider_id}: {str(e)}")
+        return None
+    await limiter.on_success()
+    return result
+
+def is_lease_exhausted(job: dict) -> bool:
+    """A job whose lease expired repeatedly (e.g. worker crashes) is dead-lettered"""
+    return job["attempts"] > OUTBOX_MAX_ATTEMPTS
+
+async def deliver_outbox_job(job: dict, settings: dict):
+    """Send a leased job through the first available provider and record the outcome.
+    
+    A provider failure counts against that provider's circuit and the job
+    fails over to the next provider straight away; providers with an open
+    circuit or no daily quota left are skipped without being tried.
+    """
+    if is_lease_exhausted(job):
+        await complete_outbox_job(job, job.get("last_error") or "Lease expired too many times", permanent=True)
+        return
+    
+    providers = get_provider_chain(settings)
+    last_error = None
+    quota_reason = None
+    for provider_settings in providers:
+        provider_id = provider_settings["provider_id"]
+        provider = provider_settings.get("email_provider", "resend")
+        limit = get_provider_limits(provider, provider_settings)["daily"]
+        if is_quota_exhausted(provider_id):
+            quota_reason = f"Daily {provider_id} quota of {limit} reached"
+            continue
+        breaker = get_circuit_breaker(provider_id)
+        if not breaker.try_acquire():
+            continue
+        try:
+            if not await reserve_daily_quota(provider_id, 1, limit):
+                quota_reason = f"Daily {provider_id} quota of {limit} reached"
+                continue
+            try:
+                result = await send_rate_limited(
+                    provider_settings,
+                    [job],
+                    lambda: send_email_with_provider(
+                        to_email=job["to_email"],
+                        subject=job["subject"],
+                        html_content=job["html"],
+                        settings=provider_settings,
+                        idempotency_key=job["idempotency_key"]
+                    )
+                )
+            except Exception as e:
+                if not is_provider_failure(e):
+                    # The provider answered; the message itself was refused
+                    breaker.record_success()
+                    await complete_outbox_job(job, str(e))
+                    return
+                breaker.record_failure()
+                await release_daily_quota(provider_id, 1)
+                logger.warning(f"Email provider {provider_id} failed, failing over: {str(e)}")
+                last_error = str(e)
+                continue
+            if result is None:
+                return
+            breaker.record_success()
+        finally:
+            breaker.release()
+        
+        # SMTP sends have no provider-side message id
+        message_id = result.get("id") if provider == "resend" and isinstance(result, dict) else None
+        await complete_outbox_job(job, provider_message_id=message_id)
+        return
+    
+    if last_error:
+        await complete_outbox_job(job, last_error)
+    elif quota_reason:
+        await defer_outbox_jobs([job], get_next_quota_day(), quota_reason)
+    else:
+        retry_in = min((get_circuit_breaker(p["provider_id"]).retry_in() for p in providers), default=0.0)
+        await defer_outbox_jobs(
+            [job],
+            datetime.now(timezone.utc) + timedelta(seconds=max(1.0, retry_in)),
+            "No email provider available (circuits open)"
+        )
+
+async def return_to_outbox(jobs: List[dict], reason: str):
+    """Hand leased jobs back to be claimed again, one by one, for the next provider.
+    
+    The attempt counts and the job waits out the retry backoff, so a batch
+    that keeps bouncing (e.g. while the circuit has not opened yet) neither
+    spins the workers nor retries forever.
+    """
+    now = datetime.now(timezone.utc)
+    for job in jobs:
+        await db.email_outbox.update_one(
+            {"id": job["id"], "lease_owner": job["lease_owner"]},
+            {"$set": {
+                "status": "pending",
+                "last_error": reason,
+                "lease_owner": None,
+                "available_at": now + get_retry_delay(job["attempts"])
+            }}
+        )
+    logger.warning(f"Returned {len(jobs)} email(s) to the outbox: {reason}")
+
+async def deliver_outbox_batch(jobs: List[dict], settings: dict):
+    """Send leased jobs through one Resend batch call and record each outcome.
+    
+    Jobs Resend cannot take (provider failure, daily quota) are returned to
+    the outbox when there are fallback providers, rather than sent to them
+    under this batch's lease: a slower fallback could not get through a
+    whole batch before the lease expires.
+    """
+    sendable = []
+    for job in jobs:
+        if is_lease_exhausted(job):
+            await complete_outbox_job(job, job.get("last_error") or "Lease expired too many times", permanent=True)
+        else:
+            sendable.append(job)
+    if not sendable:
+        return
     
-    # Send to each recipient
-    results = []
-    for recipient in recipients:
-        html_content = get_email_html_template(
-            service=service,
-            recipient_name=recipient["name"],
-            days_until_expiry=days_until_expiry,
-            threshold_label=threshold_label,
-            company_name=company_name
-        )
+    provider_settings = get_active_provider(settings)
+    if provider_settings is None or provider_settings.get("email_provider") != "resend":
+        await return_to_outbox(sendable, "Active email provider changed")
+        return
+    provider_id = provider_settings["provider_id"]
+    breaker = get_circuit_breaker(provider_id)
+    if not breaker.try_acquire():
+        await return_to_outbox(sendable, f"Email provider {provider_id} unavailable")
+        return
+    has_fallbacks = len(get_provider_chain(settings)) > 1
+    
+    results = None
+    try:
+        limit = get_provider_limits("resend", provider_settings)["daily"]
+        granted = await reserve_daily_quota(provider_id, len(sendable), limit)
+        over_quota = sendable[granted:]
+        sendable = sendable[:granted]
+        if over_quota:
+            reason = f"Daily {provider_id} quota of {limit} reached"
+            if has_fallbacks:
+                await return_to_outbox(over_quota, reason)
+            else:
+                await defer_outbox_jobs(over_quota, get_next_quota_day(), reason)
         
+        if sendable:
+            try:
+                results = await send_rate_limited(
+                    provider_settings,
+                    sendable,
+                    lambda: send_resend_batch(sendable, provider_settings)
+                )
+            except Exception as e:
+                if not is_provider_failure(e):
+                    breaker.record_success()
+                    for job in sendable:
+                        await complete_outbox_job(job, str(e))
+                else:
+                    breaker.record_failure()
+                    await release_daily_quota(provider_id, len(sendable))
+                    logger.warning(f"Email provider {provider_id} failed: {str(e)}")
+                    if has_fallbacks:
+                        await return_to_outbox(sendable, f"Failing over from {provider_id}: {str(e)}")
+                    else:
+                        for job in sendable:
+                            await complete_outbox_job(job, str(e))
+                sendable = []
+            else:
+                if results is not None:
+                    breaker.record_success()
+    finally:
+        breaker.release()
+    
+    for job, result in zip(sendable, results or []):
+        if "error" in result:
+            # Validation errors will not succeed on retry
+            await complete_outbox_job(job, result["error"], permanent=True)
+        else:
+            await complete_outbox_job(job, provider_message_id=result["id"])
+
+async def outbox_worker_loop(worker_id: str, pool: "OutboxWorkerPool"):
+    """Claim jobs and hand them to delivery tasks.
+    
+    Jobs are only claimed while the process runs fewer deliveries than the
+    dispatcher allows for the active provider, so claimed jobs do not sit
+    out their lease waiting for a send slot.
+    """
+    settings = None
+    settings_loaded_at = 0.0
+    loop = asyncio.get_running_loop()
+    stop_event = pool.stop_event
+    
+    while not stop_event.is_set():
         try:
-            await send_email_with_provider(
-                to_email=recipient["email"],
-                subject=subject,
-                html_content=html_content,
-                settings=settings
-            )
+            if settings is None or loop.time() - settings_loaded_at > OUTBOX_SETTINGS_TTL_SECONDS:
+                settings = await get_app_settings()
+                settings_loaded_at = loop.time()
             
-            # Log individual email
-            email_log = EmailLog(
-                service_id=service["id"],
-                service_name=service["name"],
-                recipient_email=recipient["email"],
-                recipient_name=recipient["name"],
-                threshold_id=threshold_id,
-                threshold_label=threshold_label,
-                days_until_expiry=days_until_expiry,
-                status="sent"
-            )
-            await db.email_logs.insert_one(email_log.model_dump())
+            active = get_active_provider(settings)
+            limiter = rate_limiters.get(active["provider_id"]) if active else None
+            if limiter and limiter.paused_for() > 0:
+                # Throttled: leave the jobs unclaimed until the pause is over
+                try:
+                    await asyncio.wait_for(stop_event.wait(), timeout=limiter.paused_for())
+                except asyncio.TimeoutError:
+                    pass
+                continue
             
-            results.append({"email": recipient["email"], "name": recipient["name"], "status": "sent"})
-            logger.info(f"Email sent to {recipient['email']} for service {service['name']}")
+            provider = (active or settings).get("email_provider", "resend")
+            if not await pool.acquire_slot(notification_dispatcher.capacity(provider)):
+                continue
             
-        except Exception as e:
-            logger.error(f"Failed to send email to {recipient['email']}: {str(e)}")
+            try:
+                if active and active.get("email_provider") == "resend" and RESEND_BATCH_SIZE > 1:
+                    jobs = await claim_outbox_batch(worker_id, RESEND_BATCH_SIZE)
+                else:
+                    job = await claim_outbox_job(worker_id)
+                    jobs = [job] if job else []
+            except BaseException:
+                await pool.release_slot()
+                raise
             
-            # Log failed email
-            email_log = EmailLog(
-                service_id=service["id"],
-                service_name=service["name"],
-                recipient_email=recipient["email"],
-                recipient_name=recipient["name"],
-                threshold_id=threshold_id,
-                threshold_label=threshold_label,
-                days_until_expiry=days_until_expiry,
-                status="failed"
-            )
-            await db.email_logs.insert_one(email_log.model_dump())
+            if not jobs:
+                await pool.release_slot()
+                try:
+                    await asyncio.wait_for(stop_event.wait(), timeout=OUTBOX_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
             
-            results.append({"email": recipient["email"], "name": recipient["name"], "status": "failed", "error": str(e)})
+            pool.spawn(deliver_outbox_jobs(worker_id, jobs, settings))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Outbox worker {worker_id} error: {str(e)}")
+            await asyncio.sleep(OUTBOX_POLL_SECONDS)
+
+async def deliver_outbox_jobs(worker_id: str, jobs: List[dict], settings: dict):
+    try:
+        if len(jobs) > 1:
+            await deliver_outbox_batch(jobs, settings)
+        else:
+            await deliver_outbox_job(jobs[0], settings)
+    except Exception as e:
+        logger.error(f"Outbox worker {worker_id} error: {str(e)}")
+
+class OutboxWorkerPool:
+    """Runs outbox worker loops and their delivery tasks in the current process"""
     
-    # Create notification log entry
-    all_sent = all(r["status"] == "sent" for r in results)
-    any_sent = any(r["status"] == "sent" for r in results)
+    def __init__(self):
+        self.stop_event: Optional[asyncio.Event] = None
+        self._slot_changed: Optional[asyncio.Condition] = None
+        # Deliveries running plus slots taken by loops that are still claiming
+        self._slots_in_use = 0
+        self._tasks: List[asyncio.Task] = []
+        self._deliveries: set = set()
     
-    notification_log = NotificationLog(
-        service_id=service["id"],
-        service_name=service["name"],
-        threshold_id=threshold_id,
-        threshold_label=threshold_label,
-        days_until_expiry=days_until_expiry,
-        recipients=results,
-        status="sent" if all_sent else ("partial" if any_sent else "failed")
-    )
-    await db.notification_logs.insert_one(notification_log.model_dump())
+    def start(self, count: int):
+        self.stop_event = asyncio.Event()
+        self._slot_changed = asyncio.Condition()
+        prefix = f"{os.uname().nodename}:{os.getpid()}"
+        self._tasks = [
+            asyncio.create_task(outbox_worker_loop(f"{prefix}:{i}", self))
+            for i in range(count)
+        ]
+        logger.info(f"Started {count} outbox worker(s)")
     
-    return {"status": notification_log.status, "recipients": results}
-
-async def check_expiring_services():
-    """Check for expiring services and send notifications using per-service thresholds"""
-    logger.info("Running expiry check...")
+    async def acquire_slot(self, capacity: int) -> bool:
+        """Wait until fewer than `capacity` slots are in use and take one; False if stopping.
+        
+        The slot is held while the loop claims jobs, so concurrent loops
+        cannot all see the same free slot. Pass it on with spawn or give it
+        back with release_slot.
+        """
+        async with self._slot_changed:
+            await self._slot_changed.wait_for(
+                lambda: self._slots_in_use < capacity or self.stop_event.is_set()
+            )
+            if self.stop_event.is_set():
+                return False
+            self._slots_in_use += 1
+            return True
     
-    services = await db.services.find({"status": "active"}, {"_id": 0}).to_list(1000)
-    now = datetime.now(timezone.utc)
+    async def release_slot(self):
+        async with self._slot_changed:
+            self._slots_in_use -= 1
+            self._slot_changed.notify_all()
     
-    for service in services:
+    async def _deliver(self, delivery: Awaitable):
         try:
-            expiry_str = service.get("expiry_date", "")
-            if not expiry_str:
-                continue
-                
-            expiry_date = datetime.fromisoformat(expiry_str.replace("Z", "+00:00"))
-            if expiry_date.tzinfo is None:
-                expiry_date = expiry_date.replace(tzinfo=timezone.utc)
-                
-            days_until = (expiry_date - now).days
-            notifications_sent = service.get("notifications_sent", [])
-            
-            # Use per-service thresholds
-            thresholds = service.get("reminder_thresholds", [])
-            if not thresholds:
-                # Fallback to default thresholds
-                thresholds = [
-                    {"id": "default_30", "days_before": 30, "label": "First reminder"},
-                    {"id": "default_7", "days_before": 7, "label": "Second reminder"},
-                    {"id": "default_1", "days_before": 1, "label": "Final reminder"}
-                ]
-            
-            # Sort thresholds by days_before descending
-            thresholds = sorted(thresholds, key=lambda x: x.get("days_before", 0), reverse=True)
-            
-            for threshold in thresholds:
-                threshold_id = threshold.get("id", str(threshold.get("days_before", 0)))
-                days_before = threshold.get("days_before", 0)
-                label = threshold.get("label", f"{days_before} day reminder")
-                
-                # Check if already sent for this threshold
-                if threshold_id in notifications_sent:
-                    continue
-                
-                # Check if we should send this notification
-                if days_until <= days_before:
-                    try:
-                        await send_expiry_notifications(service, days_until, threshold_id, label)
-                        notifications_sent.append(threshold_id)
-                        await db.services.update_one(
-                            {"id": service["id"]},
-                            {"$set": {"notifications_sent": notifications_sent}}
-                        )
-                        logger.info(f"Sent '{label}' notification for {service['name']}")
-                    except Exception as e:
-                        logger.error(f"Failed to send notification for {service['name']}: {str(e)}")
-                    break  # Only send one notification per check
-                    
-        except Exception as e:
-            logger.error(f"Error processing service {service.get('name', 'unknown')}: {str(e)}")
+            await delivery
+        finally:
+            await self.release_slot()
+    
+    def spawn(self, delivery: Awaitable):
+        """Run a delivery in the slot taken with acquire_slot"""
+        task = asyncio.ensure_future(self._deliver(delivery))
+        self._deliveries.add(task)
+        task.add_done_callback(self._deliveries.discard)
     
-    logger.info("Expiry check completed")
+    async def stop(self, timeout: float = 30):
+        if not self._tasks:
+            return
+        self.stop_event.set()
+        async with self._slot_changed:
+            self._slot_changed.notify_all()
+        # Let in-flight sends finish; unfinished jobs are reclaimed after their lease expires
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        done, pending = await asyncio.wait(self._tasks, timeout=timeout)
+        if self._deliveries:
+            more_done, more_pending = await asyncio.wait(list(self._deliveries), timeout=max(0.0, deadline - loop.time()))
+            pending |= more_pending
+        for task in pending:
+            task.cancel()
+        self._tasks = []
+
+outbox_workers = OutboxWorkerPool()
+
+async def get_outbox_counts() -> dict:
+    counts = {"pending": 0, "sending": 0, "sent": 0, "dead": 0}
+    async for row in db.email_outbox.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+        counts[row["_id"]] = row["count"]
+    return counts
+
+@api_router.get("/outbox")
+async def get_outbox_jobs(status: Optional[str] = None, current_user: dict = Depends(get_admin_user)):
+    """List outbox jobs, e.g. ?status=dead for dead letters"""
+    query = {"status": status} if status else {}
+    return await db.email_outbox.find(query, {"_id": 0, "html": 0}).sort("available_at", -1).to_list(200)
+
+@api_router.post("/outbox/{job_id}/retry")
+async def retry_outbox_job(job_id: str, current_user: dict = Depends(get_admin_user)):
+    """Requeue a dead-lettered job with a fresh attempt budget"""
+    result = await db.email_outbox.update_one(
+        {"id": job_id, "status": "dead"},
+        {"$set": {"status": "pending", "attempts": 0, "available_at": datetime.now(timezone.utc)}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Dead-lettered job not found")
+    return {"message": "Job requeued"}
 
 # ==================== DASHBOARD STATS ====================
 
+DASHBOARD_STATS_ID = "dashboard_stats"
+
+# Maximum age of the materialized dashboard stats before a read triggers a full refresh
+DASHBOARD_STATS_MAX_STALENESS_SECONDS = int(os.environ.get('DASHBOARD_STATS_MAX_STALENESS_SECONDS', '3600'))
+
+def parse_expiry_date(expiry_str: str) -> datetime:
+    """Parse a stored ISO expiry date, assuming UTC when no timezone is present"""
+    expiry_date = datetime.fromisoformat(expiry_str.replace("Z", "+00:00"))
+    if expiry_date.tzinfo is None:
+        expiry_date = expiry_date.replace(tzinfo=timezone.utc)
+    return expiry_date
+
+def get_stats_increments(service: Optional[dict], now: datetime) -> dict:
+    """Return the dashboard counters contributed by a single service, keyed by stats field path"""
+    if not service or service.get("status") != "active":
+        return {}
+    
+    increments = {"total": 1}
+    expiry_str = service.get("expiry_date", "")
+    if not expiry_str:
+        return increments
+    
+    try:
+        days_until = (parse_expiry_date(expiry_str) - now).days
+    except Exception as e:
+        logger.error(f"Error calculating stats for service: {str(e)}")
+        return increments
+    
+    if days_until < 0:
+        increments["expired"] = 1
+    elif days_until <= 30:
+        increments["expiring_soon"] = 1
+    else:
+        increments["safe"] = 1
+    
+    increments[f"categories.{service.get('category_name', 'Uncategorized')}"] = 1
+    increments["total_cost"] = service.get("cost", 0)
+    return increments
+
+async def compute_dashboard_stats(now: datetime) -> dict:
+    """Compute dashboard stats with a full pass over active services.
+    
+    Also returns a per-category breakdown under "by_category", used for the
+    daily history snapshots.
+    """
+    stats = {"total": 0, "expiring_soon": 0, "expired": 0, "safe": 0, "categories": {}, "total_cost": 0}
+    by_category = {}
+    
+    cursor = db.services.find(
+        {"status": "active"},
+        {"_id": 0, "status": 1, "expiry_date": 1, "category_name": 1, "cost": 1}
+    )
+    async for service in cursor:
+        increments = get_stats_increments(service, now)
+        for key, delta in increments.items():
+            if key.startswith("categories."):
+                cat = key[len("categories."):]
+                stats["categories"][cat] = stats["categories"].get(cat, 0) + delta
+                breakdown = by_category.setdefault(cat, {"count": 0, "cost": 0, "expired": 0, "expiring_soon": 0})
+                breakdown["count"] += 1
+                breakdown["cost"] += increments.get("total_cost", 0)
+                breakdown["expired"] += increments.get("expired", 0)
+                breakdown["expiring_soon"] += increments.get("expiring_soon", 0)
+            else:
+                stats[key] += delta
+    
+    stats["by_category"] = by_category
+    return stats
+
+async def refresh_dashboard_stats(record_history: bool = False):
+    """Recompute and store the materialized dashboard stats document"""
+    now = datetime.now(timezone.utc)
+    stats = await compute_dashboard_stats(now)
+    by_category = stats.pop("by_category")
+    snapshot = {"id": DASHBOARD_STATS_ID, **stats, "as_of": now.isoformat()}
+    await db.dashboard_snapshots.replace_one({"id": DASHBOARD_STATS_ID}, snapshot, upsert=True)
+    logger.info("Dashboard stats refreshed")
+    
+    if record_history:
+        await record_daily_stats_snapshot(stats, by_category, now)
+    return snapshot
+
+async def run_daily_stats_refresh():
+    """Scheduled job: full stats refresh plus today's history snapshot"""
+    await refresh_dashboard_stats(record_history=True)
+
+async def invalidate_dashboard_stats():
+    """Drop the materialized stats so the next read recomputes them"""
+    await db.dashboard_snapshots.delete_one({"id": DASHBOARD_STATS_ID})
+
+async def update_dashboard_stats(before: Optional[dict], after: Optional[dict]):
+    """Apply a single service write to the materialized stats as a counter delta"""
+    try:
+        now = datetime.now(timezone.utc)
+        increments = get_stats_increments(after, now)
+        for key, delta in get_stats_increments(before, now).items():
+            increments[key] = increments.get(key, 0) - delta
+        increments = {k: v for k, v in increments.items() if v}
+        if not increments:
+            return
+        
+        # Category names are used as field names; fall back to a full refresh
+        # when one cannot be addressed with a dotted $inc path
+        for key in increments:
+            cat = key[len("categories."):] if key.startswith("categories.") else None
+            if cat is not None and (not cat or "." in cat or cat.startswith("$")):
+                await invalidate_dashboard_stats()
+                return
+        
+        await db.dashboard_snapshots.update_one({"id": DASHBOARD_STATS_ID}, {"$inc": increments})
+    except Exception as e:
+        logger.error(f"Failed to update dashboard stats, invalidating: {str(e)}")
+        await invalidate_dashboard_stats()
+
 @api_router.get("/dashboard/stats")
 async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
-    services = await db.services.find({"status": "active"}, {"_id": 0}).to_list(1000)
+    return await single_flight.do("dashboard/stats", "", load_dashboard_stats)
+
+async def load_dashboard_stats():
+    snapshot = await db.dashboard_snapshots.find_one({"id": DASHBOARD_STATS_ID}, {"_id": 0})
+    
+    if snapshot:
+        age = datetime.now(timezone.utc) - datetime.fromisoformat(snapshot["as_of"])
+        if age.total_seconds() > DASHBOARD_STATS_MAX_STALENESS_SECONDS:
+            snapshot = None
+    
+    if not snapshot:
+        snapshot = await refresh_dashboard_stats()
+    
+    return {
+        "total": snapshot["total"],
+        "expiring_soon": snapshot["expiring_soon"],
+        "expired": snapshot["expired"],
+        "safe": snapshot["safe"],
+        "categories": {k: v for k, v in snapshot["categories"].items() if v > 0},
+        "total_cost": snapshot["total_cost"],
+        "as_of": snapshot["as_of"]
+    }
+
+# ==================== STATS HISTORY ====================
+
+STATS_HISTORY_MAX_DAYS = 731
+
+async def record_daily_stats_snapshot(stats: dict, by_category: dict, now: datetime):
+    """Persist one compact stats snapshot per UTC day into the stats_history collection"""
+    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if await db.stats_history.find_one({"date": day_start}, {"_id": 1}):
+        return
+    
+    await db.stats_history.insert_one({
+        "date": day_start,
+        "day": day_start.date().isoformat(),
+        "total": stats["total"],
+        "expired": stats["expired"],
+        "expiring_soon": stats["expiring_soon"],
+        "safe": stats["safe"],
+        "total_cost": stats["total_cost"],
+        "categories": [
+            {"name": name, **breakdown}
+            for name, breakdown in sorted(by_category.items())
+        ],
+        "created_at": now.isoformat()
+    })
+    logger.info(f"Recorded stats snapshot for {day_start.date().isoformat()}")
+
+def parse_day(value: str, field: str) -> datetime:
+    """Parse a YYYY-MM-DD query parameter as midnight UTC"""
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{field} must be a date in YYYY-MM-DD format")
+
+@api_router.get("/dashboard/trends")
+async def get_dashboard_trends(
+    from_date: Optional[str] = Query(None, alias="from"),
+    to_date: Optional[str] = Query(None, alias="to"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Daily stats snapshots for trend charts, read from stats_history only"""
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    end = parse_day(to_date, "to") if to_date else today
+    start = parse_day(from_date, "from") if from_date else end - timedelta(days=29)
+    
+    if start > end:
+        raise HTTPException(status_code=400, detail="from must not be after to")
+    if (end - start).days >= STATS_HISTORY_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range cannot exceed {STATS_HISTORY_MAX_DAYS} days")
+    
+    snapshots = await db.stats_history.find(
+        {"date": {"$gte": start, "$lte": end}},
+        {"_id": 0, "date": 0, "created_at": 0}
+    ).sort("date", 1).to_list(STATS_HISTORY_MAX_DAYS)
+    
+    return {
+        "from": start.date().isoformat(),
+        "to": end.date().isoformat(),
+        "snapshots": snapshots
+    }
+
+# ==================== RENEWAL FORECAST ====================
+
+FORECAST_MAX_MONTHS = 60
+
+def compute_renewal_forecast(
+    expiry: np.ndarray,
+    duration_months: np.ndarray,
+    cost: np.ndarray,
+    start: np.datetime64,
+    months: int,
+    granularity: str = "month"
+) -> dict:
+    """Project renewals over the next `months` months from columnar service data.
+    
+    Weekly forecasts cover [start, start + months); monthly ones cover the
+    rest of start's month and the following months - 1 calendar months.
+    
+    expiry is datetime64[D] (NaT for unknown), duration_months is the recurring
+    renewal period (0 for one-off expiries) and cost is the cost per renewal.
+    Recurring renewals fall on expiry + k * duration months, clamped to the end
+    of shorter months like relativedelta.
+    """
+    start = np.datetime64(start, "D")
+    start_month = start.astype("datetime64[M]")
+    if granularity == "week":
+        end = (start_month + months).astype("datetime64[D]") + (start - start_month.astype("datetime64[D]"))
+    else:
+        # Monthly periods end with the last calendar month, so the totals
+        # match the sum of the periods
+        end = (start_month + months).astype("datetime64[D]")
+    
+    valid = ~np.isnat(expiry)
+    overdue = valid & (expiry < start)
+    upcoming = valid & (expiry >= start) & (expiry < end)
+    
+    exp = expiry[upcoming]
+    period = np.maximum(duration_months[upcoming].astype(np.int64), 0)
+    unit_cost = cost[upcoming].astype(np.float64)
+    
+    first_month = exp.astype("datetime64[M]")
+    first_day = (exp - first_month.astype("datetime64[D]")).astype(np.int64)
+    month_span = (end.astype("datetime64[M]") - first_month).astype(np.int64)
+    
+    # Number of renewals per service inside the window (upper bound, trimmed below)
+    occurrences = np.ones(len(exp), dtype=np.int64)
+    recurring = period > 0
+    occurrences[recurring] = month_span[recurring] // period[recurring] + 1
+    
+    # Expand to one row per (service, renewal) without a Python loop
+    idx = np.repeat(np.arange(len(exp)), occurrences)
+    offsets = np.repeat(np.cumsum(occurrences) - occurrences, occurrences)
+    k = np.arange(len(idx)) - offsets
+    
+    renewal_month = first_month[idx] + k * period[idx]
+    month_start = renewal_month.astype("datetime64[D]")
+    days_in_month = ((renewal_month + 1).astype("datetime64[D]") - month_start).astype(np.int64)
+    renewal_date = month_start + np.minimum(first_day[idx], days_in_month - 1)
+    
+    in_window = renewal_date < end
+    renewal_date = renewal_date[in_window]
+    renewal_cost = unit_cost[idx][in_window]
+    
+    if granularity == "week":
+        buckets = ((renewal_date - start).astype(np.int64) // 7)
+        bucket_count = int(((end - start).astype(np.int64) + 6) // 7)
+        period_starts = start + 7 * np.arange(bucket_count)
+    else:
+        buckets = (renewal_date.astype("datetime64[M]") - start_month).astype(np.int64)
+        bucket_count = months
+        period_starts = (start_month + np.arange(bucket_count)).astype("datetime64[D]")
+    
+    counts = np.bincount(buckets, minlength=bucket_count)
+    costs = np.bincount(buckets, weights=renewal_cost, minlength=bucket_count)
+    
+    return {
+        "periods": [
+            {"period_start": str(p), "renewals": int(c), "cost": round(float(v), 2)}
+            for p, c, v in zip(period_starts, counts, costs)
+        ],
+        "total_renewals": int(counts.sum()),
+        "total_cost": round(float(costs.sum()), 2),
+        "overdue": {
+            "count": int(overdue.sum()),
+            "cost": round(float(cost[overdue].sum()), 2)
+        }
+    }
+
+async def load_forecast_columns():
+    """Extract expiry, duration and cost of active services as columns in one round trip"""
+    pipeline = [
+        {"$match": {"status": "active"}},
+        {"$group": {
+            "_id": None,
+            "expiry_date": {"$push": {"$ifNull": ["$expiry_date", ""]}},
+            "expiry_duration_months": {"$push": {"$ifNull": ["$expiry_duration_months", 0]}},
+            "cost": {"$push": {"$ifNull": ["$cost", 0]}}
+        }}
+    ]
+    rows = await db.services.aggregate(pipeline).to_list(1)
+    columns = rows[0] if rows else {"expiry_date": [], "expiry_duration_months": [], "cost": []}
+    
+    expiry = pd.to_datetime(pd.Series(columns["expiry_date"], dtype=object), utc=True, errors="coerce", format="ISO8601")
+    return (
+        expiry.dt.tz_localize(None).to_numpy(dtype="datetime64[ns]").astype("datetime64[D]"),
+        np.asarray(columns["expiry_duration_months"], dtype=np.int64),
+        np.asarray(columns["cost"], dtype=np.float64)
+    )
+
+@api_router.get("/dashboard/forecast")
+async def get_renewal_forecast(
+    months: int = 12,
+    granularity: str = "month",
+    current_user: dict = Depends(get_current_user)
+):
+    """Forecast renewal counts and costs per week or month for the next N months"""
+    if granularity not in ("week", "month"):
+        raise HTTPException(status_code=400, detail="granularity must be 'week' or 'month'")
+    if months < 1 or months > FORECAST_MAX_MONTHS:
+        raise HTTPException(status_code=400, detail=f"months must be between 1 and {FORECAST_MAX_MONTHS}")
+    
     now = datetime.now(timezone.utc)
+    expiry, duration_months, cost = await load_forecast_columns()
+    forecast = compute_renewal_forecast(
+        expiry, duration_months, cost,
+        start=np.datetime64(now.date()),
+        months=months,
+        granularity=granularity
+    )
+    
+    return {
+        "as_of": now.isoformat(),
+        "months": months,
+        "granularity": granularity,
+        **forecast
+    }
+
+# ==================== NOTIFICATION PREVIEW ====================
+
+NOTIFICATION_PREVIEW_MAX_DAYS = 366
+
+def simulate_notification_days(
+    expiry: np.ndarray,
+    days_before: np.ndarray,
+    first_run: np.datetime64,
+    first_run_index: int,
+    daily: bool = True
+) -> np.ndarray:
+    """Day index of the scan that sends each unsent threshold, vectorized over services x thresholds.
+    
+    expiry is datetime64[s] per service; days_before is a (services x thresholds)
+    float matrix of unsent thresholds sorted descending, NaN-padded on the right.
+    Day index 0 is the scan at first_run; scans run daily and send at most one
+    threshold per service, so the k-th threshold goes out on
+    max(eligible_k, sent_(k-1) + 1), i.e. a running maximum of eligible_k - k.
+    With daily=False (interval scans) first_run is midnight of day 0 and a
+    threshold goes out on the day it becomes due. Unused slots are +inf.
+    """
+    day_seconds = 24 * 3600
+    expiry_seconds = expiry.astype("datetime64[s]").astype(np.int64).astype(np.float64)
+    run_seconds = np.datetime64(first_run, "s").astype(np.int64)
+    
+    # A threshold becomes due once now > expiry - (days_before + 1) days, so
+    # the first daily scan that sends it is the first one strictly after that
+    due = expiry_seconds[:, None] - (days_before + 1) * day_seconds
+    days_to_due = np.floor((due - run_seconds) / day_seconds)
+    eligible = np.maximum(days_to_due + 1 if daily else days_to_due, first_run_index)
+    eligible = np.where(np.isnan(days_before), np.inf, eligible)
+    if not daily:
+        return eligible
     
-    total = len(services)
-    expiring_soon = 0
-    expired = 0
-    safe = 0
-    categories = {}
-    total_cost = 0
+    k = np.arange(days_before.shape[1])
+    return np.maximum.accumulate(eligible - k, axis=1) + k
+
+async def load_preview_services():
+    """Active services with unsent thresholds as columns for the simulation"""
+    services = await db.services.find(
+        {"status": "active", "next_notification_at": {"$ne": None}},
+        {"_id": 0, "id": 1, "name": 1, "expiry_date": 1, "reminder_thresholds": 1,
+         "notifications_sent": 1, "owners": 1, "contact_email": 1, "contact_name": 1}
+    ).to_list(None)
     
+    unsent = []
     for service in services:
-        try:
-            expiry_str = service.get("expiry_date", "")
-            if not expiry_str:
-                continue
-                
-            expiry_date = datetime.fromisoformat(expiry_str.replace("Z", "+00:00"))
-            if expiry_date.tzinfo is None:
-                expiry_date = expiry_date.replace(tzinfo=timezone.utc)
-                
-            days_until = (expiry_date - now).days
-            
-            if days_until < 0:
-                expired += 1
-            elif days_until <= 30:
-                expiring_soon += 1
-            else:
-                safe += 1
-            
-            cat = service.get("category_name", "Uncategorized")
-            categories[cat] = categories.get(cat, 0) + 1
-            total_cost += service.get("cost", 0)
-            
-        except Exception as e:
-            logger.error(f"Error calculating stats for service: {str(e)}")
+        sent = set(service.get("notifications_sent", []))
+        unsent.append([t for t in get_sorted_thresholds(service) if get_threshold_id(t) not in sent])
+    
+    width = max((len(t) for t in unsent), default=0)
+    days_before = np.full((len(services), max(width, 1)), np.nan)
+    for i, thresholds in enumerate(unsent):
+        days_before[i, :len(thresholds)] = [t.get("days_before", 0) for t in thresholds]
+    
+    expiry = pd.to_datetime(
+        pd.Series([s.get("expiry_date", "") for s in services], dtype=object),
+        utc=True, errors="coerce", format="ISO8601"
+    ).dt.tz_localize(None).to_numpy(dtype="datetime64[ns]")
+    
+    # Services with unparseable expiry dates never notify
+    days_before[np.isnat(expiry)] = np.nan
+    return services, unsent, expiry, days_before
+
+@api_router.get("/notifications/preview")
+async def preview_notifications(
+    from_date: Optional[str] = Query(None, alias="from"),
+    to_date: Optional[str] = Query(None, alias="to"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Dry-run of the daily expiry checks over a date range: per-day counts and recipients.
+    
+    Nothing is sent or written. Assumes the scheduler clock is UTC and that
+    no services change in the meantime; with interval scans, several
+    thresholds of one service can fall on the same day.
+    """
+    now = datetime.now(timezone.utc)
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    start = parse_day(from_date, "from") if from_date else today
+    end = parse_day(to_date, "to") if to_date else start + timedelta(days=6)
+    
+    if start > end:
+        raise HTTPException(status_code=400, detail="from must not be after to")
+    if start < today:
+        raise HTTPException(status_code=400, detail="from cannot be in the past")
+    if (end - start).days >= NOTIFICATION_PREVIEW_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range cannot exceed {NOTIFICATION_PREVIEW_MAX_DAYS} days")
+    
+    services, unsent, expiry, days_before = await load_preview_services()
+    
+    if EXPIRY_CHECK_INTERVAL_MINUTES > 0:
+        send_day = simulate_notification_days(
+            expiry, days_before, np.datetime64(today.replace(tzinfo=None)), 0, daily=False
+        )
+    else:
+        # Day 0 is today's scan; it only counts if it has not run yet
+        first_run = today + timedelta(hours=EXPIRY_CHECK_HOUR)
+        send_day = simulate_notification_days(
+            expiry,
+            days_before,
+            np.datetime64(first_run.replace(tzinfo=None)),
+            0 if now < first_run else 1
+        )
+    
+    first_index = (start - today).days
+    last_index = (end - today).days
+    rows, cols = np.nonzero(np.isfinite(send_day) & (send_day >= first_index) & (send_day <= last_index))
+    day_index = send_day[rows, cols].astype(np.int64) - first_index
+    
+    # Only the selected (service, threshold) pairs are materialized
+    day_count = last_index - first_index + 1
+    days = [
+        {"date": (start + timedelta(days=i)).date().isoformat(), "notifications": 0, "emails": 0, "recipients": set()}
+        for i in range(day_count)
+    ]
+    recipients_by_service = {}
+    for row, col, day in zip(rows.tolist(), cols.tolist(), day_index.tolist()):
+        if row not in recipients_by_service:
+            recipients_by_service[row] = [r["email"].lower() for r in get_notification_recipients(services[row])]
+        emails = recipients_by_service[row]
+        days[day]["notifications"] += 1
+        days[day]["emails"] += len(emails)
+        days[day]["recipients"].update(emails)
+    
+    # In digest mode each recipient gets one email per check
+    settings = await get_app_settings()
+    for day in days:
+        if settings.get("notification_digest"):
+            day["emails"] = len(day["recipients"])
+        day["recipients"] = sorted(day["recipients"])
     
     return {
-        "total": total,
-        "expiring_soon": expiring_soon,
-        "expired": expired,
-        "safe": safe,
-        "categories": categories,
-        "total_cost": total_cost
+        "from": start.date().isoformat(),
+        "to": end.date().isoformat(),
+        "total_notifications": int(len(rows)),
+        "total_emails": sum(day["emails"] for day in days),
+        "peak_day_emails": max((day["emails"] for day in days), default=0),
+        "days": days
     }
 
+# ==================== JOB TRACKING ====================
+
+# A running job whose heartbeat is older than this is considered abandoned
+JOB_STALE_SECONDS = int(os.environ.get('JOB_STALE_SECONDS', '600'))
+
+class JobRecord(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    type: str
+    trigger: str = "manual"  # manual, schedule
+    status: str = "queued"  # queued, running, done, failed
+    # Set while queued/running; a unique partial index allows one active job per type
+    active: bool = True
+    attached: int = 0  # Triggers that joined this run instead of starting another
+    counts: Dict[str, int] = Field(default_factory=dict)
+    phases: Dict[str, dict] = Field(default_factory=dict)
+    error: str = ""
+    created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    heartbeat_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class JobProgress:
+    """Collects counts and phase durations of a run and persists them to its job record"""
+    
+    HEARTBEAT_SECONDS = 5
+    
+    def __init__(self, job_id: Optional[str]):
+        self.job_id = job_id
+        self.counts: Dict[str, int] = {}
+        self.phases: Dict[str, dict] = {}
+        self._last_flush = datetime.now(timezone.utc)
+    
+    def incr(self, name: str, amount: int = 1):
+        self.counts[name] = self.counts.get(name, 0) + amount
+    
+    @contextlib.asynccontextmanager
+    async def phase(self, name: str):
+        started_at = datetime.now(timezone.utc)
+        self.phases[name] = {"started_at": started_at.isoformat(), "duration_seconds": None}
+        try:
+            yield
+        finally:
+            duration = (datetime.now(timezone.utc) - started_at).total_seconds()
+            self.phases[name]["duration_seconds"] = round(duration, 3)
+            await self.flush()
+    
+    async def maybe_flush(self):
+        if (datetime.now(timezone.utc) - self._last_flush).total_seconds() >= self.HEARTBEAT_SECONDS:
+            await self.flush()
+    
+    async def flush(self):
+        self._last_flush = datetime.now(timezone.utc)
+        if self.job_id:
+            await db.jobs.update_one({"id": self.job_id}, {"$set": {
+                "counts": self.counts,
+                "phases": self.phases,
+                "heartbeat_at": self._last_flush
+            }})
+
+async def start_or_attach_job(job_type: str, trigger: str) -> tuple:
+    """Create the active job of a type, or attach to the one already in flight.
+    
+    Returns (job, created).
+    """
+    for _ in range(2):
+        job = JobRecord(type=job_type, trigger=trigger)
+        try:
+            await db.jobs.insert_one(job.model_dump())
+            return job.model_dump(), True
+        except DuplicateKeyError:
+            pass
+        
+        existing = await db.jobs.find_one_and_update(
+            {"type": job_type, "active": True},
+            {"$inc": {"attached": 1}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if existing is None:
+            continue
+        
+        heartbeat_at = existing["heartbeat_at"].replace(tzinfo=timezone.utc)
+        if (datetime.now(timezone.utc) - heartbeat_at).total_seconds() < JOB_STALE_SECONDS:
+            return existing, False
+        
+        # The process running it died; release the slot and try again
+        await db.jobs.update_one({"id": existing["id"], "active": True}, {
+            "$set": {"status": "failed", "error": "Abandoned (no heartbeat)", "finished_at": datetime.now(timezone.utc).isoformat()},
+            "$unset": {"active": ""}
+        })
+    raise HTTPException(status_code=409, detail=f"Could not start {job_type} job")
+
+async def run_expiry_check_job(job_id: str):
+    now = datetime.now(timezone.utc)
+    await db.jobs.update_one({"id": job_id}, {"$set": {
+        "status": "running", "started_at": now.isoformat(), "heartbeat_at": now
+    }})
+    progress = JobProgress(job_id)
+    update = {"status": "done"}
+    try:
+        await check_expiring_services(progress)
+    except Exception as e:
+        logger.error(f"Expiry check job {job_id} failed: {str(e)}")
+        update = {"status": "failed", "error": str(e)}
+    finally:
+        await progress.flush()
+        update["finished_at"] = datetime.now(timezone.utc).isoformat()
+        await db.jobs.update_one({"id": job_id}, {"$set": update, "$unset": {"active": ""}})
+
+async def scheduled_expiry_check():
+    """Scheduler entry point; skips the run if one is already in flight"""
+    job, created = await start_or_attach_job("expiry_check", "schedule")
+    if created:
+        await run_expiry_check_job(job["id"])
+    else:
+        logger.info(f"Expiry check already in flight (job {job['id']}), skipping scheduled run")
+
 @api_router.post("/check-expiring")
 async def trigger_expiry_check(background_tasks: BackgroundTasks, current_user: dict = Depends(get_current_user)):
-    background_tasks.add_task(check_expiring_services)
-    return {"message": "Expiry check triggered"}
+    job, created = await start_or_attach_job("expiry_check", "manual")
+    if created:
+        background_tasks.add_task(run_expiry_check_job, job["id"])
+        return {"message": "Expiry check triggered", "job_id": job["id"], "status": job["status"]}
+    return {"message": "Expiry check already in progress", "job_id": job["id"], "status": job["status"]}
+
+@api_router.get("/jobs/{job_id}")
+async def get_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    job = await db.jobs.find_one({"id": job_id}, {"_id": 0, "active": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 # Default category suggestions (for UI hints)
 DEFAULT_CATEGORY_SUGGESTIONS = [
@@ -1271,6 +4462,23 @@ async def get_category_suggestions():
     """Get default category name suggestions for creating new categories"""
     return {"suggestions": DEFAULT_CATEGORY_SUGGESTIONS}
 
+# ==================== METRICS ====================
+
+@api_router.get("/metrics")
+async def get_metrics(current_user: dict = Depends(get_admin_user)):
+    """Runtime metrics for this API process"""
+    return {
+        "single_flight": single_flight.snapshot(),
+        "service_cache": service_cache.snapshot(),
+        "smtp_pool": smtp_pool.snapshot(),
+        "notification_dispatch": notification_dispatcher.snapshot(),
+        "rate_limits": {provider: limiter.snapshot() for provider, limiter in rate_limiters.items()},
+        "circuit_breakers": {provider_id: breaker.snapshot() for provider_id, breaker in circuit_breakers.items()},
+        "write_buffers": {writer.collection: writer.snapshot() for writer in write_buffers},
+        "email_quota": await get_quota_usage(await get_app_settings()),
+        "outbox": await get_outbox_counts()
+    }
+
 # ==================== HEALTH CHECK ====================
 
 @api_router.get("/")
@@ -1292,22 +4500,225 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Scheduler for automated expiry checks
-scheduler = AsyncIOScheduler()
+# Scheduler for automated expiry checks. Jobs are persisted in Mongo so a
+# run missed while no replica was up (or the loop was blocked) is executed
+# once, coalesced, when the scheduler resumes.
+SCHEDULER_MISFIRE_GRACE_SECONDS = int(os.environ.get('SCHEDULER_MISFIRE_GRACE_SECONDS', str(24 * 3600)))
+
+scheduler = AsyncIOScheduler(
+    jobstores={
+        # APScheduler's job stores are synchronous
+        "default": MongoDBJobStore(
+            database=os.environ['DB_NAME'],
+            collection="scheduler_jobs",
+            client=MongoClient(mongo_url)
+        )
+    },
+    job_defaults={
+        "coalesce": True,
+        "max_instances": 1,
+        "misfire_grace_time": SCHEDULER_MISFIRE_GRACE_SECONDS
+    }
+)
+
+# ==================== LEADER ELECTION ====================
+
+# Lease duration of the scheduler lock; the holder renews it every third of this
+LEADER_LOCK_TTL_SECONDS = int(os.environ.get('LEADER_LOCK_TTL_SECONDS', '60'))
+
+class LeaderLease:
+    """Mongo-backed lease lock so only one replica runs the scheduled jobs.
+    
+    The lock is a single document keyed by name. The holder renews
+    expires_at with a heartbeat; if it dies, another replica takes over once
+    the lease has expired. A TTL index removes abandoned lock documents.
+    """
+    
+    def __init__(self, name: str, ttl_seconds: int, on_change: Optional[Callable[[bool], None]] = None):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.on_change = on_change
+        self.owner_id = f"{os.uname().nodename}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._valid_until: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    @property
+    def is_leader(self) -> bool:
+        return self._valid_until is not None and datetime.now(timezone.utc) < self._valid_until
+    
+    async def try_acquire(self) -> bool:
+        """Acquire or renew the lease; returns whether this process holds it"""
+        now = datetime.now(timezone.utc)
+        expires_at = now + timedelta(seconds=self.ttl_seconds)
+        try:
+            await db.leader_locks.update_one(
+                {"_id": self.name, "$or": [{"owner": self.owner_id}, {"expires_at": {"$lte": now}}]},
+                {"$set": {"owner": self.owner_id, "expires_at": expires_at, "heartbeat_at": now}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Held by another live replica
+            self._valid_until = None
+            return False
+        
+        if self._valid_until is None:
+            logger.info(f"Acquired '{self.name}' leadership as {self.owner_id}")
+        self._valid_until = expires_at
+        return True
+    
+    async def _heartbeat_loop(self):
+        while True:
+            was_leader = self.is_leader
+            try:
+                await self.try_acquire()
+            except Exception as e:
+                logger.error(f"Leader heartbeat for '{self.name}' failed: {str(e)}")
+            if was_leader and not self.is_leader:
+                logger.warning(f"Lost '{self.name}' leadership")
+            if self.on_change and was_leader != self.is_leader:
+                self.on_change(self.is_leader)
+            await asyncio.sleep(self.ttl_seconds / 3)
+    
+    def start(self):
+        self._task = asyncio.create_task(self._heartbeat_loop())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._valid_until is not None:
+            # Release immediately so a standby does not wait for expiry
+            await db.leader_locks.delete_one({"_id": self.name, "owner": self.owner_id})
+            self._valid_until = None
+
+def on_scheduler_leadership_change(is_leader: bool):
+    """Only the leader processes the shared job store; standbys keep their scheduler paused"""
+    if not scheduler.running:
+        return
+    if is_leader:
+        scheduler.resume()
+    else:
+        scheduler.pause()
+
+scheduler_lease = LeaderLease("scheduler", LEADER_LOCK_TTL_SECONDS, on_scheduler_leadership_change)
+
+def leader_only(job_fn: Callable[[], Awaitable[Any]]) -> Callable[[], Awaitable[Any]]:
+    """Wrap a scheduled job so it only runs on the replica holding the scheduler lease"""
+    @functools.wraps(job_fn)
+    async def run():
+        if not await scheduler_lease.try_acquire():
+            logger.info(f"Skipping {job_fn.__name__}: another replica holds the scheduler lease")
+            return
+        await job_fn()
+    return run
+
+# Scheduled jobs live at module level so the persistent job store can
+# reference them by name
+
+@leader_only
+async def expiry_check_job():
+    await scheduled_expiry_check()
+
+@leader_only
+async def dashboard_stats_job():
+    await run_daily_stats_refresh()
+
+def get_expiry_check_trigger():
+    if EXPIRY_CHECK_INTERVAL_MINUTES > 0:
+        return IntervalTrigger(minutes=EXPIRY_CHECK_INTERVAL_MINUTES)
+    return CronTrigger(hour=EXPIRY_CHECK_HOUR, minute=0)
+
+def ensure_scheduled_job(func: Callable, trigger, job_id: str):
+    """Add a job to the persistent store unless an identical one is already there.
+    
+    Replacing an unchanged job would move its next_run_time into the future
+    and drop a run that was missed while the scheduler was down.
+    """
+    existing = scheduler.get_job(job_id)
+    if existing and existing.func is func and str(existing.trigger) == str(trigger):
+        return existing
+    return scheduler.add_job(func, trigger, id=job_id, replace_existing=True)
+
+async def ensure_indexes():
+    """Create collections and indexes used by background jobs and range queries"""
+    collections = await db.list_collection_names()
+    if "stats_history" not in collections:
+        try:
+            await db.create_collection(
+                "stats_history",
+                timeseries={"timeField": "date", "granularity": "hours"}
+            )
+        except Exception as e:
+            logger.warning(f"Could not create time-series collection, using a regular one: {str(e)}")
+    await db.stats_history.create_index([("date", 1)])
+    await db.services.create_index([("status", 1), ("next_notification_at", 1)])
+    await db.email_outbox.create_index([("status", 1), ("available_at", 1)])
+    await db.email_outbox.create_index([("status", 1), ("lease_expires_at", 1)])
+    await db.email_outbox.create_index([("id", 1)], unique=True)
+    await db.email_outbox.create_index([("idempotency_key", 1)], unique=True)
+    await db.email_outbox.create_index(
+        [("completed_at", 1)],
+        expireAfterSeconds=OUTBOX_RETENTION_DAYS * 24 * 3600
+    )
+    await db.leader_locks.create_index([("expires_at", 1)], expireAfterSeconds=0)
+    await db.email_quota.create_index([("date", 1)], expireAfterSeconds=30 * 24 * 3600)
+    await db.notification_claims.create_index(
+        [("created_at", 1)], expireAfterSeconds=NOTIFICATION_CLAIM_RETENTION_DAYS * 24 * 3600
+    )
+    await db.notification_claims.create_index([("job_id", 1)])
+    await db.email_templates.create_index([("label_key", 1), ("version", -1)], unique=True)
+    await db.jobs.create_index([("id", 1)], unique=True)
+    await db.jobs.create_index(
+        [("type", 1)],
+        unique=True,
+        partialFilterExpression={"active": True}
+    )
+
+# Scheduling and email delivery run in the worker process (python -m worker);
+# set to "true" to run them inside a single API process instead
+RUN_BACKGROUND_JOBS = os.environ.get('RUN_BACKGROUND_JOBS', 'false').lower() in ('1', 'true', 'yes')
+
+async def start_background_services():
+    """Start the scheduler (guarded by the leader lease) and the outbox workers"""
+    # Jobs are only processed while this replica holds the lease
+    scheduler.start(paused=True)
+    
+    ensure_scheduled_job(expiry_check_job, get_expiry_check_trigger(), "daily_expiry_check")
+    # Fully refresh the materialized dashboard stats at midnight UTC, when
+    # services move between expiry buckets, and record the daily snapshot
+    ensure_scheduled_job(dashboard_stats_job, CronTrigger(hour=0, minute=0, timezone="UTC"), "dashboard_stats_refresh")
+    # Catch up on today's history snapshot if the midnight run was missed
+    scheduler.add_job(dashboard_stats_job, id="dashboard_stats_catch_up", replace_existing=True)
+    
+    if EXPIRY_CHECK_INTERVAL_MINUTES > 0:
+        logger.info(f"Scheduler started - expiry check every {EXPIRY_CHECK_INTERVAL_MINUTES} minutes")
+    else:
+        logger.info(f"Scheduler started - daily expiry check scheduled at {EXPIRY_CHECK_HOUR}:00")
+    scheduler_lease.start()
+    
+    outbox_workers.start(OUTBOX_WORKERS)
+
+async def stop_background_services():
+    if scheduler.running:
+        scheduler.shutdown()
+    await scheduler_lease.stop()
+    await outbox_workers.stop()
+    # After the workers so their last delivery results are written
+    await close_write_buffers()
+    await smtp_pool.close_all()
+    await resend_client.close()
 
 @app.on_event("startup")
 async def startup_event():
-    # Run expiry check daily at 9 AM
-    scheduler.add_job(
-        check_expiring_services,
-        CronTrigger(hour=9, minute=0),
-        id="daily_expiry_check",
-        replace_existing=True
-    )
-    scheduler.start()
-    logger.info("Scheduler started - daily expiry check scheduled at 9:00 AM")
+    await ensure_indexes()
+    await backfill_next_notification_at()
+    
+    if RUN_BACKGROUND_JOBS:
+        await start_background_services()
+    else:
+        logger.info("Background jobs disabled in this process (RUN_BACKGROUND_JOBS=false)")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    scheduler.shutdown()
+    await stop_background_services()
     client.close()
@@ -0,0 +1,39 @@
+"""Scheduler and email delivery worker, run separately from the API server.
+
+Start it from the backend directory (or the Docker image's /app):
+
+    python -m worker
+
+and run the API replicas with RUN_BACKGROUND_JOBS=false so interactive
+requests do not share an event loop with notification runs.
+"""
+import asyncio
+import signal
+
+from server import (
+    client,
+    logger,
+    ensure_indexes,
+    backfill_next_notification_at,
+    start_background_services,
+    stop_background_services,
+)
+
+async def main():
+    await ensure_indexes()
+    await backfill_next_notification_at()
+    await start_background_services()
+    logger.info("Worker started")
+    
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    
+    await stop_event.wait()
+    logger.info("Worker shutting down")
+    await stop_background_services()
+    client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
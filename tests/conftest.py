@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+# server.py reads these at import time; no connection is made
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """In-memory MongoDB in place of server.db"""
+    from mongomock_motor import AsyncMongoMockClient, AsyncMongoMockCollection
+    import server
+
+    find_one_and_update = AsyncMongoMockCollection.find_one_and_update
+
+    async def find_one_and_update_without_id(self, *args, projection=None, **kwargs):
+        # mongomock cannot return the updated document when _id is projected out
+        doc = await find_one_and_update(self, *args, **kwargs)
+        if doc is not None and projection and projection.get("_id") == 0:
+            doc.pop("_id", None)
+        return doc
+
+    monkeypatch.setattr(AsyncMongoMockCollection, "find_one_and_update", find_one_and_update_without_id)
+    database = AsyncMongoMockClient()["test"]
+    monkeypatch.setattr(server, "db", database)
+    return database
@@ -0,0 +1,142 @@
+import asyncio
+
+import pytest
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+import server
+from server import BulkWriter
+
+
+class FakeCollection:
+    """Records bulk writes; `failures` are raised by the next bulk_write calls"""
+
+    def __init__(self):
+        self.batches = []
+        self.failures = []
+        self.ids = set()
+
+    async def bulk_write(self, operations, ordered=True):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.batches.append(list(operations))
+        matched = 0
+        for operation in operations:
+            if isinstance(operation, InsertOne):
+                self.ids.add(operation._doc["id"])
+            elif operation._filter["id"] in self.ids:
+                matched += 1
+        return type("BulkWriteResult", (), {"matched_count": matched})()
+
+    async def distinct(self, key, query):
+        return [i for i in query["id"]["$in"] if i in self.ids]
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    collection = FakeCollection()
+    monkeypatch.setattr(server, "db", {"logs": collection})
+    return collection
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def update(doc_id):
+    return UpdateOne({"id": doc_id}, {"$set": {"status": "sent"}})
+
+
+def test_flushes_once_max_batch_is_pending(collection):
+    async def scenario():
+        writer = BulkWriter("logs", max_batch=3, flush_seconds=60)
+        await writer.extend([InsertOne({"id": str(i)}) for i in range(2)])
+        assert collection.batches == []
+        await writer.add(InsertOne({"id": "2"}))
+        return writer
+
+    writer = run(scenario())
+    assert [len(batch) for batch in collection.batches] == [3]
+    assert writer.snapshot()["pending"] == 0
+    assert writer.snapshot()["writes"] == 3
+
+
+def test_failed_flush_is_retried(collection):
+    async def scenario():
+        writer = BulkWriter("logs", max_batch=10, flush_seconds=60)
+        collection.failures.append(ConnectionError("primary stepped down"))
+        await writer.extend([InsertOne({"id": "a"}), InsertOne({"id": "b"})])
+        await writer.flush()
+        assert writer.snapshot()["pending"] == 2
+        await writer.flush()
+        return writer
+
+    writer = run(scenario())
+    assert collection.ids == {"a", "b"}
+    assert writer.snapshot() == {"pending": 0, "flushes": 2, "writes": 2, "retried": 2, "dropped": 0}
+
+
+def test_writes_are_dropped_after_max_retries(collection):
+    async def scenario():
+        writer = BulkWriter("logs", max_batch=10, flush_seconds=60)
+        collection.failures.extend(ConnectionError("down") for _ in range(server.WRITE_BUFFER_MAX_RETRIES))
+        await writer.add(InsertOne({"id": "a"}))
+        for _ in range(server.WRITE_BUFFER_MAX_RETRIES):
+            await writer.flush()
+        return writer
+
+    writer = run(scenario())
+    assert collection.batches == []
+    assert writer.snapshot()["pending"] == 0
+    assert writer.snapshot()["dropped"] == 1
+
+
+def test_update_of_a_missing_document_waits_for_its_insert(collection):
+    async def scenario():
+        writer = BulkWriter("logs", max_batch=10, flush_seconds=60)
+        await writer.add(update("late"), retry_id="late")
+        await writer.flush()
+        assert writer.snapshot()["pending"] == 1
+        collection.ids.add("late")
+        await writer.flush()
+        return writer
+
+    writer = run(scenario())
+    assert writer.snapshot()["pending"] == 0
+    assert writer.snapshot()["retried"] == 1
+    assert len(collection.batches) == 2
+
+
+def test_rejected_writes_are_dropped(collection):
+    async def scenario():
+        writer = BulkWriter("logs", max_batch=10, flush_seconds=60)
+        collection.failures.append(BulkWriteError({
+            "writeErrors": [{"index": 1, "code": 11000, "errmsg": "duplicate key"}],
+            "nInserted": 2
+        }))
+        await writer.extend([InsertOne({"id": str(i)}) for i in range(3)])
+        await writer.flush()
+        return writer
+
+    writer = run(scenario())
+    assert writer.snapshot() == {"pending": 0, "flushes": 1, "writes": 2, "retried": 0, "dropped": 1}
+
+
+def test_ordered_writer_keeps_writes_after_the_rejected_one(collection):
+    async def scenario():
+        writer = BulkWriter("logs", max_batch=10, flush_seconds=60, ordered=True)
+        collection.failures.append(BulkWriteError({
+            "writeErrors": [{"index": 1, "code": 121, "errmsg": "document failed validation"}],
+            "nMatched": 1
+        }))
+        operations = [update(str(i)) for i in range(4)]
+        await writer.extend(operations)
+        await writer.flush()
+        assert writer.snapshot()["pending"] == 2
+        await writer.flush()
+        return writer, operations
+
+    writer, operations = run(scenario())
+    assert collection.batches == [operations[2:]]
+    assert writer.snapshot()["dropped"] == 1
+    assert writer.snapshot()["pending"] == 0
@@ -0,0 +1,163 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from server import CircuitBreaker, ResendError
+
+SETTINGS = {
+    "email_provider": "resend",
+    "resend_api_key": "key",
+    "email_fallback_providers": [{"name": "backup-smtp", "email_provider": "smtp", "smtp_host": "mail.test"}]
+}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(server.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_seconds=60)
+
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.try_acquire()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.trips == 1
+    assert not breaker.try_acquire()
+    assert breaker.retry_in() == 60
+
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=60)
+
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=60)
+    breaker.record_failure()
+
+    clock[0] += 60
+    assert breaker.try_acquire()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.try_acquire()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.try_acquire()
+
+
+def test_failed_probe_reopens(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=60)
+    breaker.record_failure()
+
+    clock[0] += 60
+    assert breaker.try_acquire()
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.trips == 2
+    assert not breaker.try_acquire()
+
+
+def test_released_probe_frees_the_slot(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=60)
+    breaker.record_failure()
+    clock[0] += 60
+
+    assert breaker.try_acquire()
+    breaker.release()
+
+    assert breaker.try_acquire()
+
+
+def test_stale_probe_does_not_block_forever(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=60)
+    breaker.record_failure()
+    clock[0] += 60
+    assert breaker.try_acquire()
+
+    clock[0] += 59
+    assert not breaker.try_acquire()
+    clock[0] += 1
+    assert breaker.try_acquire()
+
+
+def test_snapshot(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=60)
+    breaker.record_failure()
+    clock[0] += 15
+
+    assert breaker.snapshot() == {
+        "state": "open",
+        "available": False,
+        "consecutive_failures": 1,
+        "trips": 1,
+        "retry_in_seconds": 45.0
+    }
+
+
+@pytest.fixture
+def leased_jobs(db, monkeypatch):
+    monkeypatch.setattr(server, "circuit_breakers", {})
+    monkeypatch.setattr(server, "rate_limiters", {})
+    monkeypatch.setattr(server, "quota_exhausted_until", {})
+    now = datetime.now(timezone.utc)
+    jobs = [{
+        "id": f"job-{i}",
+        "to_email": f"user{i}@example.com",
+        "status": "sending",
+        "lease_owner": "worker-1",
+        "lease_expires_at": now + timedelta(seconds=server.OUTBOX_LEASE_SECONDS),
+        "attempts": 1,
+        "available_at": now
+    } for i in range(2)]
+    asyncio.run(db.email_outbox.insert_many([dict(job) for job in jobs]))
+    return jobs
+
+
+def test_failed_batch_waits_before_failing_over(db, leased_jobs, monkeypatch):
+    async def failing_batch(jobs, provider_settings):
+        raise ResendError(503, "unavailable")
+
+    monkeypatch.setattr(server, "send_resend_batch", failing_batch)
+
+    asyncio.run(server.deliver_outbox_batch(leased_jobs, SETTINGS))
+
+    returned = asyncio.run(db.email_outbox.find({}, {"_id": 0}).to_list(None))
+    # mongomock returns naive UTC datetimes
+    earliest = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=server.OUTBOX_RETRY_BASE_SECONDS / 2)
+    assert {job["status"] for job in returned} == {"pending"}
+    assert {job["lease_owner"] for job in returned} == {None}
+    # The bounce counts as an attempt and is not claimable straight away
+    assert {job["attempts"] for job in returned} == {1}
+    assert all(job["available_at"] >= earliest - timedelta(seconds=1) for job in returned)
+    assert server.get_circuit_breaker("resend").failures == 1
+
+
+def test_jobs_bounced_too_often_are_dead_lettered(db, leased_jobs, monkeypatch):
+    for job in leased_jobs:
+        job["attempts"] = server.OUTBOX_MAX_ATTEMPTS + 1
+
+    async def unexpected_batch(jobs, provider_settings):
+        raise AssertionError("no send expected")
+
+    monkeypatch.setattr(server, "send_resend_batch", unexpected_batch)
+    monkeypatch.setattr(server, "record_outbox_result", lambda *args, **kwargs: asyncio.sleep(0))
+
+    asyncio.run(server.deliver_outbox_batch(leased_jobs, SETTINGS))
+
+    statuses = asyncio.run(db.email_outbox.distinct("status"))
+    assert statuses == ["dead"]
@@ -0,0 +1,143 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from server import EmailTemplateStore
+
+ADMIN = {"id": "admin-1", "role": "admin"}
+SERVICE = {
+    "id": "svc",
+    "name": "CRM",
+    "provider": "Acme",
+    "category_name": "SaaS",
+    "expiry_date": (datetime.now(timezone.utc) + timedelta(days=7)).isoformat(),
+    "owners": [{"name": "Ana", "role": "Owner", "email": "ana@example.com"}]
+}
+
+
+@pytest.fixture
+def store(db, monkeypatch):
+    asyncio.run(db.email_templates.create_index([("label_key", 1), ("version", -1)], unique=True))
+    store = EmailTemplateStore(ttl_seconds=60)
+    monkeypatch.setattr(server, "email_template_store", store)
+    return store
+
+
+def save(label, subject, html):
+    return asyncio.run(server.save_email_template(label, subject, html, ADMIN["id"]))
+
+
+def render(threshold_label):
+    subject, body = asyncio.run(server.render_notification(SERVICE, 7, threshold_label, "Example Corp"))
+    return subject, body.render({"recipient_name": "Ana"})
+
+
+@pytest.mark.parametrize("subject,html,message", [
+    ("", "<p>Hi</p>", "single non-empty line"),
+    ("Line\nbreak", "<p>Hi</p>", "single non-empty line"),
+    ("$service_name", "<p>$password</p>", "Unknown field(s) in html template: password"),
+    ("$owners_html", "<p>Hi</p>", "Unknown field(s) in subject template: owners_html"),
+    ("Expiring", "<p>$ 5</p>", "Invalid html template"),
+    ("Expiring", "x" * (server.EMAIL_TEMPLATE_MAX_BYTES + 1), "exceeds")
+])
+def test_invalid_templates_are_rejected(subject, html, message):
+    with pytest.raises(HTTPException) as excinfo:
+        server.validate_email_template(subject, html)
+
+    assert excinfo.value.status_code == 400
+    assert message in excinfo.value.detail
+
+
+def test_saving_creates_a_new_version(store):
+    first = save("One Week", "$urgency: $service_name", "<p>v1 $recipient_name</p>")
+    second = save("one week ", "$urgency: $service_name", "<p>v2 $recipient_name</p>")
+
+    assert (first["version"], second["version"]) == (1, 2)
+    assert second["label_key"] == "one week"
+    versions = asyncio.run(server.get_email_template_versions("ONE WEEK", current_user=ADMIN))
+    assert [v["version"] for v in versions] == [2, 1]
+
+
+def test_custom_template_is_rendered_for_its_label(store):
+    save("One Week", "$urgency: $service_name expires in $days_until_expiry days", "<p>Hi  $recipient_name, $service_name</p>")
+
+    subject, html = render("one week")
+
+    assert subject == "WARNING: CRM expires in 7 days"
+    assert html == "<p>Hi Ana, CRM</p>"
+
+
+def test_wildcard_applies_to_labels_without_their_own_template(store):
+    save("*", "Any: $service_name", "<p>any</p>")
+    save("Final", "Final: $service_name", "<p>final</p>")
+
+    assert render("First reminder")[0] == "Any: CRM"
+    assert render("Final")[0] == "Final: CRM"
+
+
+def test_built_in_template_is_used_without_a_custom_one(store):
+    subject, html = render("One Week")
+
+    assert subject == server.get_notification_subject(SERVICE, 7)
+    assert "CRM" in html
+
+
+def test_revert_saves_an_earlier_version_as_the_newest(store):
+    save("Final", "Old $service_name", "<p>old</p>")
+    save("Final", "New $service_name", "<p>new</p>")
+
+    reverted = asyncio.run(server.revert_email_template("final", 1, current_user=ADMIN))
+
+    assert reverted["version"] == 3
+    assert render("Final")[0] == "Old CRM"
+
+
+def test_delete_falls_back_to_the_built_in_template(store):
+    save("Final", "Custom $service_name", "<p>custom</p>")
+    render("Final")
+
+    asyncio.run(server.delete_email_template("Final", current_user=ADMIN))
+
+    assert render("Final")[0] == server.get_notification_subject(SERVICE, 7)
+    with pytest.raises(HTTPException):
+        asyncio.run(server.delete_email_template("Final", current_user=ADMIN))
+
+
+def test_versions_are_compiled_once(store, monkeypatch):
+    save("Final", "Custom $service_name", "<p>custom</p>")
+    parses = []
+    parse = server.CompiledTemplate.parse
+    monkeypatch.setattr(server.CompiledTemplate, "parse", staticmethod(lambda source: parses.append(source) or parse(source)))
+
+    for _ in range(3):
+        render("Final")
+
+    assert len(parses) == 2
+
+
+def test_writes_in_other_processes_are_seen_after_the_ttl(store, db, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(server.time, "monotonic", lambda: clock[0])
+    save("Final", "First $service_name", "<p>first</p>")
+    render("Final")
+    # Saved by another process
+    asyncio.run(db.email_templates.insert_one({
+        **server.EmailTemplate(label="Final", label_key="final", version=2, subject="Second $service_name",
+                               html="<p>second</p>", created_by="admin-2").model_dump()
+    }))
+
+    within_ttl = render("Final")[0]
+    clock[0] += 61
+
+    assert (within_ttl, render("Final")[0]) == ("First CRM", "Second CRM")
+
+
+def test_broken_stored_template_falls_back_to_the_built_in_one(store, db):
+    asyncio.run(db.email_templates.insert_one({
+        "label": "Final", "label_key": "final", "version": 1, "subject": "Custom", "html": "<p>$ 5</p>"
+    }))
+
+    assert render("Final")[0] == server.get_notification_subject(SERVICE, 7)
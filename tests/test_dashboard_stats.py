@@ -0,0 +1,88 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import server
+
+
+def make_service(service_id, days, category="Cloud", cost=10, status="active"):
+    return {
+        "id": service_id,
+        "status": status,
+        "expiry_date": (datetime.now(timezone.utc) + timedelta(days=days, hours=1)).isoformat(),
+        "category_name": category,
+        "cost": cost
+    }
+
+
+def full_stats():
+    stats = asyncio.run(server.compute_dashboard_stats(datetime.now(timezone.utc)))
+    stats.pop("by_category")
+    stats["categories"] = {k: v for k, v in stats["categories"].items() if v > 0}
+    return stats
+
+
+def load():
+    stats = asyncio.run(server.load_dashboard_stats())
+    stats.pop("as_of")
+    return stats
+
+
+def test_snapshot_counts_active_services(db):
+    asyncio.run(db.services.insert_many([
+        make_service("a", -3),
+        make_service("b", 10, cost=5),
+        make_service("c", 90, category="Office"),
+        make_service("d", 10, status="inactive")
+    ]))
+
+    assert load() == {
+        "total": 3,
+        "expired": 1,
+        "expiring_soon": 1,
+        "safe": 1,
+        "categories": {"Cloud": 2, "Office": 1},
+        "total_cost": 25
+    }
+
+
+def test_writes_are_applied_as_deltas(db):
+    services = [make_service("a", 10), make_service("b", 90, category="Office")]
+    asyncio.run(db.services.insert_many([dict(s) for s in services]))
+    load()
+
+    async def writes():
+        # Create
+        created = make_service("c", -1, category="HR", cost=7)
+        await db.services.insert_one(dict(created))
+        await server.update_dashboard_stats(None, created)
+        # Update: moves category and expiry bucket
+        updated = {**services[0], "category_name": "Office", "expiry_date": services[1]["expiry_date"], "cost": 3}
+        await db.services.replace_one({"id": "a"}, dict(updated))
+        await server.update_dashboard_stats(services[0], updated)
+        # Delete
+        await db.services.delete_one({"id": "b"})
+        await server.update_dashboard_stats(services[1], None)
+
+    asyncio.run(writes())
+
+    assert load() == full_stats()
+    assert asyncio.run(db.dashboard_snapshots.count_documents({})) == 1
+
+
+def test_unaddressable_category_invalidates_the_snapshot(db):
+    load()
+
+    asyncio.run(server.update_dashboard_stats(None, make_service("a", 10, category="v1.2")))
+
+    assert asyncio.run(db.dashboard_snapshots.count_documents({})) == 0
+
+
+def test_stale_snapshot_is_recomputed(db, monkeypatch):
+    asyncio.run(db.dashboard_snapshots.insert_one({
+        "id": server.DASHBOARD_STATS_ID,
+        "total": 99, "expiring_soon": 0, "expired": 0, "safe": 99, "categories": {}, "total_cost": 0,
+        "as_of": (datetime.now(timezone.utc) - timedelta(seconds=server.DASHBOARD_STATS_MAX_STALENESS_SECONDS + 1)).isoformat()
+    }))
+    asyncio.run(db.services.insert_one(make_service("a", 90)))
+
+    assert load()["total"] == 1
@@ -0,0 +1,100 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from server import JobProgress
+
+NOW = datetime(2026, 10, 19, 12, tzinfo=timezone.utc)
+THRESHOLDS = [{"id": "t30", "label": "30 days", "days_before": 30}]
+
+
+class FakeWriter:
+    def __init__(self):
+        self.operations = []
+
+    async def add(self, operation, **kwargs):
+        self.operations.append(operation)
+
+    async def extend(self, operations):
+        self.operations.extend(operations)
+
+
+@pytest.fixture
+def marked(db, monkeypatch):
+    marked = []
+
+    async def mark_threshold_sent(service, threshold_id):
+        marked.append((service["id"], threshold_id))
+
+    monkeypatch.setattr(server, "mark_threshold_sent", mark_threshold_sent)
+    monkeypatch.setattr(server, "notification_log_writer", FakeWriter())
+    return marked
+
+
+def make_service(service_id, days, *emails):
+    return {
+        "id": service_id,
+        "name": service_id.upper(),
+        "status": "active",
+        "expiry_date": (NOW + timedelta(days=days, hours=1)).isoformat(),
+        "reminder_thresholds": THRESHOLDS,
+        "owners": [{"email": email, "name": email.split("@")[0]} for email in emails]
+    }
+
+
+def run_digest(services):
+    asyncio.run(server.send_digest_notifications(services, NOW, JobProgress(None)))
+    return asyncio.run(server.db.email_outbox.find({}, {"_id": 0}).to_list(None))
+
+
+def test_one_email_per_recipient(marked):
+    jobs = run_digest([
+        make_service("crm", 20, "ana@example.com", "bo@example.com"),
+        make_service("erp", 5, "ana@example.com"),
+        make_service("wiki", 60, "ana@example.com")
+    ])
+
+    by_recipient = {job["to_email"]: job for job in jobs}
+    assert sorted(by_recipient) == ["ana@example.com", "bo@example.com"]
+    digest = by_recipient["ana@example.com"]
+    assert digest["subject"] == "WARNING: 2 services are expiring soon"
+    assert digest["days_until_expiry"] == 5
+    assert [item["service_id"] for item in digest["digest_items"]] == ["crm", "erp"]
+    # A recipient with a single due service gets the regular reminder
+    single = by_recipient["bo@example.com"]
+    assert single["digest_items"] == []
+    assert single["service_id"] == "crm"
+    assert sorted(marked) == [("crm", "t30"), ("erp", "t30"), ("wiki", None)]
+
+
+def test_recipients_are_grouped_case_insensitively(marked):
+    jobs = run_digest([
+        make_service("crm", 20, "Ana@Example.com"),
+        make_service("erp", 20, "ana@example.com")
+    ])
+
+    assert len(jobs) == 1
+    assert len(jobs[0]["digest_items"]) == 2
+
+
+def test_pairs_already_sent_are_left_out(marked):
+    crm = make_service("crm", 20, "ana@example.com")
+    erp = make_service("erp", 20, "ana@example.com")
+    asyncio.run(server.claim_notification_pairs({server.get_idempotency_key(crm, "t30", "ana@example.com"): "earlier-job"}))
+
+    jobs = run_digest([crm, erp])
+
+    assert len(jobs) == 1
+    assert jobs[0]["service_id"] == "erp"
+    assert jobs[0]["digest_items"] == []
+
+
+def test_rerun_queues_nothing_new(marked):
+    services = [make_service("crm", 20, "ana@example.com"), make_service("erp", 20, "ana@example.com")]
+
+    run_digest(services)
+    jobs = run_digest(services)
+
+    assert len(jobs) == 1
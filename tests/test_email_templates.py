@@ -0,0 +1,113 @@
+import re
+from html.parser import HTMLParser
+
+import pytest
+
+from server import (
+    DIGEST_EMAIL_TEMPLATE,
+    EXPIRY_EMAIL_TEMPLATE,
+    CompiledTemplate,
+    compile_template,
+    get_email_html_template,
+    get_expiry_email_values,
+    minify_html,
+    render_expiry_email,
+)
+
+
+class TextExtractor(HTMLParser):
+    """Text a mail client shows, with whitespace runs collapsed like a browser"""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.hidden = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("head", "style", "title"):
+            self.hidden += 1
+
+    def handle_endtag(self, tag):
+        if tag in ("head", "style", "title"):
+            self.hidden -= 1
+
+    def handle_data(self, data):
+        if not self.hidden:
+            self.chunks.append(data)
+
+
+def visible_text(source):
+    parser = TextExtractor()
+    parser.feed(source)
+    return re.sub(r"\s+", " ", "".join(parser.chunks)).strip()
+
+
+SERVICE = {
+    "name": "Domain & DNS",
+    "provider": "Registrar",
+    "category_name": "Infrastructure",
+    "expiry_date": "2026-11-01T00:00:00+00:00",
+    "owners": [{"name": "Ada", "role": "Owner"}]
+}
+
+
+def test_whitespace_between_inline_elements_is_kept():
+    assert minify_html("<p><b>Hello</b> <i>world</i></p>") == "<p><b>Hello</b> <i>world</i></p>"
+
+
+def test_whitespace_runs_collapse_to_one_space():
+    assert minify_html("  <p>\n    Hello,\n\n    world\t</p>\n") == "<p> Hello, world </p>"
+
+
+def test_preformatted_blocks_are_left_alone():
+    source = "<div>\n  <pre>line 1\n    line 2</pre>\n</div>"
+
+    assert minify_html(source) == "<div> <pre>line 1\n    line 2</pre> </div>"
+
+
+@pytest.mark.parametrize("template", [EXPIRY_EMAIL_TEMPLATE, DIGEST_EMAIL_TEMPLATE])
+def test_minification_keeps_the_visible_text(template):
+    assert visible_text(minify_html(template)) == visible_text(template)
+    assert len(minify_html(template)) < len(template)
+
+
+def test_rendered_reminder_text_matches_the_unminified_template():
+    values = {"recipient_name": "Ada"}
+    minified = render_expiry_email(SERVICE, 3, "Second reminder", "Acme").render(values)
+    full = compile_template(EXPIRY_EMAIL_TEMPLATE, minify=False).render({
+        **get_expiry_email_values(SERVICE, 3, "Second reminder", "Acme"), **values
+    })
+
+    assert visible_text(minified) == visible_text(full)
+    assert "Provider: Registrar" in visible_text(minified)
+
+
+def test_per_recipient_render_matches_a_full_render():
+    body = render_expiry_email(SERVICE, 3, "Second reminder", "Acme")
+
+    assert body.fields == {"recipient_name"}
+    assert body.render({"recipient_name": "Ada"}) == get_email_html_template(SERVICE, "Ada", 3, "Second reminder", "Acme")
+
+
+def test_values_are_escaped():
+    html = get_email_html_template(SERVICE, "<script>", 3, "Second reminder", "Acme")
+
+    assert "Domain &amp; DNS" in html
+    assert "&lt;script&gt;" in html
+    assert "<script>" not in html
+
+
+def test_compiled_template_bind_and_render():
+    template = CompiledTemplate.parse("Hi ${name}, $service costs $$5")
+
+    assert template.fields == {"name", "service"}
+    bound = template.bind({"service": "DNS"})
+    assert bound.fields == {"name"}
+    assert bound.render({"name": "Ada"}) == "Hi Ada, DNS costs $5"
+    with pytest.raises(KeyError):
+        bound.render({})
+
+
+def test_invalid_placeholder_reports_the_line():
+    with pytest.raises(ValueError, match="line 2"):
+        CompiledTemplate.parse("<p>\n$ 5</p>")
@@ -0,0 +1,56 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import BackgroundTasks
+
+import server
+
+
+@pytest.fixture
+def processed(db, monkeypatch):
+    calls = []
+
+    async def process_due_service(service, now):
+        calls.append(service["id"])
+
+    monkeypatch.setattr(server, "process_due_service", process_due_service)
+    now = datetime.now(timezone.utc)
+    asyncio.run(db.services.insert_many([
+        {"id": "due", "name": "CRM", "status": "active", "next_notification_at": now - timedelta(minutes=1)},
+        {"id": "later", "name": "ERP", "status": "active", "next_notification_at": now + timedelta(days=3)},
+        {"id": "inactive", "name": "Old", "status": "inactive", "next_notification_at": now - timedelta(minutes=1)},
+    ]))
+    return calls
+
+
+def set_digest(db, enabled):
+    asyncio.run(db.settings.insert_one({**server.AppSettings().model_dump(), "notification_digest": enabled}))
+
+
+def test_due_service_is_queued_right_away(db, processed):
+    set_digest(db, False)
+
+    for service_id in ("due", "later", "inactive"):
+        asyncio.run(server.notify_if_due(service_id))
+
+    assert processed == ["due"]
+
+
+def test_digest_mode_leaves_the_service_for_the_next_scan(db, processed):
+    set_digest(db, True)
+
+    asyncio.run(server.notify_if_due("due"))
+
+    assert processed == []
+
+
+def test_only_due_writes_schedule_a_notification():
+    now = datetime.now(timezone.utc)
+    background_tasks = BackgroundTasks()
+
+    server.schedule_notification_if_due(background_tasks, "due", now - timedelta(seconds=1))
+    server.schedule_notification_if_due(background_tasks, "later", now + timedelta(days=1))
+    server.schedule_notification_if_due(background_tasks, "unscheduled", None)
+
+    assert [task.args for task in background_tasks.tasks] == [("due",)]
@@ -0,0 +1,107 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import BackgroundTasks
+
+import server
+from server import JobProgress
+
+USER = {"id": "u1", "role": "admin"}
+
+
+@pytest.fixture
+def jobs(db):
+    asyncio.run(db.jobs.create_index([("type", 1)], unique=True, partialFilterExpression={"active": True}))
+    return db.jobs
+
+
+def trigger():
+    background_tasks = BackgroundTasks()
+    response = asyncio.run(server.trigger_expiry_check(background_tasks, current_user=USER))
+    return response, background_tasks
+
+
+def test_trigger_while_a_run_is_in_flight_attaches_to_it(jobs):
+    first, first_tasks = trigger()
+    second, second_tasks = trigger()
+
+    assert first["message"] == "Expiry check triggered"
+    assert len(first_tasks.tasks) == 1
+    assert second["message"] == "Expiry check already in progress"
+    assert second["job_id"] == first["job_id"]
+    assert second_tasks.tasks == []
+    assert asyncio.run(jobs.find_one({"id": first["job_id"]}))["attached"] == 1
+
+
+def test_finished_run_frees_the_slot(jobs, monkeypatch):
+    async def check_expiring_services(progress):
+        progress.incr("due_services", 3)
+        async with progress.phase("select"):
+            pass
+
+    monkeypatch.setattr(server, "check_expiring_services", check_expiring_services)
+    first, _ = trigger()
+    asyncio.run(server.run_expiry_check_job(first["job_id"]))
+    second, _ = trigger()
+
+    job = asyncio.run(server.get_job(first["job_id"], current_user=USER))
+    assert job["status"] == "done"
+    assert job["counts"] == {"due_services": 3}
+    assert job["phases"]["select"]["duration_seconds"] is not None
+    assert "active" not in job
+    assert second["job_id"] != first["job_id"]
+
+
+def test_failed_run_is_recorded(jobs, monkeypatch):
+    async def check_expiring_services(progress):
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(server, "check_expiring_services", check_expiring_services)
+    first, _ = trigger()
+    asyncio.run(server.run_expiry_check_job(first["job_id"]))
+
+    job = asyncio.run(jobs.find_one({"id": first["job_id"]}))
+    assert (job["status"], job["error"]) == ("failed", "database unavailable")
+
+
+def test_abandoned_run_is_replaced(jobs):
+    first, _ = trigger()
+    asyncio.run(jobs.update_one({"id": first["job_id"]}, {"$set": {
+        "heartbeat_at": datetime.now(timezone.utc) - timedelta(seconds=server.JOB_STALE_SECONDS + 1)
+    }}))
+
+    second, _ = trigger()
+
+    assert second["message"] == "Expiry check triggered"
+    abandoned = asyncio.run(jobs.find_one({"id": first["job_id"]}))
+    assert (abandoned["status"], abandoned["error"]) == ("failed", "Abandoned (no heartbeat)")
+
+
+def test_scheduled_run_is_skipped_while_one_is_in_flight(jobs, monkeypatch):
+    runs = []
+
+    async def run_expiry_check_job(job_id):
+        runs.append(job_id)
+
+    monkeypatch.setattr(server, "run_expiry_check_job", run_expiry_check_job)
+    trigger()
+
+    asyncio.run(server.scheduled_expiry_check())
+
+    assert runs == []
+
+
+def test_progress_flushes_on_the_heartbeat(jobs, monkeypatch):
+    asyncio.run(jobs.insert_one({"id": "job-1", "counts": {}}))
+
+    async def scenario():
+        progress = JobProgress("job-1")
+        progress.incr("emails_queued", 2)
+        await progress.maybe_flush()
+        unflushed = (await jobs.find_one({"id": "job-1"}))["counts"]
+        monkeypatch.setattr(JobProgress, "HEARTBEAT_SECONDS", 0)
+        await progress.maybe_flush()
+        return unflushed, (await jobs.find_one({"id": "job-1"}))["counts"]
+
+    assert asyncio.run(scenario()) == ({}, {"emails_queued": 2})
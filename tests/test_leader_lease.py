@@ -0,0 +1,111 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from server import LeaderLease
+
+
+def test_only_one_replica_holds_the_lease(db):
+    async def scenario():
+        first = LeaderLease("scheduler", 30)
+        second = LeaderLease("scheduler", 30)
+        return await first.try_acquire(), await second.try_acquire(), await first.try_acquire(), first, second
+
+    first_acquired, second_acquired, renewed, first, second = asyncio.run(scenario())
+    assert (first_acquired, second_acquired, renewed) == (True, False, True)
+    assert first.is_leader
+    assert not second.is_leader
+
+
+def test_expired_lease_is_taken_over(db):
+    async def scenario():
+        first = LeaderLease("scheduler", 30)
+        second = LeaderLease("scheduler", 30)
+        await first.try_acquire()
+        # The holder stopped renewing
+        await db.leader_locks.update_one({"_id": "scheduler"}, {"$set": {"expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+        return await second.try_acquire(), await first.try_acquire()
+
+    assert asyncio.run(scenario()) == (True, False)
+
+
+def test_stopping_releases_the_lease_at_once(db):
+    async def scenario():
+        first = LeaderLease("scheduler", 30)
+        second = LeaderLease("scheduler", 30)
+        await first.try_acquire()
+        await first.stop()
+        return first.is_leader, await second.try_acquire()
+
+    assert asyncio.run(scenario()) == (False, True)
+
+
+def test_leases_are_independent_by_name(db):
+    async def scenario():
+        return await LeaderLease("scheduler", 30).try_acquire(), await LeaderLease("reports", 30).try_acquire()
+
+    assert asyncio.run(scenario()) == (True, True)
+
+
+def test_standby_takes_over_when_the_leader_stops(db):
+    changes = []
+
+    async def scenario():
+        holder = LeaderLease("scheduler", 30)
+        await holder.try_acquire()
+        # Short lease so the standby's heartbeat runs every 10ms
+        standby = LeaderLease("scheduler", 0.03, on_change=changes.append)
+        standby.start()
+        await asyncio.sleep(0.05)
+        standing_by = list(changes)
+        await holder.stop()
+        await asyncio.sleep(0.05)
+        leader = standby.is_leader
+        await standby.stop()
+        return standing_by, leader
+
+    standing_by, leader = asyncio.run(scenario())
+    assert standing_by == []
+    assert leader
+    assert changes == [True]
+
+
+@pytest.fixture
+def lease(db, monkeypatch):
+    lease = LeaderLease("scheduler", 30)
+    monkeypatch.setattr(server, "scheduler_lease", lease)
+    return lease
+
+
+def test_leader_only_runs_on_the_leader(lease):
+    runs = []
+
+    @server.leader_only
+    async def job():
+        runs.append(1)
+
+    async def scenario():
+        await job()
+        # Another replica cannot take the lease while it is renewed
+        await LeaderLease("scheduler", 30).try_acquire()
+        await job()
+
+    asyncio.run(scenario())
+    assert runs == [1, 1]
+
+
+def test_leader_only_skips_on_standbys(lease):
+    runs = []
+
+    @server.leader_only
+    async def job():
+        runs.append(1)
+
+    async def scenario():
+        await LeaderLease("scheduler", 30).try_acquire()
+        await job()
+
+    asyncio.run(scenario())
+    assert runs == []
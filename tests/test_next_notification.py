@@ -0,0 +1,74 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from server import compute_next_notification_at, get_due_threshold
+
+EXPIRY = datetime(2026, 12, 1, 9, 30, tzinfo=timezone.utc)
+THRESHOLDS = [
+    {"id": "t7", "label": "One week", "days_before": 7},
+    {"id": "t30", "label": "One month", "days_before": 30}
+]
+
+
+def make_service(**fields):
+    return {"id": "svc", "name": "CRM", "status": "active", "expiry_date": EXPIRY.isoformat(),
+            "reminder_thresholds": THRESHOLDS, **fields}
+
+
+def test_next_notification_is_the_earliest_unsent_threshold():
+    assert compute_next_notification_at(make_service()) == EXPIRY - timedelta(days=31)
+    assert compute_next_notification_at(make_service(notifications_sent=["t30"])) == EXPIRY - timedelta(days=8)
+    assert compute_next_notification_at(make_service(notifications_sent=["t30", "t7"])) is None
+
+
+@pytest.mark.parametrize("fields", [{"status": "inactive"}, {"expiry_date": ""}, {"expiry_date": "soon"}])
+def test_services_that_are_never_notified(fields):
+    assert compute_next_notification_at(make_service(**fields)) is None
+
+
+@pytest.mark.parametrize("sent", [[], ["t30"]])
+def test_threshold_becomes_due_at_the_next_notification_time(sent):
+    service = make_service(notifications_sent=sent)
+    due_at = compute_next_notification_at(service)
+
+    assert get_due_threshold(service, due_at - timedelta(seconds=1)) is None
+    assert get_due_threshold(service, due_at + timedelta(seconds=1))["threshold_id"] == ("t7" if sent else "t30")
+
+
+def test_scan_only_processes_due_services(db, monkeypatch):
+    processed = []
+
+    async def process_due_service(service, now):
+        processed.append(service["id"])
+
+    async def flush_write_buffers():
+        pass
+
+    monkeypatch.setattr(server, "process_due_service", process_due_service)
+    monkeypatch.setattr(server, "flush_write_buffers", flush_write_buffers)
+    now = datetime.now(timezone.utc)
+    asyncio.run(db.services.insert_many([
+        {"id": "due", "status": "active", "next_notification_at": now - timedelta(hours=1)},
+        {"id": "later", "status": "active", "next_notification_at": now + timedelta(days=1)},
+        {"id": "done", "status": "active", "next_notification_at": None},
+        {"id": "inactive", "status": "inactive", "next_notification_at": now - timedelta(hours=1)}
+    ]))
+
+    counts = asyncio.run(server.check_expiring_services())
+
+    assert processed == ["due"]
+    assert counts["due_services"] == 1
+
+
+def test_backfill_sets_the_next_notification_time(db):
+    asyncio.run(db.services.insert_many([make_service(id="old"), make_service(id="new", next_notification_at=None)]))
+
+    asyncio.run(server.backfill_next_notification_at())
+
+    old = asyncio.run(db.services.find_one({"id": "old"}))
+    new = asyncio.run(db.services.find_one({"id": "new"}))
+    assert old["next_notification_at"] == (EXPIRY - timedelta(days=31)).replace(tzinfo=None)
+    assert new["next_notification_at"] is None
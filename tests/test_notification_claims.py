@@ -0,0 +1,100 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from server import claim_notification_pairs, release_notification_pairs
+
+
+@pytest.fixture(autouse=True)
+def no_logs(monkeypatch):
+    async def record_outbox_result(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(server, "record_outbox_result", record_outbox_result)
+
+
+def age_claims(db):
+    """Make every claim older than a lease"""
+    created_at = datetime.now(timezone.utc) - timedelta(seconds=server.OUTBOX_LEASE_SECONDS + 1)
+    asyncio.run(db.notification_claims.update_many({}, {"$set": {"created_at": created_at}}))
+
+
+def leased_job(job_id, attempts=1):
+    return {"id": job_id, "lease_owner": "worker-1", "to_email": "a@example.com", "service_name": "CRM", "attempts": attempts}
+
+
+def test_each_pair_is_claimed_once(db):
+    async def scenario():
+        first = await claim_notification_pairs({"svc:t30:a": "job-1", "svc:t30:b": "job-1"})
+        second = await claim_notification_pairs({"svc:t30:a": "job-2", "svc:t30:c": "job-2"})
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first == {"svc:t30:a", "svc:t30:b"}
+    assert second == {"svc:t30:c"}
+
+
+def test_recent_claims_are_not_taken_over(db):
+    asyncio.run(claim_notification_pairs({"svc:t30:a": "job-1"}))
+
+    assert asyncio.run(claim_notification_pairs({"svc:t30:a": "job-2"})) == set()
+
+
+def test_stale_claim_without_a_queued_job_is_taken_over(db):
+    asyncio.run(claim_notification_pairs({"svc:t30:a": "job-1"}))
+    age_claims(db)
+
+    assert asyncio.run(claim_notification_pairs({"svc:t30:a": "job-2"})) == {"svc:t30:a"}
+    claim = asyncio.run(db.notification_claims.find_one({"_id": "svc:t30:a"}))
+    assert claim["job_id"] == "job-2"
+
+
+def test_stale_claim_with_a_queued_job_is_kept(db):
+    asyncio.run(claim_notification_pairs({"svc:t30:a": "job-1"}))
+    asyncio.run(db.email_outbox.insert_one({"id": "job-1", "status": "pending"}))
+    age_claims(db)
+
+    assert asyncio.run(claim_notification_pairs({"svc:t30:a": "job-2"})) == set()
+
+
+@pytest.mark.parametrize("error,permanent", [(None, False), ("Invalid recipient", True)])
+def test_finished_pairs_are_never_claimed_again(db, error, permanent):
+    async def finish():
+        await claim_notification_pairs({"svc:t30:a": "job-1"})
+        await db.email_outbox.insert_one({"id": "job-1", "status": "sending", "lease_owner": "worker-1"})
+        await server.complete_outbox_job(leased_job("job-1"), error, permanent=permanent)
+        # The TTL index removes delivered jobs long before their claims expire
+        await db.email_outbox.delete_many({})
+
+    asyncio.run(finish())
+    age_claims(db)
+
+    assert asyncio.run(claim_notification_pairs({"svc:t30:a": "job-2"})) == set()
+
+
+def test_releasing_only_frees_own_claims(db):
+    async def scenario():
+        await claim_notification_pairs({"svc:t30:a": "job-1"})
+        await release_notification_pairs({"svc:t30:a": "job-2"})
+        kept = await claim_notification_pairs({"svc:t30:a": "job-3"})
+        await release_notification_pairs({"svc:t30:a": "job-1"})
+        return kept, await claim_notification_pairs({"svc:t30:a": "job-3"})
+
+    assert asyncio.run(scenario()) == (set(), {"svc:t30:a"})
+
+
+def test_claims_are_released_when_jobs_cannot_be_queued(db, monkeypatch):
+    async def failing_enqueue(jobs):
+        raise RuntimeError("outbox unavailable")
+
+    monkeypatch.setattr(server, "enqueue_outbox_jobs", failing_enqueue)
+
+    async def scenario():
+        await claim_notification_pairs({"svc:t30:a": "job-1"})
+        with pytest.raises(RuntimeError):
+            await server.enqueue_claimed_jobs([], {"svc:t30:a": "job-1"})
+        return await db.notification_claims.count_documents({})
+
+    assert asyncio.run(scenario()) == 0
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from server import NotificationDispatcher, parse_provider_limits
+
+
+def run_sends(dispatcher, provider, count, fail=False):
+    peak = 0
+    running = 0
+
+    async def send():
+        nonlocal peak, running
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        if fail:
+            raise ConnectionError("refused")
+        return "ok"
+
+    async def scenario():
+        return await asyncio.gather(*(dispatcher.send(provider, send) for _ in range(count)), return_exceptions=True)
+
+    return asyncio.run(scenario()), peak
+
+
+def test_provider_limit_bounds_concurrent_sends():
+    dispatcher = NotificationDispatcher(max_concurrency=10, provider_limits={"gmail": 2, "smtp": 4})
+
+    results, peak = run_sends(dispatcher, "gmail", 6)
+
+    assert results == ["ok"] * 6
+    assert peak == 2
+    assert dispatcher.snapshot()["sent"] == 6
+
+
+def test_global_limit_bounds_concurrent_sends():
+    dispatcher = NotificationDispatcher(max_concurrency=3, provider_limits={"resend": 10})
+
+    _, peak = run_sends(dispatcher, "resend", 8)
+
+    assert peak == 3
+
+
+def test_unknown_providers_use_the_smtp_limit():
+    dispatcher = NotificationDispatcher(max_concurrency=10, provider_limits={"smtp": 4})
+
+    _, peak = run_sends(dispatcher, "custom", 8)
+
+    assert peak == 4
+    assert dispatcher.capacity("custom") == 4
+
+
+def test_failures_are_counted_and_raised():
+    dispatcher = NotificationDispatcher(max_concurrency=4, provider_limits={"smtp": 4})
+
+    results, _ = run_sends(dispatcher, "smtp", 3, fail=True)
+
+    assert all(isinstance(result, ConnectionError) for result in results)
+    snapshot = dispatcher.snapshot()
+    assert (snapshot["sent"], snapshot["failed"], snapshot["in_flight"], snapshot["queue_depth"]) == (0, 3, 0, 0)
+
+
+def test_batch_calls_count_every_message():
+    dispatcher = NotificationDispatcher(max_concurrency=4, provider_limits={"resend": 4})
+
+    asyncio.run(dispatcher.send("resend", lambda: asyncio.sleep(0, result=[]), messages=50))
+
+    assert dispatcher.snapshot()["sent"] == 50
+    assert dispatcher.snapshot()["throughput_per_second"] == round(50 / NotificationDispatcher.THROUGHPUT_WINDOW_SECONDS, 2)
+
+
+@pytest.mark.parametrize("max_concurrency,limit,capacity", [(20, 2, 2), (3, 10, 3), (5, 0, 1)])
+def test_capacity(max_concurrency, limit, capacity):
+    assert NotificationDispatcher(max_concurrency, {"gmail": limit}).capacity("gmail") == capacity
+
+
+def test_provider_limits_are_parsed_from_the_environment_format():
+    assert parse_provider_limits("gmail=2, resend=10") == {"gmail": 2, "resend": 10}
+    assert parse_provider_limits("") == {}
@@ -0,0 +1,52 @@
+import numpy as np
+
+from server import simulate_notification_days
+
+FIRST_RUN = np.datetime64("2026-01-01T09:00:00")
+
+
+def simulate(expiry_offsets, days_before, first_run_index=0, daily=True):
+    expiry = FIRST_RUN + np.array(expiry_offsets, dtype="timedelta64[s]")
+    return simulate_notification_days(
+        expiry, np.array(days_before, dtype=np.float64), FIRST_RUN, first_run_index, daily
+    ).tolist()
+
+
+def days(n, hours=0):
+    return (n * 24 + hours) * 3600
+
+
+def test_expiry_on_the_scan_hour():
+    # Due once (expiry - now).days <= 7, i.e. at the scan exactly 7 days before
+    assert simulate([days(20)], [[7]]) == [[13.0]]
+
+
+def test_expiry_just_after_the_scan_hour():
+    assert simulate([days(20, 1)], [[7]]) == [[13.0]]
+    assert simulate([days(20) - 1], [[7]]) == [[12.0]]
+
+
+def test_one_threshold_per_scan():
+    # All three thresholds are due, but only one goes out per daily scan
+    assert simulate([days(1, 1)], [[30, 7, 1]]) == [[0.0, 1.0, 2.0]]
+
+
+def test_scan_already_ran_today():
+    assert simulate([days(3)], [[30, 7]], first_run_index=1) == [[1.0, 2.0]]
+
+
+def test_padding_is_never_sent():
+    result = simulate([days(40), days(40)], [[30, 7], [30, np.nan]])
+
+    assert result[0] == [10.0, 33.0]
+    assert result[1][0] == 10.0
+    assert result[1][1] == float("inf")
+
+
+def test_interval_scans_send_on_the_day_the_threshold_is_due():
+    first_run = np.datetime64("2026-01-01T00:00:00")
+    expiry = first_run + np.array([days(20, 12)], dtype="timedelta64[s]")
+
+    result = simulate_notification_days(expiry, np.array([[7.0]]), first_run, 0, daily=False)
+
+    assert result.tolist() == [[12.0]]
@@ -0,0 +1,161 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from server import OutboxJob, OutboxWorkerPool
+
+
+@pytest.fixture
+def outbox(db):
+    asyncio.run(db.email_outbox.create_index([("idempotency_key", 1)], unique=True))
+    return db.email_outbox
+
+
+def make_job(**fields):
+    return OutboxJob(
+        to_email="a@example.com",
+        subject="Reminder",
+        html="<p>Reminder</p>",
+        service_id="svc",
+        service_name="CRM",
+        days_until_expiry=30,
+        **fields
+    )
+
+
+def test_enqueue_skips_duplicate_idempotency_keys(outbox):
+    async def scenario():
+        first = await server.enqueue_outbox_jobs([make_job(idempotency_key="svc:t30:a"), make_job(idempotency_key="svc:t30:b")])
+        second = await server.enqueue_outbox_jobs([make_job(idempotency_key="svc:t30:a"), make_job(idempotency_key="svc:t30:c")])
+        return first, second, await outbox.count_documents({})
+
+    first, second, count = asyncio.run(scenario())
+    assert len(first) == 2
+    assert [job.idempotency_key for job in second] == ["svc:t30:c"]
+    assert count == 3
+
+
+def test_claim_leases_a_job_to_one_worker(outbox):
+    async def scenario():
+        await server.enqueue_outbox_jobs([make_job()])
+        return await server.claim_outbox_job("worker-1"), await server.claim_outbox_job("worker-2")
+
+    claimed, second = asyncio.run(scenario())
+    assert claimed["status"] == "sending"
+    assert claimed["lease_owner"] == "worker-1"
+    assert claimed["attempts"] == 1
+    assert second is None
+
+
+def test_expired_lease_is_claimed_again(outbox):
+    async def scenario():
+        await server.enqueue_outbox_jobs([make_job()])
+        await server.claim_outbox_job("worker-1")
+        await outbox.update_many({}, {"$set": {"lease_expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+        return await server.claim_outbox_job("worker-2")
+
+    reclaimed = asyncio.run(scenario())
+    assert reclaimed["lease_owner"] == "worker-2"
+    assert reclaimed["attempts"] == 2
+
+
+def test_jobs_are_not_claimed_before_they_are_due(outbox):
+    async def scenario():
+        await server.enqueue_outbox_jobs([make_job(available_at=datetime.now(timezone.utc) + timedelta(minutes=5))])
+        return await server.claim_outbox_job("worker-1")
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_failed_job_is_retried_then_dead_lettered(outbox, monkeypatch):
+    async def record_outbox_result(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(server, "record_outbox_result", record_outbox_result)
+    monkeypatch.setattr(server, "OUTBOX_MAX_ATTEMPTS", 2)
+
+    async def attempt():
+        # Make the retry due straight away
+        await outbox.update_many({}, {"$set": {"available_at": datetime.now(timezone.utc)}})
+        job = await server.claim_outbox_job("worker-1")
+        await server.complete_outbox_job(job, "Connection refused")
+        return await outbox.find_one({}, {"_id": 0})
+
+    async def scenario():
+        await server.enqueue_outbox_jobs([make_job()])
+        return await attempt(), await attempt()
+
+    retried, dead = asyncio.run(scenario())
+    assert retried["status"] == "pending"
+    assert retried["lease_owner"] is None
+    assert retried["available_at"] > datetime.now(timezone.utc).replace(tzinfo=None)
+    assert dead["status"] == "dead"
+    assert dead["last_error"] == "Connection refused"
+
+
+def test_completion_after_a_lost_lease_is_ignored(outbox, monkeypatch):
+    async def record_outbox_result(*args, **kwargs):
+        raise AssertionError("the new lease owner records the outcome")
+
+    monkeypatch.setattr(server, "record_outbox_result", record_outbox_result)
+
+    async def scenario():
+        await server.enqueue_outbox_jobs([make_job()])
+        job = await server.claim_outbox_job("worker-1")
+        await outbox.update_many({}, {"$set": {"lease_owner": "worker-2"}})
+        await server.complete_outbox_job(job)
+        return await outbox.find_one({}, {"_id": 0})
+
+    assert asyncio.run(scenario())["status"] == "sending"
+
+
+def test_retry_delay_grows_with_jitter():
+    base = server.OUTBOX_RETRY_BASE_SECONDS
+    for attempts, full in [(1, base), (2, 2 * base), (4, 8 * base)]:
+        delays = [server.get_retry_delay(attempts).total_seconds() for _ in range(50)]
+        assert all(full / 2 <= delay <= full for delay in delays)
+        assert len(set(delays)) > 1
+
+
+def test_concurrent_loops_never_exceed_the_capacity():
+    async def scenario():
+        pool = OutboxWorkerPool()
+        pool.start(0)
+        running = peak = 0
+
+        async def delivery():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        async def worker_loop():
+            for _ in range(5):
+                assert await pool.acquire_slot(2)
+                # Claiming jobs yields to the other loops
+                await asyncio.sleep(0)
+                pool.spawn(delivery())
+
+        await asyncio.gather(*(worker_loop() for _ in range(4)))
+        await asyncio.gather(*pool._deliveries)
+        return peak
+
+    assert asyncio.run(scenario()) == 2
+
+
+def test_released_slot_lets_a_waiting_loop_claim():
+    async def scenario():
+        pool = OutboxWorkerPool()
+        pool.start(0)
+        await pool.acquire_slot(1)
+        waiter = asyncio.ensure_future(pool.acquire_slot(1))
+        await asyncio.sleep(0)
+        blocked = not waiter.done()
+        # Nothing was claimed, so the slot is given back
+        await pool.release_slot()
+        return blocked, await asyncio.wait_for(waiter, timeout=1)
+
+    assert asyncio.run(scenario()) == (True, True)
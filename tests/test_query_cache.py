@@ -0,0 +1,90 @@
+import asyncio
+
+import server
+from server import MemoryCacheBackend, QueryCache
+
+
+class CountingLoader:
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+def test_repeated_lookups_are_served_from_memory(db):
+    async def scenario():
+        cache = QueryCache(MemoryCacheBackend(1024, generation_ttl_seconds=60))
+        loader = CountingLoader({"services": 3})
+        results = [await cache.get_or_load("stats", loader) for _ in range(3)]
+        return results, loader.calls, cache
+
+    results, calls, cache = asyncio.run(scenario())
+    assert results == [{"services": 3}] * 3
+    assert calls == 1
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_generation_is_not_read_again_within_the_ttl(db, monkeypatch):
+    reads = []
+    collection_type = type(db.cache_generations)
+    find_one = collection_type.find_one
+
+    async def counting_find_one(self, *args, **kwargs):
+        reads.append(args)
+        return await find_one(self, *args, **kwargs)
+
+    monkeypatch.setattr(collection_type, "find_one", counting_find_one)
+
+    async def scenario():
+        backend = MemoryCacheBackend(1024, generation_ttl_seconds=60)
+        return await asyncio.gather(*(backend.get_generation() for _ in range(5)))
+
+    assert asyncio.run(scenario()) == [0] * 5
+    assert len(reads) == 1
+
+
+def test_local_writes_invalidate_at_once(db):
+    async def scenario():
+        cache = QueryCache(MemoryCacheBackend(1024, generation_ttl_seconds=60))
+        await cache.get_or_load("stats", CountingLoader(1))
+        await cache.invalidate()
+        return await cache.get_or_load("stats", CountingLoader(2))
+
+    assert asyncio.run(scenario()) == 2
+
+
+def test_writes_in_other_processes_are_seen_after_the_ttl(db, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(server.time, "monotonic", lambda: clock[0])
+
+    async def scenario():
+        # Two backends stand in for two processes
+        reader = QueryCache(MemoryCacheBackend(1024, generation_ttl_seconds=1))
+        writer = QueryCache(MemoryCacheBackend(1024, generation_ttl_seconds=1))
+        await reader.get_or_load("stats", CountingLoader(1))
+        await writer.invalidate()
+        within_ttl = await reader.get_or_load("stats", CountingLoader(2))
+        clock[0] += 1
+        after_ttl = await reader.get_or_load("stats", CountingLoader(2))
+        return within_ttl, after_ttl
+
+    assert asyncio.run(scenario()) == (1, 2)
+
+
+def test_least_recently_used_entries_are_evicted(db):
+    async def scenario():
+        backend = MemoryCacheBackend(max_bytes=20)
+        await backend.set("a", "x" * 6)
+        await backend.set("b", "y" * 6)
+        await backend.get("a")
+        await backend.set("c", "z" * 6)
+        await backend.set("huge", "w" * 30)
+        return [await backend.get(key) for key in ("a", "b", "c", "huge")], backend
+
+    values, backend = asyncio.run(scenario())
+    assert values == ["x" * 6, None, "z" * 6, None]
+    assert backend.evictions == 1
+    assert backend.snapshot()["bytes"] <= 20
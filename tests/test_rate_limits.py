@@ -0,0 +1,188 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from server import AdaptiveRateLimiter
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(server, "rate_limiters", {})
+    monkeypatch.setattr(server, "quota_exhausted_until", {})
+
+
+def test_slots_are_shared_between_processes(db):
+    async def scenario():
+        # Two limiters for one provider stand in for two processes
+        first = AdaptiveRateLimiter("gmail", 1)
+        second = AdaptiveRateLimiter("gmail", 1)
+        return await first.acquire(timeout=0), await second.acquire(timeout=0), await second.acquire(timeout=2)
+
+    assert asyncio.run(scenario()) == (True, False, True)
+
+
+def test_burst_up_to_the_rate(db):
+    async def scenario():
+        limiter = AdaptiveRateLimiter("resend", 3)
+        return [await limiter.acquire(timeout=0) for _ in range(4)]
+
+    assert asyncio.run(scenario()) == [True, True, True, False]
+
+
+def test_providers_have_separate_buckets(db):
+    async def scenario():
+        gmail = AdaptiveRateLimiter("gmail", 1)
+        backup = AdaptiveRateLimiter("gmail-2", 1)
+        return await gmail.acquire(timeout=0), await backup.acquire(timeout=0)
+
+    assert asyncio.run(scenario()) == (True, True)
+
+
+def test_throttling_pauses_and_slows_every_process(db):
+    async def scenario():
+        first = AdaptiveRateLimiter("gmail", 4)
+        second = AdaptiveRateLimiter("gmail", 4)
+        backoff = await first.on_throttled(retry_after=30)
+        acquired = await second.acquire(timeout=5)
+        return backoff, acquired, second
+
+    backoff, acquired, second = asyncio.run(scenario())
+    assert backoff == 30
+    assert not acquired
+    assert second.rate == 2
+    assert 25 < second.paused_for() <= 30
+
+
+def test_backoff_grows_without_retry_after(db):
+    async def scenario():
+        limiter = AdaptiveRateLimiter("gmail", 16)
+        return [await limiter.on_throttled() for _ in range(6)], limiter.rate
+
+    backoffs, rate = asyncio.run(scenario())
+    assert backoffs == [30, 60, 120, 240, 480, 900]
+    assert rate == 1
+
+
+def test_successes_recover_the_rate(db):
+    async def scenario():
+        limiter = AdaptiveRateLimiter("gmail", 10)
+        await limiter.on_throttled(retry_after=1)
+        for _ in range(3):
+            await limiter.on_success()
+        other = AdaptiveRateLimiter("gmail", 10)
+        other._load(await server.db.email_rate_limits.find_one({"_id": "gmail"}))
+        return limiter.rate, other.rate
+
+    assert asyncio.run(scenario()) == (6.5, 6.5)
+
+
+def test_lowered_configured_rate_applies(db):
+    limiter = server.get_rate_limiter({"provider_id": "smtp", "email_provider": "smtp", "email_rate_limit_per_second": 8})
+    server.get_rate_limiter({"provider_id": "smtp", "email_provider": "smtp", "email_rate_limit_per_second": 2})
+
+    assert limiter.base_rate == 2
+    assert limiter.rate == 2
+
+
+def test_daily_quota_is_granted_up_to_the_limit(db):
+    async def scenario():
+        granted = [await server.reserve_daily_quota("gmail", 2, 3) for _ in range(3)]
+        exhausted = server.is_quota_exhausted("gmail")
+        await server.release_daily_quota("gmail", 1)
+        return granted, exhausted, server.is_quota_exhausted("gmail"), await server.reserve_daily_quota("gmail", 1, 3)
+
+    granted, exhausted, exhausted_after_release, regranted = asyncio.run(scenario())
+    assert granted == [2, 1, 0]
+    assert exhausted
+    assert not exhausted_after_release
+    assert regranted == 1
+
+
+def test_daily_quota_without_a_limit_only_counts(db):
+    async def scenario():
+        await server.reserve_daily_quota("resend", 5, None)
+        await server.reserve_daily_quota("resend", 5, None)
+        return await server.db.email_quota.find_one({})
+
+    doc = asyncio.run(scenario())
+    assert doc["count"] == 10
+    assert doc["provider"] == "resend"
+    assert not server.is_quota_exhausted("resend")
+
+
+def leased_jobs(db, count, lease_seconds=None):
+    now = datetime.now(timezone.utc)
+    jobs = [{
+        "id": f"job-{i}",
+        "to_email": f"user{i}@example.com",
+        "status": "sending",
+        "lease_owner": "worker-1",
+        "lease_expires_at": now + timedelta(seconds=lease_seconds or server.OUTBOX_LEASE_SECONDS),
+        "attempts": 1,
+        "available_at": now
+    } for i in range(count)]
+    asyncio.run(db.email_outbox.insert_many([dict(job) for job in jobs]))
+    return jobs
+
+
+def outbox(db):
+    return asyncio.run(db.email_outbox.find({}, {"_id": 0}).sort("id", 1).to_list(None))
+
+
+PROVIDER = {"provider_id": "resend", "email_provider": "resend"}
+
+
+def test_throttled_send_defers_the_jobs_without_using_an_attempt(db):
+    jobs = leased_jobs(db, 2)
+
+    async def throttled():
+        raise server.ResendError(429, "slow down", retry_after=20)
+
+    async def scenario():
+        await server.reserve_daily_quota("resend", 2, 100)
+        result = await server.send_rate_limited(PROVIDER, jobs, throttled)
+        return result, await db.email_quota.find_one({})
+
+    result, quota = asyncio.run(scenario())
+    assert result is None
+    assert quota["count"] == 0
+    deferred = outbox(db)
+    assert {job["status"] for job in deferred} == {"pending"}
+    assert {job["attempts"] for job in deferred} == {0}
+    assert {job["lease_owner"] for job in deferred} == {None}
+    earliest = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=19)
+    assert all(job["available_at"] >= earliest for job in deferred)
+    assert server.rate_limiters["resend"].paused_for() > 19
+
+
+def test_jobs_are_deferred_when_the_limit_outlasts_their_lease(db):
+    # Less than EMAIL_SEND_TIMEOUT_SECONDS of the lease is left, so there is no time to wait
+    jobs = leased_jobs(db, 1, lease_seconds=1)
+    calls = []
+
+    async def send():
+        calls.append(1)
+
+    async def scenario():
+        limiter = server.get_rate_limiter({**PROVIDER, "email_rate_limit_per_second": 1})
+        await limiter.acquire(timeout=0)
+        return await server.send_rate_limited(PROVIDER, jobs, send)
+
+    assert asyncio.run(scenario()) is None
+    assert calls == []
+    assert outbox(db)[0]["status"] == "pending"
+    assert outbox(db)[0]["last_error"] == "Waiting for the resend rate limit"
+
+
+def test_other_errors_propagate(db):
+    jobs = leased_jobs(db, 1)
+
+    async def failing():
+        raise server.ResendError(503, "unavailable")
+
+    with pytest.raises(server.ResendError):
+        asyncio.run(server.send_rate_limited(PROVIDER, jobs, failing))
+
+    assert outbox(db)[0]["status"] == "sending"
@@ -0,0 +1,75 @@
+import numpy as np
+
+from server import compute_renewal_forecast
+
+
+def forecast(expiry, duration_months, cost, start="2026-01-01", months=4, granularity="month"):
+    return compute_renewal_forecast(
+        np.array(expiry, dtype="datetime64[D]"),
+        np.array(duration_months),
+        np.array(cost, dtype=np.float64),
+        np.datetime64(start),
+        months,
+        granularity
+    )
+
+
+def test_recurring_and_one_off_renewals_per_month():
+    result = forecast(
+        ["2026-01-31", "2026-03-15", "NaT", "2025-12-01"],
+        [1, 0, 1, 12],
+        [10, 5, 1, 3]
+    )
+
+    assert [(p["period_start"], p["renewals"], p["cost"]) for p in result["periods"]] == [
+        ("2026-01-01", 1, 10.0),
+        ("2026-02-01", 1, 10.0),
+        ("2026-03-01", 2, 15.0),
+        ("2026-04-01", 1, 10.0),
+    ]
+    assert result["total_renewals"] == 5
+    assert result["total_cost"] == 45.0
+    assert result["overdue"] == {"count": 1, "cost": 3.0}
+
+
+def test_month_end_renewals_clamp_to_shorter_months():
+    # Jan 31 renews on Feb 28 (week 8 from Jan 1), not in March
+    result = forecast(["2026-01-31"], [1], [1], months=2, granularity="week")
+
+    renewal_weeks = [i for i, p in enumerate(result["periods"]) if p["renewals"]]
+    assert renewal_weeks == [4, 8]
+
+
+def test_renewals_outside_the_window_are_excluded():
+    result = forecast(["2026-05-01", "2026-02-10"], [0, 3], [1, 2], months=4)
+
+    # 2026-02-10 recurs on 2026-05-10, after the window
+    assert result["total_renewals"] == 1
+    assert result["total_cost"] == 2.0
+
+
+def test_weekly_buckets_cover_the_window():
+    result = forecast(["2026-01-01", "2026-01-07", "2026-01-08"], [0, 0, 0], [1, 1, 1], months=1, granularity="week")
+
+    assert [p["period_start"] for p in result["periods"]] == [
+        "2026-01-01", "2026-01-08", "2026-01-15", "2026-01-22", "2026-01-29"
+    ]
+    assert [p["renewals"] for p in result["periods"]] == [2, 1, 0, 0, 0]
+
+
+def test_no_services():
+    result = forecast([], [], [], months=2)
+
+    assert result["total_renewals"] == 0
+    assert [p["renewals"] for p in result["periods"]] == [0, 0]
+
+
+def test_monthly_periods_add_up_to_the_totals():
+    # Starting mid-month, the window ends with the 12th calendar month, so a
+    # renewal in the 13th month (2027-10) is outside it
+    result = forecast(["2027-10-05", "2026-10-25"], [0, 12], [4, 6], start="2026-10-19", months=12)
+
+    assert len(result["periods"]) == 12
+    assert result["periods"][-1]["period_start"] == "2027-09-01"
+    assert sum(p["renewals"] for p in result["periods"]) == result["total_renewals"] == 1
+    assert sum(p["cost"] for p in result["periods"]) == result["total_cost"] == 6.0
@@ -0,0 +1,110 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+import server
+from server import OutboxJob, ResendClient
+
+
+def make_client(handler):
+    client = ResendClient("https://resend.test", timeout_seconds=5, max_retries=0)
+    client._client = httpx.AsyncClient(base_url=client.base_url, transport=httpx.MockTransport(handler))
+    return client
+
+
+def queue_jobs(count, **fields):
+    jobs = [
+        OutboxJob(
+            to_email=f"user{i}@example.com",
+            subject=f"Subject {i}",
+            html="<p>Hi</p>",
+            service_id="svc",
+            service_name="CRM",
+            days_until_expiry=30,
+            **fields
+        )
+        for i in range(count)
+    ]
+    asyncio.run(server.enqueue_outbox_jobs(jobs))
+    return jobs
+
+
+def test_batch_results_map_to_messages_in_order(monkeypatch):
+    sent = []
+
+    def handler(request):
+        sent.append(request)
+        # Message 1 is rejected; accepted ids skip it
+        return httpx.Response(200, json={
+            "data": [{"id": "id-0"}, {"id": "id-2"}],
+            "errors": [{"index": 1, "message": "Invalid `to` field"}]
+        })
+
+    monkeypatch.setattr(server, "resend_client", make_client(handler))
+    messages = [
+        {"to_email": f"user{i}@example.com", "subject": f"Subject {i}", "html": "<p>Hi</p>"}
+        for i in range(3)
+    ]
+    results = asyncio.run(server.send_resend_batch(messages, {"resend_api_key": "key", "sender_email": "from@example.com"}))
+
+    assert results == [{"id": "id-0"}, {"error": "Invalid `to` field"}, {"id": "id-2"}]
+    assert sent[0].url.path == "/emails/batch"
+    assert sent[0].headers["x-batch-validation"] == "permissive"
+    assert [message["to"] for message in json.loads(sent[0].content)] == [[m["to_email"]] for m in messages]
+
+
+def test_batch_claim_leases_up_to_the_limit(db):
+    queue_jobs(3)
+
+    async def scenario():
+        first = await server.claim_outbox_batch("worker-1", 2)
+        second = await server.claim_outbox_batch("worker-2", 2)
+        third = await server.claim_outbox_batch("worker-3", 2)
+        return first, second, third
+
+    first, second, third = asyncio.run(scenario())
+    assert len(first) == 2
+    assert len(second) == 1
+    assert third == []
+    assert len({job["lease_owner"] for job in first}) == 1
+    assert first[0]["lease_owner"].startswith("worker-1:")
+    assert {job["attempts"] for job in first + second} == {1}
+    assert not {job["id"] for job in first} & {job["id"] for job in second}
+
+
+def test_batch_claim_skips_jobs_that_are_not_due(db):
+    queue_jobs(2, available_at=datetime.now(timezone.utc) + timedelta(minutes=5))
+
+    assert asyncio.run(server.claim_outbox_batch("worker-1", 10)) == []
+
+
+def test_batch_outcomes_are_recorded_per_message(db, monkeypatch):
+    monkeypatch.setattr(server, "circuit_breakers", {})
+    monkeypatch.setattr(server, "rate_limiters", {})
+    monkeypatch.setattr(server, "quota_exhausted_until", {})
+    recorded = []
+
+    async def record_outbox_result(job, status, error="", provider_message_id=None):
+        recorded.append((job["to_email"], status, error, provider_message_id))
+
+    async def send_resend_batch(jobs, provider_settings):
+        return [{"id": "id-0"}, {"error": "Invalid `to` field"}]
+
+    monkeypatch.setattr(server, "record_outbox_result", record_outbox_result)
+    monkeypatch.setattr(server, "send_resend_batch", send_resend_batch)
+    queue_jobs(2)
+
+    async def scenario():
+        jobs = await server.claim_outbox_batch("worker-1", 2)
+        await server.deliver_outbox_batch(jobs, {"email_provider": "resend", "resend_api_key": "key"})
+        return {job["to_email"]: job["status"] for job in await db.email_outbox.find({}, {"_id": 0}).to_list(None)}
+
+    statuses = asyncio.run(scenario())
+    assert statuses == {"user0@example.com": "sent", "user1@example.com": "dead"}
+    assert sorted(recorded) == [
+        ("user0@example.com", "sent", "", "id-0"),
+        ("user1@example.com", "failed", "Invalid `to` field", None)
+    ]
@@ -0,0 +1,110 @@
+import asyncio
+
+import httpx
+import pytest
+
+from server import ResendClient, ResendError
+
+
+def make_client(handler, max_retries=2):
+    """ResendClient whose requests go to `handler` instead of the network"""
+    client = ResendClient("https://resend.test", timeout_seconds=5, max_retries=max_retries)
+    client._client = httpx.AsyncClient(base_url=client.base_url, transport=httpx.MockTransport(handler))
+    # Retry immediately
+    client._get_retry_delay = lambda attempt, response: 0
+    return client
+
+
+def test_retries_with_the_same_idempotency_key():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        if len(requests) == 1:
+            raise httpx.ConnectError("connection refused", request=request)
+        if len(requests) == 2:
+            return httpx.Response(503, json={"message": "unavailable"})
+        return httpx.Response(200, json={"id": "email-1"})
+
+    client = make_client(handler)
+    result = asyncio.run(client.send_email("key", {"to": ["a@example.com"]}, idempotency_key="svc:t:a@example.com"))
+
+    assert result == {"id": "email-1"}
+    assert len(requests) == 3
+    assert {request.headers["Idempotency-Key"] for request in requests} == {"svc:t:a@example.com"}
+    assert requests[0].headers["Authorization"] == "Bearer key"
+
+
+def test_generated_idempotency_key_is_reused_across_retries():
+    keys = []
+
+    def handler(request):
+        keys.append(request.headers["Idempotency-Key"])
+        if len(keys) == 1:
+            return httpx.Response(502, text="Bad Gateway")
+        return httpx.Response(200, json={"id": "email-1"})
+
+    asyncio.run(make_client(handler).send_email("key", {}))
+
+    assert len(keys) == 2
+    assert keys[0] == keys[1]
+
+
+def test_gives_up_after_max_retries():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(500, json={"message": "boom"}, headers={"retry-after": "7"})
+
+    with pytest.raises(ResendError) as excinfo:
+        asyncio.run(make_client(handler, max_retries=2).send_email("key", {}))
+
+    assert len(calls) == 3
+    assert excinfo.value.status_code == 500
+    assert excinfo.value.retry_after == 7
+
+
+def test_throttling_is_raised_to_the_rate_limiter():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(429, json={"message": "slow down"}, headers={"retry-after": "4"})
+
+    with pytest.raises(ResendError) as excinfo:
+        asyncio.run(make_client(handler).send_email("key", {}))
+
+    assert len(calls) == 1
+    assert excinfo.value.status_code == 429
+    assert excinfo.value.retry_after == 4
+
+
+def test_client_errors_are_not_retried():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(422, json={"message": "Invalid `to` field"})
+
+    with pytest.raises(ResendError) as excinfo:
+        asyncio.run(make_client(handler).send_email("key", {}))
+
+    assert len(calls) == 1
+    assert excinfo.value.message == "Invalid `to` field"
+
+
+def test_missing_api_key_raises_without_a_request():
+    def handler(request):
+        raise AssertionError("no request expected")
+
+    with pytest.raises(ValueError):
+        asyncio.run(make_client(handler).send_email("", {}))
+
+
+def test_retry_delay_honours_retry_after():
+    client = ResendClient("https://resend.test", timeout_seconds=5, max_retries=2)
+
+    assert client._get_retry_delay(0, httpx.Response(503, headers={"retry-after": "3"})) == 3
+    assert client._get_retry_delay(0, httpx.Response(503, headers={"retry-after": "600"})) == ResendClient.MAX_RETRY_AFTER_SECONDS
+    assert client._get_retry_delay(2, None) == 2
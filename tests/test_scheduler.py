@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.schedulers.base import STATE_PAUSED, STATE_RUNNING
+from apscheduler.triggers.cron import CronTrigger
+
+import server
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    scheduler = AsyncIOScheduler(jobstores={"default": MemoryJobStore()})
+    monkeypatch.setattr(server, "scheduler", scheduler)
+    return scheduler
+
+
+def run_started(scheduler, fn):
+    async def scenario():
+        scheduler.start(paused=True)
+        try:
+            return fn()
+        finally:
+            scheduler.shutdown(wait=False)
+
+    return asyncio.run(scenario())
+
+
+def test_unchanged_job_keeps_its_next_run_time(scheduler):
+    def scenario():
+        first = server.ensure_scheduled_job(server.expiry_check_job, CronTrigger(hour=9), "daily_expiry_check")
+        next_run_time = first.next_run_time
+        second = server.ensure_scheduled_job(server.expiry_check_job, CronTrigger(hour=9), "daily_expiry_check")
+        return next_run_time, second.next_run_time
+
+    before, after = run_started(scheduler, scenario)
+    assert after == before
+
+
+def test_changed_trigger_replaces_the_job(scheduler):
+    def scenario():
+        server.ensure_scheduled_job(server.expiry_check_job, CronTrigger(hour=9), "daily_expiry_check")
+        server.ensure_scheduled_job(server.expiry_check_job, CronTrigger(hour=17), "daily_expiry_check")
+        return scheduler.get_jobs()
+
+    jobs = run_started(scheduler, scenario)
+    assert len(jobs) == 1
+    assert "hour='17'" in str(jobs[0].trigger)
+
+
+def test_standby_pauses_the_scheduler(scheduler):
+    def scenario():
+        server.on_scheduler_leadership_change(True)
+        leader = scheduler.state
+        server.on_scheduler_leadership_change(False)
+        return leader, scheduler.state
+
+    leader, standby = run_started(scheduler, scenario)
+    assert leader == STATE_RUNNING
+    assert standby == STATE_PAUSED
@@ -0,0 +1,88 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from server import PooledSMTPConnection, SMTPConnectionPool
+
+
+class HangingSMTP:
+    """SMTP session whose server never answers the message"""
+
+    is_connected = True
+
+    def __init__(self):
+        self.closed = False
+
+    async def send_message(self, message):
+        await asyncio.sleep(3600)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def short_timeout(monkeypatch):
+    monkeypatch.setattr(server, "EMAIL_SEND_TIMEOUT_SECONDS", 0.05)
+
+
+def test_send_returns_within_the_deadline():
+    async def send():
+        return "sent"
+
+    assert asyncio.run(server.send_with_deadline("smtp", send)) == "sent"
+
+
+def test_hung_send_times_out():
+    async def send():
+        await asyncio.sleep(3600)
+
+    with pytest.raises(TimeoutError, match="smtp timed out after 0.05s"):
+        asyncio.run(server.send_with_deadline("smtp", send))
+
+
+def test_timed_out_session_is_not_returned_to_the_pool():
+    pool = SMTPConnectionPool(max_idle=4, idle_seconds=60, max_messages=100)
+    smtp = HangingSMTP()
+
+    async def connect(key):
+        return PooledSMTPConnection(smtp)
+
+    pool._connect = connect
+
+    async def scenario():
+        await server.send_with_deadline("smtp", lambda: pool.send(None, "smtp.test", 587, "u", "p", True))
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(scenario())
+
+    assert smtp.closed
+    assert pool.snapshot()["idle"] == 0
+    assert pool.discarded == 1
+
+
+def test_services_past_the_run_deadline_are_left_for_the_next_run(db, monkeypatch):
+    processed = []
+
+    async def process_due_service(service, now):
+        processed.append(service["id"])
+        # The first service uses up the whole run
+        await asyncio.sleep(0.06)
+
+    async def flush_write_buffers():
+        pass
+
+    monkeypatch.setattr(server, "process_due_service", process_due_service)
+    monkeypatch.setattr(server, "flush_write_buffers", flush_write_buffers)
+    monkeypatch.setattr(server, "NOTIFICATION_MAX_CONCURRENCY", 1)
+    monkeypatch.setattr(server, "EXPIRY_CHECK_DEADLINE_SECONDS", 0.05)
+    due = datetime.now(timezone.utc) - timedelta(hours=1)
+    asyncio.run(db.services.insert_many([
+        {"id": f"svc-{i}", "status": "active", "next_notification_at": due} for i in range(3)
+    ]))
+
+    counts = asyncio.run(server.check_expiring_services())
+
+    assert processed == ["svc-0"]
+    assert counts["deferred_services"] == 2
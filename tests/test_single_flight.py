@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from server import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    executions = []
+
+    async def load():
+        executions.append(1)
+        await asyncio.sleep(0.01)
+        return {"total": 3}
+
+    async def scenario():
+        return await asyncio.gather(*(flight.do("services", "page=1", load) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == [{"total": 3}] * 5
+    assert len(executions) == 1
+    assert flight.snapshot() == {
+        "in_flight": 0,
+        "routes": {"services": {"calls": 5, "executions": 1, "coalesced": 4}}
+    }
+
+
+def test_different_params_are_not_shared():
+    flight = SingleFlight()
+
+    async def scenario():
+        return await asyncio.gather(
+            flight.do("services", "page=1", lambda: asyncio.sleep(0.01, result=1)),
+            flight.do("services", "page=2", lambda: asyncio.sleep(0.01, result=2))
+        )
+
+    assert asyncio.run(scenario()) == [1, 2]
+    assert flight.snapshot()["routes"]["services"]["executions"] == 2
+
+
+def test_later_calls_run_again():
+    flight = SingleFlight()
+    results = iter([1, 2])
+
+    async def load():
+        return next(results)
+
+    async def scenario():
+        return await flight.do("stats", "", load), await flight.do("stats", "", load)
+
+    assert asyncio.run(scenario()) == (1, 2)
+
+
+def test_errors_reach_every_waiting_caller():
+    flight = SingleFlight()
+
+    async def load():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("database unavailable")
+
+    async def scenario():
+        return await asyncio.gather(*(flight.do("stats", "", load) for _ in range(3)), return_exceptions=True)
+
+    errors = asyncio.run(scenario())
+    assert [str(error) for error in errors] == ["database unavailable"] * 3
+    assert flight.snapshot()["in_flight"] == 0
+
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    flight = SingleFlight()
+
+    async def load():
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def scenario():
+        first = asyncio.ensure_future(flight.do("stats", "", load))
+        second = asyncio.ensure_future(flight.do("stats", "", load))
+        await asyncio.sleep(0.005)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(scenario()) == "done"
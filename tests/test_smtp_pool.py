@@ -0,0 +1,194 @@
+import asyncio
+
+import aiosmtplib
+import pytest
+
+import server
+from server import PooledSMTPConnection, SMTPConnectionPool
+
+
+class FakeSMTP:
+    """Connected SMTP session; `errors` are raised by the next send_message calls"""
+
+    def __init__(self, errors=()):
+        self.is_connected = True
+        self.errors = list(errors)
+        self.sent = []
+        self.resets = 0
+        self.noops = 0
+        self.closed = False
+
+    async def send_message(self, message):
+        await asyncio.sleep(0)
+        if self.errors:
+            error = self.errors.pop(0)
+            if isinstance(error, aiosmtplib.SMTPServerDisconnected):
+                self.is_connected = False
+            raise error
+        self.sent.append(message)
+        return ({}, "OK")
+
+    async def rset(self):
+        self.resets += 1
+
+    async def noop(self):
+        self.noops += 1
+
+    async def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+        self.is_connected = False
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(server.time, "monotonic", lambda: now[0])
+    return now
+
+
+def make_pool(sessions, max_idle=2, max_messages=100):
+    """Pool whose new connections are taken from `sessions`"""
+    pool = SMTPConnectionPool(max_idle=max_idle, idle_seconds=60, max_messages=max_messages)
+
+    async def connect(key):
+        pool.opened += 1
+        return PooledSMTPConnection(sessions.pop(0))
+
+    pool._connect = connect
+    return pool
+
+
+def send(pool, message="message", host="smtp.test", username="alerts"):
+    return pool.send(message, host, 587, username, "secret", True)
+
+
+def test_session_is_reused_for_the_same_config(clock):
+    session = FakeSMTP()
+    pool = make_pool([session, FakeSMTP()])
+
+    async def scenario():
+        for i in range(3):
+            await send(pool, f"message {i}")
+
+    asyncio.run(scenario())
+
+    assert session.sent == ["message 0", "message 1", "message 2"]
+    assert (pool.opened, pool.reused) == (1, 2)
+
+
+def test_configs_get_separate_sessions(clock):
+    first, second = FakeSMTP(), FakeSMTP()
+    pool = make_pool([first, second])
+
+    async def scenario():
+        await send(pool, username="alerts")
+        await send(pool, username="billing")
+
+    asyncio.run(scenario())
+
+    assert (len(first.sent), len(second.sent)) == (1, 1)
+    assert pool.snapshot()["idle"] == 2
+
+
+def test_idle_sessions_are_evicted(clock):
+    stale, fresh = FakeSMTP(), FakeSMTP()
+    pool = make_pool([stale, fresh])
+
+    async def scenario():
+        await send(pool)
+        clock[0] += 61
+        await send(pool)
+
+    asyncio.run(scenario())
+
+    assert stale.closed
+    assert fresh.sent == ["message"]
+    assert pool.discarded == 1
+
+
+def test_quiet_sessions_are_checked_before_reuse(clock):
+    session = FakeSMTP()
+    pool = make_pool([session])
+
+    async def scenario():
+        await send(pool)
+        await send(pool)
+        clock[0] += server.SMTP_POOL_HEALTHCHECK_SECONDS + 1
+        await send(pool)
+
+    asyncio.run(scenario())
+
+    assert session.noops == 1
+    assert len(session.sent) == 3
+
+
+def test_sessions_are_retired_after_max_messages(clock):
+    first, second = FakeSMTP(), FakeSMTP()
+    pool = make_pool([first, second], max_messages=2)
+
+    async def scenario():
+        for _ in range(3):
+            await send(pool)
+
+    asyncio.run(scenario())
+
+    assert (len(first.sent), len(second.sent)) == (2, 1)
+    assert first.closed
+
+
+def test_at_most_max_idle_sessions_are_kept(clock):
+    sessions = [FakeSMTP() for _ in range(3)]
+    pool = make_pool(list(sessions), max_idle=2)
+
+    async def scenario():
+        # Three concurrent sends need three sessions
+        await asyncio.gather(*(send(pool) for _ in range(3)))
+
+    asyncio.run(scenario())
+
+    assert pool.snapshot()["idle"] == 2
+    assert sum(session.closed for session in sessions) == 1
+
+
+def test_dropped_session_is_replaced_and_the_message_retried(clock):
+    dropped, fresh = FakeSMTP([aiosmtplib.SMTPServerDisconnected("gone")]), FakeSMTP()
+    pool = make_pool([dropped, fresh])
+
+    asyncio.run(send(pool))
+
+    assert fresh.sent == ["message"]
+    assert pool.reconnects == 1
+
+
+def test_refused_message_keeps_the_session(clock):
+    refused = aiosmtplib.SMTPRecipientsRefused([aiosmtplib.SMTPRecipientRefused(550, "unknown user", "x@example.com")])
+    session = FakeSMTP([refused])
+    pool = make_pool([session])
+
+    async def scenario():
+        with pytest.raises(aiosmtplib.SMTPRecipientsRefused):
+            await send(pool)
+        await send(pool)
+
+    asyncio.run(scenario())
+
+    assert session.resets == 1
+    assert session.sent == ["message"]
+    assert pool.opened == 1
+
+
+def test_close_all_quits_idle_sessions(clock):
+    session = FakeSMTP()
+    pool = make_pool([session])
+
+    async def scenario():
+        await send(pool)
+        await pool.close_all()
+
+    asyncio.run(scenario())
+
+    assert session.closed
+    assert pool.snapshot()["idle"] == 0
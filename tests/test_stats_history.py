@@ -0,0 +1,56 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+USER = {"id": "u1", "role": "admin"}
+
+
+def trends(from_date=None, to_date=None):
+    return asyncio.run(server.get_dashboard_trends(from_date=from_date, to_date=to_date, current_user=USER))
+
+
+def test_daily_refresh_records_one_snapshot_per_day(db):
+    asyncio.run(db.services.insert_many([
+        {"id": "a", "status": "active", "expiry_date": (datetime.now(timezone.utc) + timedelta(days=5)).isoformat(),
+         "category_name": "Cloud", "cost": 4},
+        {"id": "b", "status": "active", "expiry_date": (datetime.now(timezone.utc) - timedelta(days=5)).isoformat(),
+         "category_name": "Cloud", "cost": 6}
+    ]))
+
+    asyncio.run(server.run_daily_stats_refresh())
+    asyncio.run(db.services.delete_many({}))
+    asyncio.run(server.run_daily_stats_refresh())
+
+    snapshots = trends()["snapshots"]
+    assert len(snapshots) == 1
+    assert snapshots[0]["day"] == datetime.now(timezone.utc).date().isoformat()
+    assert snapshots[0]["total"] == 2
+    assert snapshots[0]["categories"] == [{"name": "Cloud", "count": 2, "cost": 10, "expired": 1, "expiring_soon": 1}]
+
+
+def test_trends_are_read_in_date_order_within_the_range(db):
+    stats = {"total": 1, "expired": 0, "expiring_soon": 0, "safe": 1, "total_cost": 0}
+    for day in (12, 10, 11, 14):
+        asyncio.run(server.record_daily_stats_snapshot(stats, {}, datetime(2026, 3, day, 6, tzinfo=timezone.utc)))
+
+    result = trends("2026-03-10", "2026-03-12")
+
+    assert result["from"] == "2026-03-10"
+    assert result["to"] == "2026-03-12"
+    assert [s["day"] for s in result["snapshots"]] == ["2026-03-10", "2026-03-11", "2026-03-12"]
+
+
+@pytest.mark.parametrize("from_date,to_date", [
+    ("2026-03-12", "2026-03-10"),
+    ("2024-01-01", "2026-03-10"),
+    ("03/10/2026", None)
+])
+def test_invalid_ranges_are_rejected(db, from_date, to_date):
+    with pytest.raises(HTTPException) as excinfo:
+        trends(from_date, to_date)
+
+    assert excinfo.value.status_code == 400
@@ -0,0 +1,101 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from server import BulkWriter
+
+THRESHOLDS = [
+    {"id": "t30", "label": "One month", "days_before": 30},
+    {"id": "t7", "label": "One week", "days_before": 7}
+]
+
+
+@pytest.fixture(autouse=True)
+def writers(db, monkeypatch):
+    monkeypatch.setattr(server, "service_state_writer", BulkWriter("services", 100, 60, ordered=True))
+    monkeypatch.setattr(server, "notification_log_writer", BulkWriter("notification_logs", 100, 60))
+    monkeypatch.setattr(server, "email_log_writer", BulkWriter("email_logs", 100, 60))
+    asyncio.run(db.email_outbox.create_index([("idempotency_key", 1)], unique=True))
+
+
+def make_service(days=20, **fields):
+    return {
+        "id": "svc",
+        "name": "CRM",
+        "status": "active",
+        "expiry_date": (datetime.now(timezone.utc) + timedelta(days=days, hours=1)).isoformat(),
+        "updated_at": "2026-10-01T00:00:00+00:00",
+        "reminder_thresholds": THRESHOLDS,
+        "owners": [{"email": "ana@example.com", "name": "Ana"}],
+        "notifications_sent": [],
+        **fields
+    }
+
+
+def stored(db):
+    return asyncio.run(db.services.find_one({"id": "svc"}, {"_id": 0}))
+
+
+def run(*marks):
+    async def scenario():
+        for service, threshold_id in marks:
+            await server.mark_threshold_sent(service, threshold_id)
+        await server.service_state_writer.close()
+
+    asyncio.run(scenario())
+
+
+def test_marking_records_the_threshold_and_reschedules(db):
+    service = make_service()
+    asyncio.run(db.services.insert_one(dict(service)))
+
+    run((dict(service), "t30"))
+
+    doc = stored(db)
+    expected = server.compute_next_notification_at({**service, "notifications_sent": ["t30"]}).replace(tzinfo=None)
+    assert doc["notifications_sent"] == ["t30"]
+    # MongoDB stores milliseconds
+    assert abs(doc["next_notification_at"] - expected) < timedelta(milliseconds=1)
+
+
+def test_overlapping_runs_keep_each_others_thresholds(db):
+    service = make_service(days=5)
+    asyncio.run(db.services.insert_one(dict(service)))
+
+    # Two runs scanned the same copy of the service
+    run((dict(service), "t30"), (dict(service), "t7"), (dict(service), "t30"))
+
+    assert sorted(stored(db)["notifications_sent"]) == ["t30", "t7"]
+
+
+def test_edited_service_is_not_overwritten(db):
+    scanned = make_service()
+    asyncio.run(db.services.insert_one({**scanned, "updated_at": "2026-10-02T00:00:00+00:00", "next_notification_at": None}))
+
+    run((dict(scanned), "t30"))
+
+    doc = stored(db)
+    assert doc["notifications_sent"] == []
+    assert doc["next_notification_at"] is None
+
+
+def test_due_service_is_queued_once(db):
+    service = make_service()
+    asyncio.run(db.services.insert_one(dict(service)))
+
+    async def scenario():
+        now = datetime.now(timezone.utc)
+        # A second scan of the same copy, e.g. before the first one's bookkeeping was flushed
+        first = await server.process_due_service(dict(service), now)
+        second = await server.process_due_service(dict(service), now)
+        for writer in (server.service_state_writer, server.notification_log_writer):
+            await writer.close()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first["status"] == "queued"
+    assert second["status"] == "duplicate"
+    assert asyncio.run(db.email_outbox.count_documents({})) == 1
+    assert stored(db)["notifications_sent"] == ["t30"]
@@ -0,0 +1,60 @@
+import asyncio
+import os
+import signal
+
+import pytest
+
+import server
+import worker
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+
+    def record(name):
+        async def call():
+            calls.append(name)
+        return call
+
+    for module in (server, worker):
+        for name in ("ensure_indexes", "backfill_next_notification_at", "start_background_services", "stop_background_services"):
+            monkeypatch.setattr(module, name, record(name))
+    return calls
+
+
+@pytest.mark.skipif("RUN_BACKGROUND_JOBS" in os.environ, reason="uses the default setting")
+def test_api_does_not_run_background_jobs_by_default():
+    assert not server.RUN_BACKGROUND_JOBS
+
+
+@pytest.mark.parametrize("enabled,expected", [
+    (False, ["ensure_indexes", "backfill_next_notification_at"]),
+    (True, ["ensure_indexes", "backfill_next_notification_at", "start_background_services"])
+])
+def test_api_startup(calls, monkeypatch, enabled, expected):
+    monkeypatch.setattr(server, "RUN_BACKGROUND_JOBS", enabled)
+
+    asyncio.run(server.startup_event())
+
+    assert calls == expected
+
+
+def test_worker_runs_background_jobs_until_terminated(calls, monkeypatch):
+    class Client:
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    client = Client()
+    monkeypatch.setattr(worker, "client", client)
+
+    async def scenario():
+        asyncio.get_running_loop().call_later(0.05, os.kill, os.getpid(), signal.SIGTERM)
+        await asyncio.wait_for(worker.main(), timeout=5)
+
+    asyncio.run(scenario())
+
+    assert calls == ["ensure_indexes", "backfill_next_notification_at", "start_background_services", "stop_background_services"]
+    assert client.closed